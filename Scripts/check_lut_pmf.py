@@ -0,0 +1,57 @@
+from argparse import Namespace
+from chemical_analysis._mobile import ANALYTE_PIPELINES
+from chemical_analysis._utils import PMF_PROJECTION_KINDS, PmfProjection, _project_to_bins, bgr_to_lab
+from typing import Final, List
+import argparse, os, sys
+import cv2
+import numpy as np
+
+
+# Default values for the check.
+DEFAULT_IMAGE_SIZE: Final[List[int]] = [1000, 1000]
+DEFAULT_NUM_IMAGES: Final[int] = 4
+DEFAULT_SEED: Final[int] = 0
+
+
+# The main method.
+def main(args: Namespace) -> int:
+    rng = np.random.default_rng(args.seed)
+    num_mismatches = 0
+    for analyte in args.analytes:
+        pipeline = ANALYTE_PIPELINES[analyte]
+        if pipeline.pca_stats is None:
+            continue
+        if not os.path.isfile(pipeline.pca_stats):
+            print(f'{analyte}: PCA statistics "{pipeline.pca_stats}" not found, skipped')
+            continue
+        with np.load(pipeline.pca_stats) as stored:
+            lab_mean, lab_sorted_eigenvectors = stored["lab_mean"], stored["lab_sorted_eigenvectors"]
+        for kind in sorted(PMF_PROJECTION_KINDS):
+            projection = PmfProjection(kind, lab_mean, lab_sorted_eigenvectors)
+            mismatches, total = 0, 0
+            for _ in range(args.num_images):
+                # Random colors and reference whites, as the lookup table of the 8-bit path must give the bins of bgr_to_lab images for any of them.
+                bgr_img = rng.integers(0, 256, (*args.image_size, 3), dtype=np.uint8)
+                lab_white = (np.asarray([100.0, 0.0, 0.0]) + rng.normal(0.0, [10.0, 5.0, 5.0])).astype(np.float32)
+                lut_ind = _project_to_bins(cv2.cvtColor(bgr_img, cv2.COLOR_BGR2LAB).reshape(-1, 3), lab_white, projection)
+                float_ind = _project_to_bins(bgr_to_lab(bgr_img).reshape(-1, 3), lab_white, projection)
+                different = lut_ind != float_ind
+                mismatches += int((different if different.ndim == 1 else different.any(axis=1)).sum())
+                total += len(lut_ind)
+            print(f'{analyte}: {kind:>9s}, {mismatches} of {total} pixels in different bins')
+            num_mismatches += mismatches
+    return 0 if num_mismatches == 0 else 1
+
+
+# Call the main method.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that PMFs computed from 8-bit L*a*b* (AnalysisFacade(lut_pmf=True)) put every pixel in the same bin as the float path, using the PCA statistics shipped with the analytes.")
+    group = parser.add_argument_group("check arguments")
+    group.add_argument("--analytes", metavar="NAME", nargs="+", choices=sorted(ANALYTE_PIPELINES.keys()), default=sorted(ANALYTE_PIPELINES.keys()), help="the analytes whose PCA statistics are checked")
+    group.add_argument("--image_size", metavar="SIZE", type=int, nargs=2, default=DEFAULT_IMAGE_SIZE, help="the height and width of the random images")
+    group.add_argument("--num_images", metavar="COUNT", type=int, default=DEFAULT_NUM_IMAGES, help="the number of random images for each analyte and projection")
+    group.add_argument("--seed", metavar="VALUE", type=int, default=DEFAULT_SEED, help="the seed of the random images")
+    # Parse arguments.
+    args = parser.parse_args()
+    # Call the main procedure.
+    sys.exit(main(args))
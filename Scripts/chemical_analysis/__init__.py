@@ -1,11 +1,14 @@
 from . import alkalinity, chloride, phosphate, sulfate, iron2, iron3, iron_oxid,  bisulfite2d, ph, redox, typing
 from ._default import WHITEBALANCE_STATS
-from ._mobile import AnalysisFacade
+from ._export import EXPORT_FORMATS, ExportedNetwork, export_network, load_exported_network
+from ._mobile import AnalysisFacade, EstimationPipeline
 from ._model import ContinuousNetwork, EstimationFunction, IntervalNetwork, Network, UpNetwork, ContinuousUpNetwork
-from ._utils import bgr_to_lab, compute_calibrated_pmf, compute_theoretical_value, correct_predicted_value, correct_theoretical_value, estimate_confidence_in_whitebalance, lab_to_bgr, lab_to_normalized, lab_to_rgb, rgb_to_lab, whitebalance, write_whitebalance_stats
+from ._utils import PIXEL_SAMPLING_METHODS, PMF_PROJECTION_KINDS, PixelSampling, PmfProjection, PotCircle, WhitebalanceStatsAccumulator, bgr_to_lab, compute_blank_spectrum, compute_calibrated_pmf, compute_calibrated_pmfs, compute_projected_pmf, compute_projected_pmfs, compute_roi_calibrated_pmf, compute_theoretical_value, correct_predicted_value, correct_theoretical_value, estimate_confidence_in_whitebalance, find_pot_circle, lab_to_bgr, lab_to_normalized, lab_to_rgb, merge_whitebalance_stats, opencv_lab_to_lab, read_reduced_bgr_image, rgb_to_lab, sample_analyte_mask, whitebalance, write_whitebalance_stats
 
 import os
 if not any(map(lambda name: name.startswith("ANDROID_"), os.environ)):
     from . import sweep
     import dist2dist
-    from ._dataset import ExpandedSampleDataset, ProcessedSampleDataset, SampleDataset, SizedDataset
+    from ._cache import CacheBackend, NpzCacheBackend, PackedCacheBackend
+    from ._dataset import ExpandedSampleDataset, ProcessedSample, ProcessedSampleDataset, SampleDataset, SizedDataset, calibrate_processed_samples
+    from ._table import SampleTable
@@ -0,0 +1,232 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from enum import Enum
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Dict, Final, Hashable, Mapping, Optional, Tuple, Type
+import hashlib, json, os
+import numpy as np
+
+
+DEFAULT_MEMORY_CACHE_BYTES: Final[int] = 256 * 1024 ** 2
+
+
+DIGEST_SIZE: Final[int] = 8  # In bytes, so digests have 16 hexadecimal characters.
+
+
+PACK_ALIGNMENT: Final[int] = 64
+PACK_EXT: Final[str] = ".pack"
+PACK_INDEX_EXT: Final[str] = ".pack.index"  # The JSON index of the arrays stored in the container, next to it.
+PACK_INDEX_VERSION: Final[int] = 2
+
+
+def digest_file(path: str) -> str:
+    # The digest of a file is computed only once while its modification time and size do not change.
+    stat = os.stat(path)
+    return _digest_file(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=65536)
+def _digest_file(path: str, mtime_ns: int, size: int) -> str:
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 ** 2), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def digest_params(*params: Any) -> str:
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    def update(value: Any) -> None:
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            hasher.update(f'ndarray({value.dtype.str}, {value.shape})'.encode("utf-8"))
+            hasher.update(value.tobytes())
+        elif isinstance(value, (tuple, list)):
+            hasher.update(b"(")
+            for item in value:
+                update(item)
+            hasher.update(b")")
+        elif isinstance(value, dict):
+            update(sorted(value.items()))
+        elif isinstance(value, Enum):
+            hasher.update(f'{type(value).__qualname__}.{value.name}'.encode("utf-8"))
+        else:
+            hasher.update(f'{type(value).__qualname__}({value!r})'.encode("utf-8"))
+    update(params)
+    return hasher.hexdigest()
+
+
+class CacheBackend(ABC):
+    def __init__(self, root_dir: str) -> None:
+        super().__init__()
+        os.makedirs(root_dir, exist_ok=True)
+        self.root_dir: Final[str] = root_dir
+
+    @abstractmethod
+    def load(self, prefix: str, key: str) -> Optional[Mapping[str, np.ndarray]]:
+        raise NotImplementedError  # To be implemented by the subclass.
+
+    def path(self, prefix: str, key: Optional[str], ext: str) -> str:
+        return os.path.join(self.root_dir, f'{prefix}{f"_{key}" if key is not None else ""}{ext}')
+
+    @abstractmethod
+    def save(self, prefix: str, key: str, *args: np.ndarray, **kwds: np.ndarray) -> None:
+        raise NotImplementedError  # To be implemented by the subclass.
+
+
+class NpzCacheBackend(CacheBackend):
+    def load(self, prefix: str, key: str) -> Optional[Mapping[str, np.ndarray]]:
+        path = self.path(prefix, key, ".npz")
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    def save(self, prefix: str, key: str, *args: np.ndarray, **kwds: np.ndarray) -> None:
+        # Write to a temporary file first, so processes sharing the cache never see a partially written file.
+        path = self.path(prefix, key, ".npz")
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, "wb") as file:
+            np.savez_compressed(file, *args, **kwds)
+        os.replace(tmp_path, path)
+
+
+class PackedCacheBackend(CacheBackend):
+    def __init__(self, root_dir: str) -> None:
+        super().__init__(root_dir)
+        self._indices: Dict[str, Dict[str, Dict[str, Tuple[str, Tuple[int, ...], int]]]] = dict()  # Dict[prefix, Dict[key, Dict[name, Tuple[dtype, shape, offset]]]]
+
+    def _read_index(self, prefix: str) -> Dict[str, Dict[str, Tuple[str, Tuple[int, ...], int]]]:
+        # Read the JSON index of the container. Unreadable indices and entries beyond the end of the container are treated as missing, so their values are
+        # computed and stored again.
+        path = self.path(prefix, None, PACK_EXT)
+        try:
+            with open(self.path(prefix, None, PACK_INDEX_EXT), "rb") as file:
+                raw_index = json.loads(file.read().decode("utf-8"))
+            if raw_index["version"] != PACK_INDEX_VERSION:
+                return dict()
+            index = {key: {name: (dtype, tuple(shape), offset) for name, (dtype, shape, offset) in arrays.items()} for key, arrays in raw_index["entries"].items()}
+            size = os.path.getsize(path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return dict()
+        return {key: arrays for key, arrays in index.items() if all(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize <= size for dtype, shape, offset in arrays.values())}
+
+    def load(self, prefix: str, key: str) -> Optional[Mapping[str, np.ndarray]]:
+        path = self.path(prefix, None, PACK_EXT)
+        index = self._indices.get(prefix, None)
+        if index is None or key not in index:
+            # The container may have been extended by another instance since the last read.
+            index = self._indices[prefix] = self._read_index(prefix)
+            if key not in index:
+                return None
+        # Map the arrays without copying them. Writes to the arrays are kept in memory and never reach the file.
+        data: Dict[str, np.ndarray] = dict()
+        try:
+            for name, (dtype, shape, offset) in index[key].items():
+                if int(np.prod(shape)) == 0:
+                    data[name] = np.empty(shape, dtype=np.dtype(dtype))
+                else:
+                    data[name] = np.memmap(path, dtype=np.dtype(dtype), mode="c", offset=offset, shape=shape)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def save(self, prefix: str, key: str, *args: np.ndarray, **kwds: np.ndarray) -> None:
+        # The arrays are appended to the container, which is never truncated, and then the index is replaced through a temporary file. If the process dies
+        # in between, the previous index is still valid and the appended bytes are just unused.
+        path = self.path(prefix, None, PACK_EXT)
+        index_path = self.path(prefix, None, PACK_INDEX_EXT)
+        arrays: Dict[str, Any] = {**{f'arr_{ind}': value for ind, value in enumerate(args)}, **kwds}
+        index = self._read_index(prefix)
+        entry: Dict[str, Tuple[str, Tuple[int, ...], int]] = dict()
+        with open(path, "ab") as file:
+            end = file.seek(0, os.SEEK_END)
+            for name, value in arrays.items():
+                value = np.ascontiguousarray(value)
+                offset = -(-end // PACK_ALIGNMENT) * PACK_ALIGNMENT
+                file.write(bytes(offset - end))
+                file.write(value.tobytes())
+                entry[name] = (value.dtype.str, tuple(value.shape), offset)
+                end = offset + value.nbytes
+        index[key] = entry
+        tmp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, "wb") as file:
+            file.write(json.dumps({"version": PACK_INDEX_VERSION, "entries": index}).encode("utf-8"))
+        os.replace(tmp_path, index_path)
+        self._indices[prefix] = index
+
+
+class MemoryCache:
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_CACHE_BYTES, max_entries: Optional[int] = None) -> None:
+        super().__init__()
+        self.max_bytes: Final[int] = max_bytes
+        self.max_entries: Final[Optional[int]] = max_entries  # Bounds caches of small values, whose size doesn't count.
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()  # OrderedDict[key, Tuple[value, nbytes]], from the least to the most recently used.
+        self._lock = Lock()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(MemoryCache._sizeof(item) for item in value)
+        return 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        nbytes = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            # Values larger than the whole budget are never kept.
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            # Evict the least recently used entries until the budget is respected.
+            while self._nbytes > self.max_bytes or (self.max_entries is not None and len(self._entries) > self.max_entries):
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "nbytes": self._nbytes, "max_bytes": self.max_bytes}
+            if self.max_entries is not None:
+                stats["max_entries"] = self.max_entries
+            return stats
+
+
+CACHE_BACKENDS: Final[Dict[str, Type[CacheBackend]]] = {
+    "npz": NpzCacheBackend,
+    "packed": PackedCacheBackend,
+}
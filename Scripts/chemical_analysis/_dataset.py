@@ -1,12 +1,15 @@
-from ._utils import bgr_to_lab, compute_calibrated_pmf, compute_theoretical_value, correct_theoretical_value
+from ._cache import CACHE_BACKENDS, DEFAULT_MEMORY_CACHE_BYTES, CacheBackend, MemoryCache, digest_file, digest_params
+from ._table import SampleTable
+from ._utils import PixelSampling, PotCircle, bgr_to_lab, compute_blank_spectrum, compute_calibrated_pmfs, compute_roi_calibrated_pmf, compute_theoretical_value, correct_theoretical_value, find_pot_circle, full_resolution_placeholder, opencv_lab_to_lab, read_image_shape, read_reduced_bgr_image, sample_analyte_mask, worker_pool
 from .typing import App, AuxiliarySolution, AuxiliarySolutionComponent, ChamberType, Device, Sample, SolutionComponent, Stock, StockAliquot
 from tqdm import tqdm
 from abc import abstractmethod
 from collections.abc import Sized
 from datetime import datetime
+from tempfile import TemporaryDirectory
 from torch.utils.data import Dataset
-from typing import Any, Callable, Dict, Final, Iterable, List, Optional, Tuple,  TypeVar, Union
-import copy, json, os, shutil, warnings
+from typing import Any, Callable, Dict, Final, Iterable, List, NamedTuple, Optional, Sequence, Tuple,  TypeVar, Union
+import json, os, pickle, random, shutil, warnings
 import cv2
 import numpy as np
 
@@ -77,36 +80,73 @@ UNITS: Final[Dict[str, str]] = {
 DEFAULT_TRANSFORM: Callable[..., Dict[str, Any]] = None
 
 
+MANIFEST_FILENAME: Final[str] = ".{name}-manifest.pickle"
+MANIFEST_VERSION: Final[int] = 2
+
+
+CHUNKSIZE: Final[int] = 32
+
+
+CALIBRATION_BATCH_SIZE: Final[int] = 64  # Maximum number of samples calibrated by one batched FFT.
+
+
+class ManifestEntry(NamedTuple):
+    signature: Tuple[int, int]  # (mtime_ns, size) of the JSON file.
+    sample: Sample
+    messages: List[str]  # Warnings produced while parsing the record.
+    image_files: Tuple[Tuple[str, bool], ...]  # The image files referenced by the record, and whether they existed when it was parsed.
+
+
 T_co = TypeVar('T_co', covariant=True)
 
 
+def _scan_dir(dirname: str) -> Tuple[List[Tuple[str, Tuple[int, int]]], List[str]]:
+    # List the JSON records, with their (mtime_ns, size) signatures, and the subfolders of the given folder in alphabetical order.
+    files: List[Tuple[str, Tuple[int, int]]] = list()
+    subdirs: List[str] = list()
+    with os.scandir(dirname) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        path = os.path.join(dirname, entry.name)
+        if entry.is_file() and entry.name.lower().endswith(".json"):
+            stat = entry.stat()
+            files.append((path, (stat.st_mtime_ns, stat.st_size)))
+        elif entry.is_dir():
+            subdirs.append(path)
+    return files, subdirs
+
+
+def _transform_digest(transform: Callable[..., Dict[str, Any]]) -> str:
+    # Albumentations-like transforms serialize their configuration. Other callables are identified by their representation.
+    to_dict = getattr(transform, "to_dict", None)
+    return digest_params(json.dumps(to_dict(), sort_keys=True, default=repr) if callable(to_dict) else repr(transform))
+
+
+def _image_files_unchanged(image_files: Tuple[Tuple[str, bool], ...]) -> bool:
+    # Check whether the image files referenced by a record still exist, or are still missing, as when it was parsed.
+    return all(os.path.isfile(path) == exists for path, exists in image_files)
+
+
 class SizedDataset(Sized, Dataset[T_co]):
     def __init__(self) -> None:
         super().__init__()
 
 
 class SampleDataset(SizedDataset[Sample]):
-    def __init__(self, base_dirs: Union[str, Iterable[str]], *, progress_bar: bool = True, skip_blank_samples: bool = True, skip_incomplete_samples: bool = True, skip_inference_sample: bool = True, skip_training_sample: bool = False, verbose: bool = True) -> None:
+    def __init__(self, base_dirs: Union[str, Iterable[str]], *, progress_bar: bool = True, skip_blank_samples: bool = True, skip_incomplete_samples: bool = True, skip_inference_sample: bool = True, skip_training_sample: bool = False, num_workers: int = 0, use_manifest: bool = True, use_processes: bool = False, verbose: bool = True) -> None:
         super().__init__()
+        # Keep the input arguments.
+        self._base_dirs: List[str] = [base_dirs] if isinstance(base_dirs, str) else list(base_dirs)
+        self._skip_blank_samples = skip_blank_samples
+        self._skip_incomplete_samples = skip_incomplete_samples
+        self._skip_inference_sample = skip_inference_sample
+        self._skip_training_sample = skip_training_sample
+        self._num_workers = num_workers
+        self._use_manifest = use_manifest
+        self._use_processes = use_processes
         # Load the list of samples.
-        all_samples, blanks = self._load_samples(
-            [base_dirs] if isinstance(base_dirs, str) else list(base_dirs),
-            progress_bar=progress_bar,
-            verbose=verbose,
-        )
-        # Try to assign the blank sample and skip incomplete samples, if required to.
-        self._samples: List[Sample] = list()
-        for sample in tqdm(all_samples, desc="Assigning blank samples", leave=False, disable=not progress_bar):
-            if not os.path.isfile(sample["fileName"]) and skip_incomplete_samples:
-                continue
-            if sample["blankFileName"] is not None:
-                if not os.path.isfile(sample["blankFileName"]) and skip_incomplete_samples:
-                    continue
-                sample["blank"] = blanks.get(sample["blankFileName"], None)
-            if (sample["isBlankSample"] and not skip_blank_samples) or (sample["isInferenceSample"] and not skip_inference_sample) or (sample["isTrainingSample"] and not skip_training_sample):
-                self._samples.append(sample)
-        # Sort samples by date.
-        self._samples.sort(key=lambda sample: sample["datetime"])
+        all_samples, blanks = self._load_samples(self._base_dirs, progress_bar=progress_bar, rebuild_manifest=False, verbose=verbose)
+        self._samples: List[Sample] = self._select_samples(all_samples, blanks, progress_bar=progress_bar)
 
     def __getitem__(self, index: int) -> Sample:
         return self._samples[index]
@@ -114,28 +154,107 @@ class SampleDataset(SizedDataset[Sample]):
     def __len__(self) -> int:
         return len(self._samples)
 
-    def _load_samples(self, base_dirs: List[str], *, progress_bar: bool, verbose: bool) -> Tuple[List[Sample], Dict[str, Sample]]:
+    def _load_samples(self, base_dirs: List[str], *, progress_bar: bool, rebuild_manifest: bool, verbose: bool) -> Tuple[List[Sample], Dict[str, Sample]]:
         samples: List[Sample] = list()
         blanks: Dict[str, Sample] = dict()  # Dict[filename, sample]
-        dirs = sorted(base_dirs)
-        with tqdm(desc="Scanning folders", total=len(dirs), leave=False, disable=not progress_bar) as pbar_dirs:
-            while len(dirs) != 0:
-                dirname = dirs.pop(0)
-                for basename in tqdm(sorted(os.listdir(dirname)), desc="Parsing JSONs", leave=False, disable=not progress_bar):
-                    path = os.path.join(dirname, basename)
-                    if os.path.isfile(path) and basename.lower().endswith(".json"):
-                        with open(path, "r", encoding="utf8") as file:
-                            sample = self._parse_sample(json.load(file), record_path=path, verbose=verbose)
-                            samples.append(sample)
-                            if sample["isBlankSample"]:
-                                blanks[sample["fileName"]] = sample
-                    elif os.path.isdir(path):
-                        dirs.append(path)
-                        pbar_dirs.total += 1
-                        pbar_dirs.refresh()
-                pbar_dirs.update(1)
+        # Load the manifests of previously parsed records.
+        sorted_base_dirs = sorted(base_dirs)
+        manifests: Dict[str, Dict[str, ManifestEntry]] = {base_dir: (self._read_manifest(base_dir) if self._use_manifest and not rebuild_manifest else dict()) for base_dir in sorted_base_dirs}
+        records: Dict[str, Dict[str, ManifestEntry]] = {base_dir: dict() for base_dir in sorted_base_dirs}
+        with worker_pool(self._num_workers, use_processes=self._use_processes, chunksize=CHUNKSIZE) as map_func:
+            # Scan folders level by level, so the records are listed in the same order as a sequential breadth-first search.
+            found: List[Tuple[str, str, Tuple[int, int]]] = list()  # List[Tuple[path, base_dir, signature]]
+            dirs = [(dirname, dirname) for dirname in sorted_base_dirs]  # List[Tuple[dirname, base_dir]]
+            with tqdm(desc="Scanning folders", total=len(dirs), leave=False, disable=not progress_bar) as pbar_dirs:
+                while len(dirs) != 0:
+                    next_dirs: List[Tuple[str, str]] = list()
+                    for (_, base_dir), (files, subdirs) in zip(dirs, map_func(_scan_dir, [dirname for dirname, _ in dirs])):
+                        found.extend((path, base_dir, signature) for path, signature in files)
+                        next_dirs.extend((path, base_dir) for path in subdirs)
+                    pbar_dirs.total += len(next_dirs)
+                    pbar_dirs.update(len(dirs))
+                    dirs = next_dirs
+            # Parse the records that are new or were modified since the manifest was written, or whose image files were added or deleted since then.
+            outdated = [path for path, base_dir, signature in found if path not in manifests[base_dir] or manifests[base_dir][path].signature != signature]
+            unmodified = [(path, base_dir) for path, base_dir, signature in found if path in manifests[base_dir] and manifests[base_dir][path].signature == signature]
+            outdated.extend(path for (path, _), unchanged in zip(unmodified, map_func(_image_files_unchanged, [manifests[base_dir][path].image_files for path, base_dir in unmodified])) if not unchanged)
+            parsed = dict(zip(outdated, tqdm(map_func(self._parse_record, outdated), desc="Parsing JSONs", total=len(outdated), leave=False, disable=not progress_bar)))
+        # Collect the samples in scanning order and report the problems found while parsing them.
+        for path, base_dir, signature in found:
+            manifest_entry = ManifestEntry(signature, *parsed[path]) if path in parsed else manifests[base_dir][path]
+            records[base_dir][path] = manifest_entry
+            if verbose:
+                for message in manifest_entry.messages:
+                    warnings.warn(message)
+            sample = manifest_entry.sample
+            samples.append(sample)
+            if sample["isBlankSample"]:
+                blanks[sample["fileName"]] = sample
+        # Write the manifests that changed, i.e., with new, modified, or deleted records.
+        if self._use_manifest:
+            for base_dir in sorted_base_dirs:
+                if rebuild_manifest or records[base_dir].keys() != manifests[base_dir].keys() or any(entry is not manifests[base_dir][path] for path, entry in records[base_dir].items()):
+                    self._write_manifest(base_dir, records[base_dir])
         return samples, blanks
 
+    def _manifest_path(self, base_dir: str) -> str:
+        return os.path.join(base_dir, MANIFEST_FILENAME.format(name=self.__class__.__name__))
+
+    def _parse_record(self, record_path: str) -> Tuple[Sample, List[str], Tuple[Tuple[str, bool], ...]]:
+        messages: List[str] = list()
+        with open(record_path, "r", encoding="utf8") as file:
+            raw_record = json.load(file)
+        sample = self._parse_sample(raw_record, record_path=record_path, messages=messages, verbose=True)
+        # Keep the image files that the parsing depends on, so the record is parsed again if any of them is added or deleted.
+        dirname, _ = os.path.split(record_path)
+        basenames = [raw_record["sample"]["fileName"], *raw_record["sample"].get("extraFileNames", []), raw_record["sample"]["blankFileName"]]
+        image_files = tuple((path, os.path.isfile(path)) for path in (os.path.join(dirname, basename) for basename in basenames if basename is not None))
+        return sample, messages, image_files
+
+    def _read_manifest(self, base_dir: str) -> Dict[str, ManifestEntry]:
+        path = self._manifest_path(base_dir)
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as file:
+                    manifest = pickle.load(file)
+                if manifest["version"] == MANIFEST_VERSION:
+                    return manifest["records"]
+            except Exception as error:
+                warnings.warn(f'The manifest "{path}" is corrupted and will be rebuilt ({error}).')
+        return dict()
+
+    def _select_samples(self, all_samples: List[Sample], blanks: Dict[str, Sample], *, progress_bar: bool) -> List[Sample]:
+        # Try to assign the blank sample and skip incomplete samples, if required to.
+        samples: List[Sample] = list()
+        for sample in tqdm(all_samples, desc="Assigning blank samples", leave=False, disable=not progress_bar):
+            if not os.path.isfile(sample["fileName"]) and self._skip_incomplete_samples:
+                continue
+            if sample["blankFileName"] is not None:
+                if not os.path.isfile(sample["blankFileName"]) and self._skip_incomplete_samples:
+                    continue
+                sample["blank"] = blanks.get(sample["blankFileName"], None)
+            if (sample["isBlankSample"] and not self._skip_blank_samples) or (sample["isInferenceSample"] and not self._skip_inference_sample) or (sample["isTrainingSample"] and not self._skip_training_sample):
+                samples.append(sample)
+        # Sort samples by date.
+        samples.sort(key=lambda sample: sample["datetime"])
+        return samples
+
+    def _write_manifest(self, base_dir: str, records: Dict[str, ManifestEntry]) -> None:
+        path = self._manifest_path(base_dir)
+        try:
+            # Write to a temporary file first, so concurrent readers never see a partially written manifest.
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, "wb") as file:
+                pickle.dump({"version": MANIFEST_VERSION, "records": records}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as error:
+            warnings.warn(f'Can\'t write the manifest "{path}" ({error}).')
+
+    def rebuild_manifest(self, *, progress_bar: bool = True, verbose: bool = True) -> None:
+        # Discard the stored manifests, parse all records again, and reload the samples.
+        all_samples, blanks = self._load_samples(self._base_dirs, progress_bar=progress_bar, rebuild_manifest=True, verbose=verbose)
+        self._samples = self._select_samples(all_samples, blanks, progress_bar=progress_bar)
+
     def _parse_auxiliary_solution(self, type: str, raw_solution: Dict[str, Any]) -> AuxiliarySolution:
         return AuxiliarySolution(
             type=type,
@@ -152,7 +271,13 @@ class SampleDataset(SizedDataset[Sample]):
             batch=raw_component["batch"].strip()
         )
 
-    def _parse_sample(self, raw_record: Dict[str, Any], record_path: str, *, verbose: bool) -> Sample:
+    def _parse_sample(self, raw_record: Dict[str, Any], record_path: str, *, messages: Optional[List[str]] = None, verbose: bool) -> Sample:
+        # Define a local function to report problems (they are kept in the given list of messages, if any).
+        def warn(message: str) -> None:
+            if messages is not None:
+                messages.append(message)
+            elif verbose:
+                warnings.warn(message)
         dirname, _ = os.path.split(record_path)
         # Check the extra image files.
         extra_filenames: List[str] = list()
@@ -161,19 +286,19 @@ class SampleDataset(SizedDataset[Sample]):
             if os.path.isfile(extra_filename):
                 extra_filenames.append(extra_filename)
             else:
-                warnings.warn(f'The extra sample image "{extra_filename}" is missing.') if verbose else None
+                warn(f'The extra sample image "{extra_filename}" is missing.')
         # Check the main image file.
         filename = os.path.join(dirname, raw_record["sample"]["fileName"])
         if not os.path.isfile(filename):
             if len(extra_filenames) > 0:
-                warnings.warn(f'The sample image "{filename}" is missing. It was replaced by one of the extra images.') if verbose else None
+                warn(f'The sample image "{filename}" is missing. It was replaced by one of the extra images.')
                 filename = extra_filenames.pop()
             else:
-                warnings.warn(f'The sample image "{filename}" is missing and could not be replaced by one of the extra images.') if verbose else None
+                warn(f'The sample image "{filename}" is missing and could not be replaced by one of the extra images.')
         # Check the blank image file.
         blank_filename = os.path.join(dirname, raw_record["sample"]["blankFileName"]) if raw_record["sample"]["blankFileName"] is not None else None
         if blank_filename is not None and not os.path.isfile(blank_filename):
-            warnings.warn(f'The blank sample image "{blank_filename}" is missing.') if verbose else None
+            warn(f'The blank sample image "{blank_filename}" is missing.')
         is_blank_sample = blank_filename is None
         # Call methods implemented by the subclass to parse specialized data.
         auxiliary_solutions = self._parse_auxiliary_solutions(raw_record["sample"])
@@ -273,37 +398,45 @@ class SampleDataset(SizedDataset[Sample]):
 class ExpandedSampleDataset(SizedDataset[Sample]):
     def __init__(self, dataset: Dataset[Sample], *, progress_bar: bool = True) -> None:
         super().__init__()
-        # Expand blank samples.
-        expanded_blanks: Dict[int, List[Sample]] = dict()  # Dict[id, List[expanded_blank]]
-        for sample in tqdm(dataset, desc="Expanding blanks", leave=False, disable=not progress_bar): # type: ignore
-            blank = sample if sample["isBlankSample"] else sample["blank"]
-            if blank is not None:
-                if id(blank) not in expanded_blanks:
-                    expanded_blank: List[Sample] = list()
-                    for filename, name_appendix in zip([blank["fileName"], *blank["extraFileNames"]], ["", *map(lambda ind: f' [Extra {ind}]', range(1, len(blank["extraFileNames"]) + 1))]): # type: ignore
-                        expanded_blank.append(self._create_sample_from(blank, name=f'{blank["name"]}{name_appendix}', fileName=filename))
-                    expanded_blanks[id(blank)] = expanded_blank
-        # Create the expanded set of regular samples by combining the main and extra images of the regular and blank samples.
-        self._samples: List[Sample] = list()
-        for sample in tqdm(dataset, desc="Expanding regular samples", leave=False, disable=not progress_bar): # type: ignore
+        # Create the expanded set of samples by combining the main and extra images of the regular and blank samples. Only the indices of the combinations are kept.
+        self._dataset = dataset
+        combinations: List[Tuple[int, int, int]] = list()  # List[Tuple[sample_index, image_index, blank_image_index]], where image index 0 is the main image and -1 means no blank image.
+        for sample_index, sample in enumerate(tqdm(dataset, desc="Expanding samples", leave=False, disable=not progress_bar)): # type: ignore
+            num_images = 1 + len(sample["extraFileNames"])
             if sample["isBlankSample"]:
-                self._samples.extend(expanded_blanks[id(sample)])
+                combinations.extend((sample_index, image_index, -1) for image_index in range(num_images))
             elif sample["blank"] is not None:
-                for filename, name_appendix in zip([sample["fileName"], *sample["extraFileNames"]], ["", *map(lambda ind: f' [Extra {ind}]', range(1, len(sample["extraFileNames"]) + 1))]): # type: ignore
-                    for blank in expanded_blanks[id(sample["blank"])]:
-                        self._samples.append(self._create_sample_from(sample, name=f'{sample["name"]}{name_appendix}', fileName=filename, blankFileName=blank["fileName"], blank=blank))
+                num_blank_images = 1 + len(sample["blank"]["extraFileNames"])
+                combinations.extend((sample_index, image_index, blank_image_index) for image_index in range(num_images) for blank_image_index in range(num_blank_images))
             else:
-                for filename, name_appendix in zip([sample["fileName"], *sample["extraFileNames"]], ["", *map(lambda ind: f' [Extra {ind}]', range(1, len(sample["extraFileNames"]) + 1))]): # type: ignore
-                    self._samples.append(self._create_sample_from(sample, name=f'{sample["name"]}{name_appendix}', fileName=filename, blankFileName=sample["blankFileName"]))
+                combinations.extend((sample_index, image_index, -1) for image_index in range(num_images))
+        self._combinations = np.asarray(combinations, dtype=np.int32).reshape(-1, 3)
+        # The overlays of blank samples are made once, so all samples sharing the same blank image get the same blank record, as in the original dataset.
+        self._blank_overlays: Dict[Tuple[int, int], Sample] = dict()  # Dict[Tuple[id(blank), blank_image_index], overlay]. The overlay keeps a reference to the blank.
 
     def __getitem__(self, index: int) -> Sample:
-        return self._samples[index]
+        sample_index, image_index, blank_image_index = self._combinations[index].tolist()
+        sample: Sample = self._dataset[sample_index]
+        if blank_image_index == -1:
+            return self._create_sample_from(sample, image_index, blankFileName=sample["blankFileName"])
+        blank = self._blank_overlay(sample["blank"], blank_image_index)  # type: ignore
+        return self._create_sample_from(sample, image_index, blankFileName=blank["fileName"], blank=blank)
 
     def __len__(self) -> int:
-        return len(self._samples)
-
-    def _create_sample_from(self, sample: Sample, **kwargs: Any) -> Sample:
-        new_sample = copy.deepcopy(sample)
+        return len(self._combinations)
+
+    def _blank_overlay(self, blank: Sample, blank_image_index: int) -> Sample:
+        key = (id(blank), blank_image_index)
+        overlay = self._blank_overlays.get(key, None)
+        if overlay is None:
+            overlay = self._blank_overlays[key] = self._create_sample_from(blank, blank_image_index)
+        return overlay
+
+    def _create_sample_from(self, sample: Sample, image_index: int, **kwargs: Any) -> Sample:
+        # Make a shallow overlay of the given sample. Nested records are shared with the original sample and must not be modified.
+        new_sample = Sample(sample)  # type: ignore
+        new_sample["name"] = f'{sample["name"]} [Extra {image_index}]' if image_index > 0 else sample["name"]
+        new_sample["fileName"] = sample["extraFileNames"][image_index - 1] if image_index > 0 else sample["fileName"]
         new_sample["extraFileNames"] = []
         new_sample["recordPath"] = None
         new_sample["referenceSample"] = sample
@@ -313,31 +446,58 @@ class ExpandedSampleDataset(SizedDataset[Sample]):
 
 
 class ProcessedSample:
-    def __init__(self, sample: Sample, *, compute_masks_func: Callable[[np.ndarray, np.ndarray, ChamberType], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], compute_pmf_func: Callable[[np.ndarray, np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]], postfix: str, root_dir: str, transform: Optional[Callable[..., Dict[str, Any]]]) -> None:
+    def __init__(self, sample: Sample, *, compute_masks_func: Callable[[np.ndarray, Optional[np.ndarray], ChamberType, Optional[np.ndarray], Optional[PotCircle]], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], compute_pmf_func: Callable[[np.ndarray, np.ndarray, np.ndarray, bool], Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]], postfix: str, cache: CacheBackend, memory_cache: Optional[MemoryCache] = None, masks_params: Tuple[Any, ...] = (), pmf_params: Tuple[Any, ...] = (), reduced_masks: bool = False, reuse_blank_geometry: bool = False, analyte_lab_only: bool = False, pixel_sampling: Optional[PixelSampling] = None, augmentation_seed: Optional[int] = None, transform: Optional[Callable[..., Dict[str, Any]]]) -> None:
         # Define some properties and local functions.
         self._bgr_img_ext: Dict[str, str] = dict()
+        def make_prefix(original_path: str) -> str:
+            # The prefix is keyed by the content of the source image, so images with the same file name never collide.
+            return f'{os.path.splitext(os.path.basename(original_path))[0]}-{digest_file(original_path)}{postfix}'
         def make_bgr_image(prefix: str, original_path: str) -> None:
             ext = os.path.splitext(original_path)[1] if transform is None else '.png'
             path = self._path(prefix, None, ext)
             if not os.path.isfile(path):
+                # Write to a temporary file first, so processes sharing the cache never see a partially written image.
+                tmp_path = f'{os.path.splitext(path)[0]}.{os.getpid()}.tmp{ext}'
                 if transform is None:
-                    shutil.copyfile(original_path, path)
+                    shutil.copyfile(original_path, tmp_path)
                 else:
                     bgr_img = cv2.imread(original_path, cv2.IMREAD_COLOR)
                     if bgr_img is None:
                         raise RuntimeError(f'Can\'t load the file "{original_path}"')
-                    if not cv2.imwrite(path, transform(image=bgr_img)["image"]):
+                    if augmentation_seed is None:
+                        augmented_bgr_img = transform(image=bgr_img)["image"]
+                    else:
+                        # Make the augmentation reproducible without changing the state of the global random number generators.
+                        states = random.getstate(), np.random.get_state()
+                        seed = int(digest_params(prefix, augmentation_seed), 16) % 2 ** 32
+                        random.seed(seed)
+                        np.random.seed(seed)
+                        try:
+                            augmented_bgr_img = transform(image=bgr_img)["image"]
+                        finally:
+                            random.setstate(states[0])
+                            np.random.set_state(states[1])
+                    if not cv2.imwrite(tmp_path, augmented_bgr_img):
                         raise RuntimeError(f'Can\'t save the file "{path}"')
+                os.replace(tmp_path, path)
             self._bgr_img_ext[prefix] = ext
         # Set sample.
         self.sample: Final[Sample] = sample
         # Set functions to compute masks and PMFs.
         self._compute_masks = compute_masks_func
         self._compute_pmf = compute_pmf_func
-        # Set root directory.
-        self._root_dir = root_dir
+        self._reduced_masks = reduced_masks
+        # Set whether the circle found in the blank is the hint for the circle of the sample (and of the blank itself), as both are captured in the same holder.
+        self._reuse_blank_geometry = reuse_blank_geometry
+        # Set how the analyte pixels are sampled to compute PMFs, if not all of them are used.
+        self._pixel_sampling = pixel_sampling
+        # Set whether only the L*a*b* values of the analyte pixels are stored, instead of the full frame L*a*b* image.
+        self._analyte_lab_only = analyte_lab_only
+        # Set the cache backend and the in-memory cache shared by the samples of a dataset.
+        self._cache = cache
+        self._memory_cache = memory_cache
         # Set sample's prefix and BGR images.
-        self.sample_prefix: Final[str] = f'{os.path.splitext(os.path.basename(sample["fileName"]))[0]}{postfix}'
+        self.sample_prefix: Final[str] = make_prefix(sample["fileName"])
         # added to identify date and analyst name
         self.datetime: Final[str] = str(sample["datetime"])
         self.analyst_name: Final[str] = sample["analystName"]
@@ -345,62 +505,195 @@ class ProcessedSample:
         make_bgr_image(self.sample_prefix, sample["fileName"])
         # Set blank's prefix and BGR images.
         if sample["blankFileName"] is not None and os.path.isfile(sample["blankFileName"]):
-            blank_prefix = f'{os.path.splitext(os.path.basename(sample["blankFileName"]))[0]}{postfix}'
+            blank_prefix = make_prefix(sample["blankFileName"])
             make_bgr_image(blank_prefix, sample["blankFileName"])
         else:
             blank_prefix = None
         self.blank_prefix: Final[Optional[str]] = blank_prefix
+        # Set the digests of the parameters that affect the masks and the PMFs. They are part of the keys of the cached artifacts. The masks computed with
+        # the circle of the blank as the hint depend on the content of the blank, so the same image gets different masks with different blanks, or when
+        # it is the sample of one pair and the blank of another.
+        circle_hint_params = (blank_prefix,) if self._uses_circle_hint else ()
+        self._masks_digest = digest_params(*masks_params, sample["chamberType"], *circle_hint_params)
+        self._pmf_digest = digest_params(self._masks_digest, *pmf_params)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The in-memory cache is local to each process.
+        return {**self.__dict__, "_memory_cache": None}
+
+    def _analyte_lab_pixels(self, prefix: str) -> np.ndarray:
+        if not self._analyte_lab_only:
+            return self._lab_image(prefix)[self._mask(prefix, "analyte_msk")]
+        opencv_lab_pixels = self._memory_get(prefix, f'analyte_lab-{self._masks_digest}')
+        if opencv_lab_pixels is None:
+            stored = self._cache.load(prefix, f'analyte_lab-{self._masks_digest}')
+            if stored is not None:
+                opencv_lab_pixels = next(iter(stored.values()))
+            else:
+                # Convert only the analyte pixels, and keep the 8-bit L*a*b* values from OpenCV, since the float conversion is exact.
+                bgr_pixels = self._bgr_image(prefix)[self._mask(prefix, "analyte_msk")]
+                opencv_lab_pixels = cv2.cvtColor(bgr_pixels[np.newaxis, ...], cv2.COLOR_BGR2LAB)[0, ...]  # opencv_lab_pixels.shape = (num_pixels, 3)
+                self._cache.save(prefix, f'analyte_lab-{self._masks_digest}', opencv_lab_pixels)
+            self._memory_put(prefix, f'analyte_lab-{self._masks_digest}', opencv_lab_pixels)
+        return opencv_lab_to_lab(opencv_lab_pixels)
+
+    @property
+    def _uses_circle_hint(self) -> bool:
+        return self._reuse_blank_geometry and self.blank_prefix is not None and self.sample["chamberType"] is ChamberType.POT
+
+    def _blank_pot_circle(self) -> Optional[PotCircle]:
+        if not self._uses_circle_hint:
+            return None
+        value = self._memory_get(self.blank_prefix, f'pot_circle-{self._masks_digest}')
+        if value is None:
+            stored = self._cache.load(self.blank_prefix, f'pot_circle-{self._masks_digest}')
+            if stored is not None:
+                value = next(iter(stored.values()))
+            else:
+                if self._reduced_masks:
+                    circle = find_pot_circle(self._full_resolution_placeholder(self.blank_prefix), reduced_bgr_img=read_reduced_bgr_image(self._path(self.blank_prefix, None, self._bgr_img_ext[self.blank_prefix])))
+                else:
+                    circle = find_pot_circle(self._bgr_image(self.blank_prefix))
+                value = np.asarray(circle if circle is not None else (), dtype=np.float64)  # value.shape = (3,), or (0,) if the circle was not found.
+                self._cache.save(self.blank_prefix, f'pot_circle-{self._masks_digest}', value)
+            self._memory_put(self.blank_prefix, f'pot_circle-{self._masks_digest}', value)
+        return PotCircle(*value.tolist()) if len(value) == 3 else None
+
+    def _blank_spectrum(self) -> np.ndarray:
+        # The spectrum of the blank PMF is shared by all samples calibrated against the same blank, so it is kept in memory only.
+        assert self.blank_prefix is not None
+        blank_spectrum = self._memory_get(self.blank_prefix, f'blank_spectrum-{self._pmf_digest}')
+        if blank_spectrum is None:
+            blank_spectrum = compute_blank_spectrum(self._pmf(self.blank_prefix, "pmf")) # type: ignore
+            self._memory_put(self.blank_prefix, f'blank_spectrum-{self._pmf_digest}', blank_spectrum)
+        return blank_spectrum
 
     def _bgr_image(self, prefix: str) -> np.ndarray:
-        path = self._path(prefix, None, self._bgr_img_ext[prefix])
-        bgr_img = cv2.imread(path, cv2.IMREAD_COLOR)
+        bgr_img = self._memory_get(prefix, "bgr_img")
         if bgr_img is None:
-            raise RuntimeError(f'Can\'t load the file "{path}"')
+            path = self._path(prefix, None, self._bgr_img_ext[prefix])
+            bgr_img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if bgr_img is None:
+                raise RuntimeError(f'Can\'t load the file "{path}"')
+            self._memory_put(prefix, "bgr_img", bgr_img)
         return bgr_img
 
+    def _full_resolution_placeholder(self, prefix: str) -> np.ndarray:
+        # The shape of the full resolution image is taken from the decoded image, if it is in memory, or else from the header of the file.
+        bgr_img = self._memory_get(prefix, "bgr_img")
+        return full_resolution_placeholder(bgr_img.shape[:2] if bgr_img is not None else read_image_shape(self._path(prefix, None, self._bgr_img_ext[prefix])))
+
     def _lab_image(self, prefix: str) -> np.ndarray:
-        path = self._path(prefix, "lab_img", ".npz")
-        if os.path.isfile(path):
-            lab_img = next(iter(np.load(path).values()))
+        lab_img = self._memory_get(prefix, "lab_img")
+        if lab_img is not None:
+            return lab_img
+        stored = self._cache.load(prefix, "lab_img")
+        if stored is not None:
+            lab_img = next(iter(stored.values()))
         else:
             lab_img = bgr_to_lab(self._bgr_image(prefix))
-            np.savez_compressed(path, lab_img)
+            # With analyte-only L*a*b* storage, the full frame is computed on demand (e.g., for visualization) but never stored.
+            if not self._analyte_lab_only:
+                self._cache.save(prefix, "lab_img", lab_img)
+        self._memory_put(prefix, "lab_img", lab_img)
         return lab_img
 
     def _mask(self, prefix: str, key: str) -> np.ndarray:
         data: Dict[str, np.ndarray] = dict()
-        path = self._path(prefix, key, ".npz")
-        if os.path.isfile(path):
-            data[key] = next(iter(np.load(path).values()))
+        value = self._memory_get(prefix, f'{key}-{self._masks_digest}')
+        if value is not None:
+            return value
+        stored = self._cache.load(prefix, f'{key}-{self._masks_digest}')
+        if stored is not None:
+            data[key] = next(iter(stored.values()))
         else:
-            data["bright_msk"], data["grid_msk"], data["analyte_msk"], data["lab_white"] = self._compute_masks(self._bgr_image(prefix), self._lab_image(prefix), self.sample["chamberType"])
+            circle_hint = self._blank_pot_circle()
+            if self._reduced_masks:
+                # Estimate the masks from the image decoded at reduced scale, so the full resolution image is only decoded if the analyte pixels are required by the PMF.
+                reduced_bgr_img = read_reduced_bgr_image(self._path(prefix, None, self._bgr_img_ext[prefix]))
+                data["bright_msk"], data["grid_msk"], data["analyte_msk"], data["lab_white"] = self._compute_masks(self._full_resolution_placeholder(prefix), None, self.sample["chamberType"], reduced_bgr_img, circle_hint)
+            else:
+                data["bright_msk"], data["grid_msk"], data["analyte_msk"], data["lab_white"] = self._compute_masks(self._bgr_image(prefix), self._lab_image(prefix), self.sample["chamberType"], None, circle_hint)
             for name, value in data.items():
-                np.savez_compressed(self._path(prefix, name, ".npz"), value)
+                self._cache.save(prefix, f'{name}-{self._masks_digest}', value)
+        for name, value in data.items():
+            self._memory_put(prefix, f'{name}-{self._masks_digest}', value)
         return data[key]
 
+    def _load_calibrated_pmf(self) -> Optional[np.ndarray]:
+        prefix = f'{self.sample_prefix}-{self.blank_prefix}'
+        calibrated_pmf = self._memory_get(prefix, f'calibrated_pmf-{self._pmf_digest}')
+        if calibrated_pmf is None:
+            stored = self._cache.load(prefix, f'calibrated_pmf-{self._pmf_digest}')
+            if stored is not None:
+                calibrated_pmf = next(iter(stored.values()))
+                self._memory_put(prefix, f'calibrated_pmf-{self._pmf_digest}', calibrated_pmf)
+        return calibrated_pmf
+
+    def _memory_get(self, prefix: str, key: str) -> Optional[Any]:
+        return self._memory_cache.get((prefix, key)) if self._memory_cache is not None else None
+
+    def _memory_put(self, prefix: str, key: str, value: Any) -> None:
+        # The cached values are shared by all samples of the dataset and must not be modified by the caller.
+        if self._memory_cache is not None:
+            self._memory_cache.put((prefix, key), value)
+
     def _path(self, prefix: str, key: Optional[str], ext: str) -> str:
-        return os.path.join(self._root_dir, f'{prefix}{f"_{key}" if key is not None else ""}{ext}')
+        return self._cache.path(prefix, key, ext)
 
     def _pmf(self, prefix: str, key: str) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
         data: Dict[str, Any] = dict()
-        path = self._path(prefix, key, ".npz")
-        if os.path.isfile(path):
+        value = self._memory_get(prefix, f'{key}-{self._pmf_digest}')
+        if value is not None:
+            return value
+        stored = self._cache.load(prefix, f'{key}-{self._pmf_digest}')
+        if stored is not None:
             if key == "pmf":
-                data[key] = next(iter(np.load(path).values()))
+                data[key] = next(iter(stored.values()))
             else:
-                with np.load(path) as npz:
-                    data[key] = (npz["img_ind"], npz["pmf_ind"])
+                data[key] = (stored["img_ind"], stored["pmf_ind"])
         else:
-            data["pmf"], data["img_to_pmf"] = self._compute_pmf(self._lab_image(prefix), self._mask(prefix, "analyte_msk"), self._mask(prefix, "lab_white"))
-            np.savez_compressed(self._path(prefix, "pmf", ".npz"), data["pmf"])
-            np.savez_compressed(self._path(prefix, "img_to_pmf", ".npz"), img_ind=data["img_to_pmf"][0], pmf_ind=data["img_to_pmf"][1])
+            # The map from pixels to PMF bins is only used for visualization, so it is computed and stored only when it is requested.
+            with_img_to_pmf = key == "img_to_pmf"
+            if self._analyte_lab_only:
+                # Compute the PMF of the list of analyte pixels, and map the indices of the pixels in the list back to image coordinates.
+                sampled = self._sampled_analyte_mask(prefix)[self._mask(prefix, "analyte_msk")] if self._pixel_sampling is not None else slice(None)
+                lab_pixels = self._analyte_lab_pixels(prefix)[sampled, ...]
+                data["pmf"], img_to_pmf = self._compute_pmf(lab_pixels[:, np.newaxis, :], np.ones((len(lab_pixels), 1), dtype=np.bool_), self._mask(prefix, "lab_white"), with_img_to_pmf)
+                if img_to_pmf is not None:
+                    data["img_to_pmf"] = (np.stack(np.nonzero(self._mask(prefix, "analyte_msk")), axis=1)[sampled, ...][img_to_pmf[0][:, 0], ...], img_to_pmf[1])
+            else:
+                data["pmf"], img_to_pmf = self._compute_pmf(self._lab_image(prefix), self._sampled_analyte_mask(prefix), self._mask(prefix, "lab_white"), with_img_to_pmf)
+                if img_to_pmf is not None:
+                    data["img_to_pmf"] = img_to_pmf
+            if not with_img_to_pmf:
+                self._cache.save(prefix, f'pmf-{self._pmf_digest}', data["pmf"])
+            else:
+                data["img_to_pmf"] = _compact_img_to_pmf(*data["img_to_pmf"])
+                self._cache.save(prefix, f'img_to_pmf-{self._pmf_digest}', img_ind=data["img_to_pmf"][0], pmf_ind=data["img_to_pmf"][1])
+        for name, value in data.items():
+            self._memory_put(prefix, f'{name}-{self._pmf_digest}', value)
         return data[key]
 
+    def _sampled_analyte_mask(self, prefix: str) -> np.ndarray:
+        analyte_msk = self._mask(prefix, "analyte_msk")
+        return sample_analyte_mask(analyte_msk, self._pixel_sampling) if self._pixel_sampling is not None else analyte_msk
+
+    def _store_calibrated_pmf(self, calibrated_pmf: np.ndarray) -> None:
+        prefix = f'{self.sample_prefix}-{self.blank_prefix}'
+        self._cache.save(prefix, f'calibrated_pmf-{self._pmf_digest}', calibrated_pmf)
+        self._memory_put(prefix, f'calibrated_pmf-{self._pmf_digest}', calibrated_pmf)
+
     @property
     def blank_analyte_mask(self) -> np.ndarray:
         assert self.blank_prefix is not None
         return self._mask(self.blank_prefix, "analyte_msk")
 
+    @property
+    def blank_analyte_lab_pixels(self) -> np.ndarray:
+        assert self.blank_prefix is not None
+        return self._analyte_lab_pixels(self.blank_prefix)
+
     @property
     def blank_bgr_image(self) -> np.ndarray:
         assert self.blank_prefix is not None
@@ -438,23 +731,40 @@ class ProcessedSample:
 
     @property
     def calibrated_pmf(self) -> np.ndarray:
-        path = self._path(f'{self.sample_prefix}-{self.blank_prefix}', "calibrated_pmf", ".npz")
-        if os.path.isfile(path):
-            calibrated_pmf = next(iter(np.load(path).values()))
-        else:
-            assert self.blank_prefix is not None
-            calibrated_pmf = compute_calibrated_pmf(blank_pmf=self._pmf(self.blank_prefix, "pmf"), sample_pmf=self._pmf(self.sample_prefix, "pmf")) # type: ignore
-            np.savez_compressed(path, calibrated_pmf)
-        return calibrated_pmf
+        return calibrate_processed_samples([self])[0]
 
     @property
     def has_valid_blank(self) -> bool:
         return self.sample["blankFileName"] is not None and os.path.isfile(self.sample["blankFileName"])
 
+    def roi_calibrated_pmf(self, roi: Tuple[Tuple[int, int], ...]) -> np.ndarray:
+        # Get the window of the calibrated PMF given by the inclusive bounds in roi. It is always computed by compute_roi_calibrated_pmf, as in the mobile
+        # application, even if the whole calibrated PMF is available, so all subsets take the same numerical path.
+        roi = tuple((int(lower), int(upper)) for lower, upper in roi)
+        prefix = f'{self.sample_prefix}-{self.blank_prefix}'
+        key = f'calibrated_pmf-{self._pmf_digest}-roi_{digest_params(roi)}'
+        roi_calibrated_pmf = self._memory_get(prefix, key)
+        if roi_calibrated_pmf is not None:
+            return roi_calibrated_pmf
+        stored = self._cache.load(prefix, key)
+        if stored is not None:
+            roi_calibrated_pmf = next(iter(stored.values()))
+        else:
+            assert self.blank_prefix is not None
+            blank_spectrum = self._memory_get(self.blank_prefix, f'blank_spectrum-{self._pmf_digest}')  # Only used if the FFT is required.
+            roi_calibrated_pmf = compute_roi_calibrated_pmf(blank_pmf=self._pmf(self.blank_prefix, "pmf"), sample_pmf=self._pmf(self.sample_prefix, "pmf"), roi=roi, blank_spectrum=blank_spectrum) # type: ignore
+            self._cache.save(prefix, key, roi_calibrated_pmf)
+        self._memory_put(prefix, key, roi_calibrated_pmf)
+        return roi_calibrated_pmf
+
     @property
     def sample_analyte_mask(self) -> np.ndarray:
         return self._mask(self.sample_prefix, "analyte_msk")
 
+    @property
+    def sample_analyte_lab_pixels(self) -> np.ndarray:
+        return self._analyte_lab_pixels(self.sample_prefix)
+
     @property
     def sample_bgr_image(self) -> np.ndarray:
         return self._bgr_image(self.sample_prefix)
@@ -487,21 +797,98 @@ class ProcessedSample:
         return self.sample_prefix
 
 
+def calibrate_processed_samples(processed_samples: Sequence[ProcessedSample]) -> List[np.ndarray]:
+    # Get the calibrated PMFs already stored and compute the remaining ones with one batched FFT per group of samples sharing the same PMF parameters.
+    calibrated_pmfs: List[Optional[np.ndarray]] = [processed_sample._load_calibrated_pmf() for processed_sample in processed_samples]
+    pending: Dict[str, List[int]] = dict()  # Dict[pmf_digest, List[index]]
+    for index, (processed_sample, calibrated_pmf) in enumerate(zip(processed_samples, calibrated_pmfs)):
+        if calibrated_pmf is None:
+            assert processed_sample.blank_prefix is not None
+            pending.setdefault(processed_sample._pmf_digest, list()).append(index)
+    for batch_indices in pending.values():
+        for begin in range(0, len(batch_indices), CALIBRATION_BATCH_SIZE):
+            indices = batch_indices[begin:begin + CALIBRATION_BATCH_SIZE]
+            _calibrate_batch(processed_samples, indices, calibrated_pmfs)
+    return calibrated_pmfs # type: ignore
+
+
+def _calibrate_batch(processed_samples: Sequence[ProcessedSample], indices: List[int], calibrated_pmfs: List[Optional[np.ndarray]]) -> None:
+    # Each distinct blank spectrum is computed (or got from memory) once per batch.
+    blank_rows: Dict[str, int] = dict()
+    blank_spectra: List[np.ndarray] = list()
+    blank_indices = np.empty((len(indices),), dtype=np.int64)
+    for row, index in enumerate(indices):
+        processed_sample = processed_samples[index]
+        blank_row = blank_rows.get(processed_sample.blank_prefix, None) # type: ignore
+        if blank_row is None:
+            blank_row = blank_rows[processed_sample.blank_prefix] = len(blank_spectra) # type: ignore
+            blank_spectra.append(processed_sample._blank_spectrum())
+        blank_indices[row] = blank_row
+    sample_pmfs = np.stack([processed_samples[index]._pmf(processed_samples[index].sample_prefix, "pmf") for index in indices]) # type: ignore
+    for index, calibrated_pmf in zip(indices, compute_calibrated_pmfs(sample_pmfs, np.stack(blank_spectra), blank_indices)):
+        calibrated_pmf = np.ascontiguousarray(calibrated_pmf)
+        processed_samples[index]._store_calibrated_pmf(calibrated_pmf)
+        calibrated_pmfs[index] = calibrated_pmf
+
+
+def _compact_img_to_pmf(img_ind: np.ndarray, pmf_ind: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Pixel coordinates fit in 16 bits for images with up to 65536 rows and columns, and bin indices fit in 8 bits since PMFs have 256 bins per dimension.
+    img_dtype = np.uint16 if img_ind.size == 0 or img_ind.max() <= np.iinfo(np.uint16).max else np.uint32
+    return img_ind.astype(img_dtype), pmf_ind.astype(np.uint8)
+
+
+def _precompute_blank_pot_circle(processed_sample: ProcessedSample) -> None:
+    processed_sample._blank_pot_circle()
+
+
+def _precompute_calibrated_pmfs(processed_samples: List[ProcessedSample]) -> None:
+    calibrate_processed_samples(processed_samples)
+
+
+def _precompute_pmf(processed_sample: ProcessedSample, prefix: str) -> None:
+    processed_sample._pmf(prefix, "pmf")
+
+
 class ProcessedSampleDataset(SizedDataset[ProcessedSample]):
-    def __init__(self, dataset: SizedDataset[Sample], cache_dir: str, *, num_augmented_samples: int = 0, progress_bar: bool = True, transform: Optional[Callable[..., Dict[str, Any]]] = DEFAULT_TRANSFORM, **kwargs: Any) -> None:
+    def __init__(self, dataset: SizedDataset[Sample], cache_dir: str, *, cache_backend: str = "npz", memory_cache_bytes: int = DEFAULT_MEMORY_CACHE_BYTES, augmentation_seed: Optional[int] = None, num_augmented_samples: int = 0, num_workers: int = 0, progress_bar: bool = True, reduced_masks: bool = False, reuse_blank_geometry: bool = False, analyte_lab_only: bool = False, pixel_sampling: Optional[PixelSampling] = None, transform: Optional[Callable[..., Dict[str, Any]]] = DEFAULT_TRANSFORM, **kwargs: Any) -> None:
         super().__init__()
-        os.makedirs(cache_dir, exist_ok=True)
-        # Copy original BGR images of samples to root_dir and augment them, if needed.
+        # Set the backend used to store the processed artifacts.
+        if cache_backend not in CACHE_BACKENDS:
+            raise ValueError(f'Unknown cache backend "{cache_backend}", expected one of {sorted(CACHE_BACKENDS)}')
+        self._cache: CacheBackend = CACHE_BACKENDS[cache_backend](cache_dir)
+        # Set the in-memory cache shared by all processed samples, if required to.
+        self.memory_cache: Final[Optional[MemoryCache]] = MemoryCache(memory_cache_bytes) if memory_cache_bytes > 0 else None
+        # Get the parameters that affect the cached masks and PMFs.
+        masks_params = self._masks_key_params() if not reduced_masks else (*self._masks_key_params(), "reduced_masks")
+        masks_params = masks_params if not reuse_blank_geometry else (*masks_params, "reuse_blank_geometry")
+        pmf_params = self._pmf_key_params() if pixel_sampling is None else (*self._pmf_key_params(), "pixel_sampling", tuple(pixel_sampling))
+        # Augmented images are keyed by the transform that makes them. Unseeded augmentations are drawn anew by each dataset, so they are kept in a temporary
+        # cache that is removed with the dataset, instead of being reused by later runs.
+        augmentation_postfix = f'-{_transform_digest(transform)}' if transform is not None else ""
+        augmentation_postfix = augmentation_postfix if augmentation_seed is None else f'{augmentation_postfix}-seed_{augmentation_seed}'
+        self._augmentation_tmpdir: Optional[TemporaryDirectory] = None
+        augmentation_cache = self._cache
+        if augmentation_seed is None and num_augmented_samples > 0:
+            self._augmentation_tmpdir = TemporaryDirectory(dir=cache_dir, prefix=".augmented-")
+            augmentation_cache = CACHE_BACKENDS[cache_backend](self._augmentation_tmpdir.name)
+        # Copy original BGR images of samples to the cache directory and augment them, if needed.
         self.samples = dataset
         self._processed_samples: List[ProcessedSample] = list()
         with tqdm(desc="Copying images to cache", total=len(dataset) * (num_augmented_samples + 1), leave=False, disable=not progress_bar) as pbar:
             for sample in dataset:
                 self._processed_samples.append(ProcessedSample(
                     sample,
-                    compute_masks_func=lambda bgr_img, lab_img, chamber_type: self._compute_masks(bgr_img, lab_img, chamber_type),
-                    compute_pmf_func=lambda lab_img, analyte_msk, lab_white: self._compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white),
+                    compute_masks_func=self._compute_masks,
+                    compute_pmf_func=self._compute_pmf,
                     postfix="",
-                    root_dir=cache_dir,
+                    cache=self._cache,
+                    memory_cache=self.memory_cache,
+                    masks_params=masks_params,
+                    pmf_params=pmf_params,
+                    reduced_masks=reduced_masks,
+                    reuse_blank_geometry=reuse_blank_geometry,
+                    analyte_lab_only=analyte_lab_only,
+                    pixel_sampling=pixel_sampling,
                     transform=None,
                 ))
                 pbar.update(1)
@@ -510,13 +897,32 @@ class ProcessedSampleDataset(SizedDataset[ProcessedSample]):
                     # Get the augmented images of the actual and blank samples.
                     self._processed_samples.append(ProcessedSample(
                         sample,
-                        compute_masks_func=lambda bgr_img, lab_img, chamber_type: self._compute_masks(bgr_img, lab_img, chamber_type),
-                        compute_pmf_func=lambda lab_img, analyte_msk, lab_white: self._compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white),
-                        postfix=f'-augmented-{ind}',
-                        root_dir=cache_dir,
+                        compute_masks_func=self._compute_masks,
+                        compute_pmf_func=self._compute_pmf,
+                        postfix=f'-augmented-{ind}{augmentation_postfix}',
+                        cache=augmentation_cache,
+                        memory_cache=self.memory_cache,
+                        masks_params=masks_params,
+                        pmf_params=pmf_params,
+                        reduced_masks=reduced_masks,
+                        reuse_blank_geometry=reuse_blank_geometry,
+                        analyte_lab_only=analyte_lab_only,
+                        pixel_sampling=pixel_sampling,
+                        augmentation_seed=augmentation_seed,
                         transform=transform,
                     ))
                     pbar.update(1)
+        # Precompute masks, PMFs, and calibrated PMFs in parallel, if required to.
+        if num_workers > 0:
+            self.precompute(num_workers=num_workers, progress_bar=progress_bar)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Only the processing parameters are sent to worker processes, through the bound methods used to compute masks and PMFs.
+        return {key: value for key, value in self.__dict__.items() if key not in ("_augmentation_tmpdir", "_processed_samples", "memory_cache", "samples") and value is not self.samples}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.__dict__.update({"_augmentation_tmpdir": None, "_processed_samples": list(), "memory_cache": None, "samples": None})
 
     def get_samples(self):
         return self.samples
@@ -528,19 +934,55 @@ class ProcessedSampleDataset(SizedDataset[ProcessedSample]):
         return len(self._processed_samples)
 
     @abstractmethod
-    def _compute_masks(self, bgr_img: np.ndarray, lab_img: np.ndarray, chamber_type: ChamberType) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    def _compute_masks(self, bgr_img: np.ndarray, lab_img: Optional[np.ndarray], chamber_type: ChamberType, reduced_bgr_img: Optional[np.ndarray] = None, circle_hint: Optional[PotCircle] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         raise NotImplementedError  # To be implemented by the subclass.
 
     @abstractmethod
-    def _compute_pmf(self, lab_img: np.ndarray, analyte_msk: np.ndarray, lab_white: np.ndarray) -> Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    def _compute_pmf(self, lab_img: np.ndarray, analyte_msk: np.ndarray, lab_white: np.ndarray, with_img_to_pmf: bool = True) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
         raise NotImplementedError  # To be implemented by the subclass.
 
+    def _masks_key_params(self) -> Tuple[Any, ...]:
+        return (f'{type(self).__module__}.{type(self).__qualname__}',)  # Subclasses with parameterized masks must extend it.
+
+    def _pmf_key_params(self) -> Tuple[Any, ...]:
+        return (f'{type(self).__module__}.{type(self).__qualname__}',)  # Subclasses with parameterized PMFs must extend it.
+
+    def precompute(self, *, num_workers: int, progress_bar: bool = True) -> None:
+        # Find the circle of each distinct blank (if it is the hint for the masks), compute the PMFs (and masks) of each distinct image and then the calibrated PMFs of each distinct sample-blank pair, so no artifact is written by two workers.
+        blank_pot_circle_jobs: Dict[Tuple[str, str], ProcessedSample] = dict()  # Dict[Tuple[blank_prefix, masks_digest], processed_sample]
+        pmf_jobs: Dict[Tuple[str, str], Tuple[ProcessedSample, str]] = dict()  # Dict[Tuple[prefix, pmf_digest], Tuple[processed_sample, prefix]]
+        calibrated_pmf_jobs: Dict[Tuple[str, Optional[str], str], ProcessedSample] = dict()  # Dict[Tuple[sample_prefix, blank_prefix, pmf_digest], processed_sample]
+        calibrated_pmf_batches: Dict[Tuple[Optional[str], str], List[ProcessedSample]] = dict()  # Dict[Tuple[blank_prefix, pmf_digest], List[processed_sample]]
+        for processed_sample in self._processed_samples:
+            prefixes = [processed_sample.sample_prefix] if processed_sample.blank_prefix is None else [processed_sample.sample_prefix, processed_sample.blank_prefix]
+            for prefix in prefixes:
+                pmf_jobs.setdefault((prefix, processed_sample._pmf_digest), (processed_sample, prefix))
+            if processed_sample._uses_circle_hint:
+                blank_pot_circle_jobs.setdefault((processed_sample.blank_prefix, processed_sample._masks_digest), processed_sample)
+            if processed_sample.has_valid_blank:
+                calibrated_pmf_jobs.setdefault((processed_sample.sample_prefix, processed_sample.blank_prefix, processed_sample._pmf_digest), processed_sample)
+        # Samples sharing the same blank are calibrated together, so the spectrum of each blank is computed once.
+        for (_, blank_prefix, pmf_digest), processed_sample in calibrated_pmf_jobs.items():
+            calibrated_pmf_batches.setdefault((blank_prefix, pmf_digest), list()).append(processed_sample)
+        with worker_pool(num_workers, use_processes=True) as map_func:
+            for _ in tqdm(map_func(_precompute_blank_pot_circle, blank_pot_circle_jobs.values()), desc="Finding circles of blanks", total=len(blank_pot_circle_jobs), leave=False, disable=not progress_bar):
+                pass
+            for _ in tqdm(map_func(_precompute_pmf, [processed_sample for processed_sample, _ in pmf_jobs.values()], [prefix for _, prefix in pmf_jobs.values()]), desc="Computing masks and PMFs", total=len(pmf_jobs), leave=False, disable=not progress_bar):
+                pass
+            for _ in tqdm(map_func(_precompute_calibrated_pmfs, calibrated_pmf_batches.values()), desc="Computing calibrated PMFs", total=len(calibrated_pmf_batches), leave=False, disable=not progress_bar):
+                pass
+
+    def calibrated_pmfs(self, indices: Iterable[int], *, roi: Optional[Tuple[Tuple[int, int], ...]] = None) -> List[np.ndarray]:
+        if roi is not None:
+            return [self._processed_samples[index].roi_calibrated_pmf(roi) for index in indices]
+        return calibrate_processed_samples([self._processed_samples[index] for index in indices])
+
     def compute_calibrated_pmf_roi(self, reduction_level: float) -> Tuple[Tuple[Tuple[int, int], ...], Tuple[float, float]]:
         min_prob, max_prob = 0.0, 0.0
         used_msk: Union[bool, np.ndarray] = False
-        for processed_sample in self._processed_samples:
-            if processed_sample.has_valid_blank:
-                calibrated_pmf = processed_sample.calibrated_pmf
+        indices = [index for index, processed_sample in enumerate(self._processed_samples) if processed_sample.has_valid_blank]
+        for begin in range(0, len(indices), CALIBRATION_BATCH_SIZE):
+            for calibrated_pmf in self.calibrated_pmfs(indices[begin:begin + CALIBRATION_BATCH_SIZE]):
                 sorted_probs = calibrated_pmf.flatten()
                 sorted_probs.sort()
                 min_prob = min(min_prob, sorted_probs[0].item())
@@ -555,13 +997,4 @@ class ProcessedSampleDataset(SizedDataset[ProcessedSample]):
         return tuple(bounds), (min_prob, max_prob)
 
     def compute_true_value_statistics(self) -> Dict[str, float]:
-        values = np.asarray([processed_sample.sample["correctedTheoreticalValue"] for processed_sample in self._processed_samples if processed_sample.sample["correctedTheoreticalValue"] is not None], dtype=np.float32)
-        median = np.median(values)
-        return {
-            "min": float(np.min(values)),
-            "max": float(np.max(values)),
-            "mean": float(np.mean(values)),
-            "std": float(np.std(values)),
-            "median": float(median),
-            "mad": float(np.median(np.abs(values - median))),
-        }
+        return SampleTable(processed_sample.sample for processed_sample in self._processed_samples).compute_true_value_statistics()
@@ -0,0 +1,116 @@
+from ._model import Network
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Final, List, Sequence, Tuple
+import json, os, warnings
+import torch
+
+
+EXPORT_FORMATS: Final[Tuple[str, ...]] = ("onnx", "torchscript")
+
+
+EXPORT_EXTS: Final[Dict[str, str]] = {
+    "onnx": ".onnx",
+    "torchscript": ".pt",
+}
+METADATA_EXT: Final[str] = ".json"
+
+
+ONNX_OPSET_VERSION: Final[int] = 17
+
+
+class ExportedNetwork(ABC):
+    def __init__(self, metadata: Dict[str, Any]) -> None:
+        super().__init__()
+        self._metadata = metadata
+
+    @abstractmethod
+    def __call__(self, calibrated_pmf: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        raise NotImplementedError  # To be implemented by the subclass.
+
+    @property
+    def expected_range(self) -> Tuple[float, float]:
+        return tuple(map(float, self._metadata["expected_range"]))  # type: ignore
+
+    @property
+    def input_range(self) -> Tuple[float, float]:
+        return tuple(map(float, self._metadata["input_range"]))  # type: ignore
+
+    @property
+    def input_roi(self) -> Tuple[Tuple[int, int], ...]:
+        return tuple(map(lambda bounds: tuple(map(int, bounds)), self._metadata["input_roi"]))
+
+    @property
+    def version(self) -> str:
+        return self._metadata["version"]
+
+
+class OnnxNetwork(ExportedNetwork):
+    def __init__(self, path: str, metadata: Dict[str, Any]) -> None:
+        super().__init__(metadata)
+        import onnxruntime  # Only required by this backend.
+        self._session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def __call__(self, calibrated_pmf: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        value, normalized_value = self._session.run(None, {self._input_name: calibrated_pmf.detach().cpu().numpy()})
+        return torch.from_numpy(value).to(calibrated_pmf.device), torch.from_numpy(normalized_value).to(calibrated_pmf.device)
+
+
+class TorchScriptNetwork(ExportedNetwork):
+    def __init__(self, path: str, metadata: Dict[str, Any], device: str = "cpu") -> None:
+        super().__init__(metadata)
+        self._module = torch.jit.load(path, map_location=device)
+        self._module.eval()
+
+    def __call__(self, calibrated_pmf: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self._module(calibrated_pmf)
+
+
+def export_network(net: Network, path_prefix: str, formats: Sequence[str] = EXPORT_FORMATS, *, onnx_opset_version: int = ONNX_OPSET_VERSION) -> List[str]:
+    # Export the network, including its pre- and post-processing, to self-contained artifacts at path_prefix + EXPORT_EXTS[format], with the metadata required
+    # to use them at path_prefix + METADATA_EXT. The artifacts take batches of ROIs of calibrated PMFs, as computed by compute_roi_calibrated_pmf, and return
+    # the values and the normalized values.
+    for format in formats:
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format "{format}", expected one of {sorted(EXPORT_FORMATS)}')
+    net = net.cpu().eval()
+    input_roi = net.input_roi
+    example = torch.zeros((2, *(upper - lower + 1 for lower, upper in input_roi)), dtype=torch.float32)
+    paths: List[str] = list()
+    with torch.no_grad(), warnings.catch_warnings():
+        # The crop to the input ROI depends on the shape of the input, which is always the shape of the ROI here.
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        if "torchscript" in formats:
+            path = f'{path_prefix}{EXPORT_EXTS["torchscript"]}'
+            torch.jit.trace(net, example).save(path)
+            paths.append(path)
+        if "onnx" in formats:
+            path = f'{path_prefix}{EXPORT_EXTS["onnx"]}'
+            torch.onnx.export(net, (example,), path, input_names=["calibrated_pmf"], output_names=["value", "normalized_value"], dynamic_axes={"calibrated_pmf": {0: "batch_size"}, "value": {0: "batch_size"}, "normalized_value": {0: "batch_size"}}, opset_version=onnx_opset_version, dynamo=False)
+            paths.append(path)
+    # Write the metadata.
+    metadata = {
+        "network_class": net.__class__.__name__,
+        "version": net.version,
+        "expected_range": list(net.expected_range),
+        "input_range": list(net.input_range),
+        "input_roi": [list(bounds) for bounds in input_roi],
+    }
+    path = f'{path_prefix}{METADATA_EXT}'
+    with open(path, "w", encoding="utf-8") as fout:
+        json.dump(metadata, fout, indent=2)
+    paths.append(path)
+    return paths
+
+
+def load_exported_network(path_prefix: str, format: str, device: str = "cpu") -> ExportedNetwork:
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format "{format}", expected one of {sorted(EXPORT_FORMATS)}')
+    path = f'{path_prefix}{EXPORT_EXTS[format]}'
+    if not os.path.isfile(path) or not os.path.isfile(f'{path_prefix}{METADATA_EXT}'):
+        raise RuntimeError(f'Can\'t load the file "{path}"')
+    with open(f'{path_prefix}{METADATA_EXT}', "r", encoding="utf-8") as fin:
+        metadata = json.load(fin)
+    if format == "onnx":
+        return OnnxNetwork(path, metadata)
+    return TorchScriptNetwork(path, metadata, device)
@@ -1,17 +1,24 @@
-from . import alkalinity, bisulfite2d, chloride, iron2, iron3, ph, phosphate, sulfate
+from . import alkalinity, bisulfite2d, chloride, emulsion, iron2, iron3, ph, phosphate, redox, sulfate, suspended
+from ._cache import MemoryCache, digest_file, digest_params
 from ._default import WHITEBALANCE_STATS
+from ._export import EXPORT_FORMATS, ExportedNetwork, load_exported_network
 from ._model import Network
-from ._utils import compute_calibrated_pmf, correct_predicted_value
+from ._utils import PixelSampling, PotCircle, _batched, bgr_to_lab, compute_blank_spectrum, compute_roi_calibrated_pmf, correct_predicted_value, find_pot_circle, full_resolution_placeholder, read_image_shape, read_reduced_bgr_image, sample_analyte_mask, worker_pool
 from .typing import ChamberType
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Final, NamedTuple, Optional, Tuple
+from typing import Any, Callable, Dict, Final, Hashable, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Type, Union
+import asyncio
 import cv2
 import numpy as np
 import math
+import os
+import threading
 import torch
 
 
 ErrorCode = int
+RawPrediction = Tuple[ErrorCode, float]  # The error code of the sample (NO_ERROR or REDUCTION_REQUIRED_ERROR) and the value predicted by the network.
 
 
 NO_ERROR: Final[ErrorCode] = 0x000
@@ -70,527 +77,646 @@ SUSPENDED_BLANK_VALIDITY = timedelta(hours=8)
 REDOX_BLANK_VALIDITY = timedelta(hours=8)
 
 
+# The runtimes that can run the networks. Exported networks are loaded from the artifacts written by export_network next to the checkpoints.
+INFERENCE_BACKENDS: Final[Tuple[str, ...]] = ("checkpoint", *EXPORT_FORMATS)
+
+
+# The number of calibrated PMFs stacked in each forward pass of the network when estimating many samples.
+ESTIMATION_BATCH_SIZE: Final[int] = 32
+
+
+# The number of (raw prediction, error code) results kept by the facade, so estimating the same image against the same blank and network again (e.g., after
+# changing only the volumes) is answered without recomputation.
+RESULT_CACHE_SIZE: Final[int] = 4096
+
+
+# The version of the files written by AnalysisFacade.save_blanks.
+BLANKS_FILE_VERSION: Final[int] = 1
+
+
+# The number of threads that prepare samples for the network, and the number of samples submitted but not estimated yet, in estimation pipelines.
+PIPELINE_NUM_WORKERS: Final[int] = 2
+PIPELINE_MAX_IN_FLIGHT: Final[int] = 8
+
+
 class Blank(NamedTuple):
     data: Optional[np.ndarray]
     time: datetime
+    spectrum: Optional[np.ndarray] = None  # The spectrum of the PMF, computed once and reused by the calibration of every sample.
+    circle: Optional[PotCircle] = None  # The circle of the pot, used as the hint for the masks of every sample.
+    digest: Optional[str] = None  # Identifies the blank in the keys of memoized results.
+
+
+def _make_blank(blank_pmf: Optional[np.ndarray], circle: Optional[PotCircle] = None, time: Optional[datetime] = None) -> Blank:
+    time = time if time is not None else datetime.now()
+    if blank_pmf is None:
+        return Blank(None, time)
+    return Blank(blank_pmf, time, compute_blank_spectrum(blank_pmf), circle, digest_params(blank_pmf, tuple(circle) if circle is not None else None))
+
+
+class AnalytePipeline(NamedTuple):
+    compute_masks: Callable[..., Tuple[Tuple[np.ndarray, ...], Optional[np.ndarray], np.ndarray]]
+    compute_pmf: Callable[..., Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]]
+    network_class: Type[Network]
+    network_checkpoint: str
+    blank_validity: timedelta
+    lower_bound_warning: ErrorCode
+    upper_bound_warning: ErrorCode
+    pca_stats: Optional[str] = None  # Required by analytes whose PMFs are computed on principal components.
+
+
+ANALYTE_PIPELINES: Final[Dict[str, AnalytePipeline]] = {
+    "alkalinity": AnalytePipeline(alkalinity.compute_masks, alkalinity.compute_pmf, alkalinity.AlkalinityNetwork, alkalinity.NETWORK_CHECKPOINT, ALKALINITY_BLANK_VALIDITY, ALKALINITY_LOWER_BOUND_IMPRECISION_WARNING, ALKALINITY_UPPER_BOUND_IMPRECISION_WARNING),
+    "bisulfite": AnalytePipeline(bisulfite2d.compute_masks, bisulfite2d.compute_pmf, bisulfite2d.Bisulfite2DNetwork, bisulfite2d.NETWORK_CHECKPOINT, BISULFITE_BLANK_VALIDITY, BISULFITE_LOWER_BOUND_IMPRECISION_WARNING, BISULFITE_UPPER_BOUND_IMPRECISION_WARNING, bisulfite2d.PCA_STATS),
+    "chloride": AnalytePipeline(chloride.compute_masks, chloride.compute_pmf, chloride.ChlorideNetwork, chloride.NETWORK_CHECKPOINT, CHLORIDE_BLANK_VALIDITY, CHLORIDE_LOWER_BOUND_IMPRECISION_WARNING, CHLORIDE_UPPER_BOUND_IMPRECISION_WARNING, chloride.PCA_STATS),
+    "emulsion": AnalytePipeline(emulsion.compute_masks, emulsion.compute_pmf, emulsion.EmulsionNetwork, emulsion.NETWORK_CHECKPOINT, EMULSION_BLANK_VALIDITY, EMULSION_LOWER_BOUND_IMPRECISION_WARNING, EMULSION_UPPER_BOUND_IMPRECISION_WARNING, emulsion.PCA_STATS),
+    "iron2": AnalytePipeline(iron2.compute_masks, iron2.compute_pmf, iron2.Iron2Network, iron2.NETWORK_CHECKPOINT, IRON2_BLANK_VALIDITY, IRON2_LOWER_BOUND_IMPRECISION_WARNING, IRON2_UPPER_BOUND_IMPRECISION_WARNING, iron2.PCA_STATS),
+    "iron3": AnalytePipeline(iron3.compute_masks, iron3.compute_pmf, iron3.Iron3Network, iron3.NETWORK_CHECKPOINT, IRON3_BLANK_VALIDITY, IRON3_LOWER_BOUND_IMPRECISION_WARNING, IRON3_UPPER_BOUND_IMPRECISION_WARNING, iron3.PCA_STATS),
+    "ph": AnalytePipeline(ph.compute_masks, ph.compute_pmf, ph.PhNetwork, ph.NETWORK_CHECKPOINT, PH_BLANK_VALIDITY, PH_LOWER_BOUND_IMPRECISION_WARNING, PH_UPPER_BOUND_IMPRECISION_WARNING),
+    "phosphate": AnalytePipeline(phosphate.compute_masks, phosphate.compute_pmf, phosphate.PhosphateNetwork, phosphate.NETWORK_CHECKPOINT, PHOSPHATE_BLANK_VALIDITY, PHOSPHATE_LOWER_BOUND_IMPRECISION_WARNING, PHOSPHATE_UPPER_BOUND_IMPRECISION_WARNING, phosphate.PCA_STATS),
+    "redox": AnalytePipeline(redox.compute_masks, redox.compute_pmf, redox.RedoxNetwork, redox.NETWORK_CHECKPOINT, REDOX_BLANK_VALIDITY, REDOX_LOWER_BOUND_IMPRECISION_WARNING, REDOX_UPPER_BOUND_IMPRECISION_WARNING),
+    "sulfate": AnalytePipeline(sulfate.compute_masks, sulfate.compute_pmf, sulfate.SulfateNetwork, sulfate.NETWORK_CHECKPOINT, SULFATE_BLANK_VALIDITY, SULFATE_LOWER_BOUND_IMPRECISION_WARNING, SULFATE_UPPER_BOUND_IMPRECISION_WARNING),
+    "suspended": AnalytePipeline(suspended.compute_masks, suspended.compute_pmf, suspended.SuspendedNetwork, suspended.NETWORK_CHECKPOINT, SUSPENDED_BLANK_VALIDITY, SUSPENDED_LOWER_BOUND_IMPRECISION_WARNING, SUSPENDED_UPPER_BOUND_IMPRECISION_WARNING, suspended.PCA_STATS),
+}
+
+
+def _check_analyte(analyte: str) -> None:
+    if analyte not in ANALYTE_PIPELINES:
+        raise ValueError(f'Unknown analyte "{analyte}", expected one of {sorted(ANALYTE_PIPELINES)}')
 
 
 class AnalysisFacade:
-    def __init__(self) -> None:
+    def __init__(self, *, lut_pmf: bool = False, reduced_masks: bool = False, reuse_blank_geometry: bool = False, pixel_sampling: Optional[PixelSampling] = None, result_cache_size: int = RESULT_CACHE_SIZE, inference_backend: str = "checkpoint") -> None:
+        if inference_backend not in INFERENCE_BACKENDS:
+            raise ValueError(f'Unknown inference backend "{inference_backend}", expected one of {sorted(INFERENCE_BACKENDS)}')
         # Get device.
         self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Set whether the masks are estimated from images decoded at reduced scale.
+        self._reduced_masks = reduced_masks
+        # Set whether PMFs are computed from 8-bit L*a*b* through a lookup table of their distinct colors (with the same bins as the float path). It only applies to reduced masks,
+        # since otherwise the float L*a*b* image is computed anyway to estimate the masks.
+        self._lut_pmf = lut_pmf
+        # Set whether the circle of the pot found in the blank is verified in the samples instead of searched in the whole image.
+        self._reuse_blank_geometry = reuse_blank_geometry
+        # Set how the analyte pixels are sampled to compute PMFs, if not all of them are used.
+        self._pixel_sampling = pixel_sampling
         # Set blank samples.
-        self._alkalinity_blank = Blank(None, datetime.now())
-        self._bisulfite_blank = Blank(None, datetime.now())
-        self._chloride_blank = Blank(None, datetime.now())
-        self._emulsion_blank = Blank(None, datetime.now())
-        self._iron2_blank = Blank(None, datetime.now())
-        self._iron3_blank = Blank(None, datetime.now())
-        self._ph_blank = Blank(None, datetime.now())
-        self._phosphate_blank = Blank(None, datetime.now())
-        self._sulfate_blank = Blank(None, datetime.now())
-        self._suspension_blank = Blank(None, datetime.now())
-        self._redox_blank = Blank(None, datetime.now())
-        # Load checkpoint.
-        self._alkalinity_net = alkalinity.AlkalinityNetwork.load_from_checkpoint(alkalinity.NETWORK_CHECKPOINT).to(self._device)
-        self._alkalinity_net.eval()
-        self._bisulfite_net = bisulfite2d.Bisulfite2DNetwork.load_from_checkpoint(bisulfite2d.NETWORK_CHECKPOINT).to(self._device)
-        self._bisulfite_net.eval()
-        self._chloride_net = chloride.ChlorideNetwork.load_from_checkpoint(chloride.NETWORK_CHECKPOINT).to(self._device)
-        self._chloride_net.eval()
-        self._iron2_net = iron2.Iron2Network.load_from_checkpoint(iron2.NETWORK_CHECKPOINT).to(self._device)
-        self._iron2_net.eval()
-        self._ph_net = ph.PhNetwork.load_from_checkpoint(ph.NETWORK_CHECKPOINT).to(self._device)
-        self._ph_net.eval()
-        self._iron3_net = iron3.Iron3Network.load_from_checkpoint(iron3.NETWORK_CHECKPOINT).to(self._device)
-        self._iron3_net.eval()
-        self._phosphate_net = phosphate.PhosphateNetwork.load_from_checkpoint(phosphate.NETWORK_CHECKPOINT).to(self._device)
-        self._phosphate_net.eval()
-        self._sulfate_net = sulfate.SulfateNetwork.load_from_checkpoint(sulfate.NETWORK_CHECKPOINT).to(self._device)
-        self._sulfate_net.eval()
-        # Load PCA statistics.
-        stats = np.load(bisulfite2d.PCA_STATS)
-        self._bisulfite_lab_mean = stats["lab_mean"]
-        self._bisulfite_lab_sorted_eigenvectors = stats["lab_sorted_eigenvectors"]
-        stats = np.load(chloride.PCA_STATS)
-        self._chloride_lab_mean = stats["lab_mean"]
-        self._chloride_lab_sorted_eigenvectors = stats["lab_sorted_eigenvectors"]
-        stats = np.load(iron3.PCA_STATS)
-        self._iron3_lab_mean = stats["lab_mean"]
-        self._iron3_lab_sorted_eigenvectors = stats["lab_sorted_eigenvectors"]
-        stats = np.load(iron2.PCA_STATS)
-        self._iron2_lab_mean = stats["lab_mean"]
-        self._iron2_lab_sorted_eigenvectors = stats["lab_sorted_eigenvectors"]
-        stats = np.load(phosphate.PCA_STATS)
-        self._phosphate_lab_mean = stats["lab_mean"]
-        self._phosphate_lab_sorted_eigenvectors = stats["lab_sorted_eigenvectors"]
-        # Load white balance statistics.
-        self._whitebalance_stats = dict(np.load(WHITEBALANCE_STATS))
+        self._blanks: Dict[str, Blank] = {analyte: Blank(None, datetime.now()) for analyte in ANALYTE_PIPELINES}
+        # Set the runtime of the networks.
+        self._inference_backend = inference_backend
+        # Networks and statistics are loaded on first use, since a session usually measures a few analytes.
+        self._networks: Dict[str, Union[Network, ExportedNetwork]] = dict()
+        self._pca_stats: Dict[str, Dict[str, np.ndarray]] = dict()
+        self._whitebalance_stats: Optional[Dict[str, Any]] = None
+        self._resources_lock = threading.RLock()
+        # Set the memoized predictions, that don't depend on the volumes.
+        self._result_cache = MemoryCache(max_entries=result_cache_size) if result_cache_size > 0 else None
+
+    def _blank_stamp(self, analyte: str) -> str:
+        # Blanks are restored only by facades that would compute the same blank PMFs and use them with the same networks.
+        pipeline = ANALYTE_PIPELINES[analyte]
+        resources = tuple(digest_file(path) if path is not None and os.path.isfile(path) else None for path in (pipeline.network_checkpoint, pipeline.pca_stats))
+        return digest_params(analyte, self._lut_pmf, self._reduced_masks, self._reuse_blank_geometry, tuple(self._pixel_sampling) if self._pixel_sampling is not None else None, resources)
 
     def _check_blank(self, blank: Blank, validity: timedelta) -> ErrorCode:
-        blank_data, blank_time = blank
+        blank_data, blank_time, _, _, _ = blank
         if blank_data is None:
             return BLANK_REQUIRED_ERROR
         elif (datetime.now() - blank_time) > validity:
             return FRESH_BLANK_REQUIRED_ERROR
         return NO_ERROR
 
-    def _get_version(self, net: Network) -> str:
+    def _compute_lab_image_and_analyte_mask(self, path: str, compute_masks: Callable[..., Tuple[Tuple[np.ndarray, ...], Optional[np.ndarray], np.ndarray]], circle_hint: Optional[PotCircle] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        bgr_img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if not self._reduced_masks:
+            (_, _, analyte_msk), lab_img, lab_white = compute_masks(bgr_img=bgr_img, lab_img=None, chamber_type=ChamberType.POT, circle_hint=circle_hint)
+            return lab_img, analyte_msk if self._pixel_sampling is None else sample_analyte_mask(analyte_msk, self._pixel_sampling), lab_white
+        # Estimate the masks from the image decoded at reduced scale.
+        (_, _, analyte_msk), _, lab_white = compute_masks(bgr_img=bgr_img, lab_img=None, chamber_type=ChamberType.POT, reduced_bgr_img=read_reduced_bgr_image(path), circle_hint=circle_hint)
+        # Convert to L*a*b* only the bounding box of the analyte at full resolution, as the PMF depends on the analyte pixels only.
+        rows, cols = np.flatnonzero(analyte_msk.any(axis=1)), np.flatnonzero(analyte_msk.any(axis=0))
+        if len(rows) == 0:
+            return np.empty((0, 0, 3), dtype=np.uint8 if self._lut_pmf else np.float32), np.empty((0, 0), dtype=analyte_msk.dtype), lab_white
+        if self._pixel_sampling is not None:
+            # Convert to L*a*b* only the sampled pixels, as a single column image.
+            sampled_bgr_pixels = bgr_img[sample_analyte_mask(analyte_msk, self._pixel_sampling)][:, np.newaxis, :]
+            sampled_lab_pixels = cv2.cvtColor(sampled_bgr_pixels, cv2.COLOR_BGR2LAB) if self._lut_pmf else bgr_to_lab(sampled_bgr_pixels)
+            return sampled_lab_pixels, np.ones(sampled_lab_pixels.shape[:2], dtype=np.bool_), lab_white
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        analyte_bgr_img = bgr_img[top:bottom, left:right]
+        analyte_lab_img = cv2.cvtColor(analyte_bgr_img, cv2.COLOR_BGR2LAB) if self._lut_pmf else bgr_to_lab(analyte_bgr_img)
+        return analyte_lab_img, analyte_msk[top:bottom, left:right], lab_white
+
+    def _compute_pmf(self, analyte: str, path: str, circle_hint: Optional[PotCircle] = None) -> np.ndarray:
+        pipeline = ANALYTE_PIPELINES[analyte]
+        lab_img, analyte_msk, lab_white = self._compute_lab_image_and_analyte_mask(path, pipeline.compute_masks, circle_hint)
+        pca_kwargs = self._get_pca_stats(analyte) if pipeline.pca_stats is not None else dict()
+        pmf, _ = pipeline.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, **pca_kwargs, with_img_to_pmf=False)
+        return pmf
+
+    def _compute_roi(self, analyte: str, sample_path: str, blank: Blank, input_roi: Tuple[Tuple[int, int], ...]) -> np.ndarray:
+        # Compute the ROI of the calibrated PMF for the sample. It doesn't use the network, so it can run on worker threads.
+        blank_pmf, _, blank_spectrum, blank_circle, _ = blank
+        assert blank_pmf is not None and blank_spectrum is not None
+        sample_pmf = self._compute_pmf(analyte, sample_path, blank_circle)
+        return compute_roi_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf, roi=input_roi, blank_spectrum=blank_spectrum)
+
+    def _network(self, analyte: str) -> Union[Network, ExportedNetwork]:
+        net = self._networks.get(analyte)
+        if net is None:
+            # Load the network once, even if it is requested by concurrent calls (e.g., during a preload in background).
+            with self._resources_lock:
+                net = self._networks.get(analyte)
+                if net is None:
+                    pipeline = ANALYTE_PIPELINES[analyte]
+                    if self._inference_backend == "checkpoint":
+                        net = pipeline.network_class.load_from_checkpoint(pipeline.network_checkpoint).to(self._device)
+                        net.eval()
+                    else:
+                        net = load_exported_network(os.path.splitext(pipeline.network_checkpoint)[0], self._inference_backend, self._device)
+                    self._networks[analyte] = net
+        return net
+
+    def _predict_rois(self, analyte: str, rois: Sequence[np.ndarray]) -> List[RawPrediction]:
+        # Predict the values of a batch of ROIs of calibrated PMFs with one forward pass of the network.
+        predictions: List[RawPrediction] = [(REDUCTION_REQUIRED_ERROR, float("NaN"))] * len(rois)
+        # Samples whose 10% of the pixels don't fall on the ROI require reduction, and are not estimated. ROIs of empty analyte masks are NaN, and are estimated
+        # as NaN, so they are reported as ESTIMATION_ERROR.
+        indices = [index for index, roi in enumerate(rois) if not roi.sum() <= 0.90]
+        if len(indices) == 0:
+            return predictions
+        with torch.no_grad():
+            values, _ = self._network(analyte)(torch.as_tensor(np.stack([rois[index] for index in indices]), dtype=torch.float32, device=self._device))
+        for index, value in zip(indices, values.reshape(len(indices), -1)[:, 0].tolist()):
+            predictions[index] = (NO_ERROR, value)
+        return predictions
+
+    def _find_blank_circle(self, path: str) -> Optional[PotCircle]:
+        if not self._reuse_blank_geometry:
+            return None
+        if self._reduced_masks:
+            # The circle is found in the image decoded at reduced scale, so only the shape of the full resolution image is read.
+            return find_pot_circle(full_resolution_placeholder(read_image_shape(path)), reduced_bgr_img=read_reduced_bgr_image(path))
+        return find_pot_circle(cv2.imread(path, cv2.IMREAD_COLOR))
+
+    def _get_whitebalance_stats(self) -> Dict[str, Any]:
+        if self._whitebalance_stats is None:
+            with self._resources_lock:
+                if self._whitebalance_stats is None:
+                    self._whitebalance_stats = dict(np.load(WHITEBALANCE_STATS))
+        return self._whitebalance_stats
+
+    def _get_pca_stats(self, analyte: str) -> Dict[str, np.ndarray]:
+        stats = self._pca_stats.get(analyte)
+        if stats is None:
+            with self._resources_lock:
+                stats = self._pca_stats.get(analyte)
+                if stats is None:
+                    with np.load(ANALYTE_PIPELINES[analyte].pca_stats) as stored:
+                        stats = {"lab_mean": stored["lab_mean"], "lab_sorted_eigenvectors": stored["lab_sorted_eigenvectors"]}
+                    self._pca_stats[analyte] = stats
+        return stats
+
+    def _make_estimate(self, analyte: str, prediction: RawPrediction, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        # Apply correction due to reduction and check the predicted value against the expected range of the network.
+        pipeline = ANALYTE_PIPELINES[analyte]
+        error_code, value = prediction
+        if error_code != NO_ERROR:
+            return error_code, float("NaN"), float("NaN")
+        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
+        if math.isnan(value) or value < 0.0:
+            return ESTIMATION_ERROR, float("NaN"), float("NaN")
+        lower, upper = self._network(analyte).expected_range
+        if value <= lower:
+            error_code = pipeline.lower_bound_warning
+        elif value >= upper:
+            error_code = pipeline.upper_bound_warning
+        return error_code, float(value), float(corrected_value)
+
+    def _get_version(self, net: Union[Network, ExportedNetwork]) -> str:
         return net.version if hasattr(net, "version") else f"{net.__class__.__name__}-UnknownVersion"
 
+    def _memoize_prediction(self, key: Optional[Hashable], prediction: RawPrediction) -> None:
+        if key is not None and self._result_cache is not None:
+            self._result_cache.put(key, prediction)
+
+    def _memoized_prediction(self, key: Optional[Hashable]) -> Optional[RawPrediction]:
+        if key is None or self._result_cache is None:
+            return None
+        return self._result_cache.get(key)
+
+    def _result_key(self, analyte: str, sample_path: str, blank: Blank) -> Optional[Hashable]:
+        # The prediction depends on the content of the image, the blank and the network only, as the settings of the facade don't change.
+        if self._result_cache is None:
+            return None
+        return analyte, digest_file(sample_path), blank.digest, self._get_version(self._network(analyte))
+
+    def check_blank(self, analyte: str) -> ErrorCode:
+        _check_analyte(analyte)
+        return self._check_blank(self._blanks[analyte], ANALYTE_PIPELINES[analyte].blank_validity)
+
     def check_alkalinity_blank(self) -> ErrorCode:
-        return self._check_blank(self._alkalinity_blank, ALKALINITY_BLANK_VALIDITY)
+        return self.check_blank("alkalinity")
 
     def check_bisulfite_blank(self) -> ErrorCode:
-        return self._check_blank(self._bisulfite_blank, BISULFITE_BLANK_VALIDITY)
-    
+        return self.check_blank("bisulfite")
+
     def check_chloride_blank(self) -> ErrorCode:
-        return self._check_blank(self._chloride_blank, CHLORIDE_BLANK_VALIDITY)
-    
+        return self.check_blank("chloride")
+
     def check_emulsion_blank(self) -> ErrorCode:
-        return self._check_blank(self._emulsion_blank, EMULSION_BLANK_VALIDITY)
-    
+        return self.check_blank("emulsion")
+
     def check_iron2_blank(self) -> ErrorCode:
-        return self._check_blank(self._iron2_blank, IRON2_BLANK_VALIDITY)
-    
+        return self.check_blank("iron2")
+
     def check_iron3_blank(self) -> ErrorCode:
-        return self._check_blank(self._iron3_blank, IRON3_BLANK_VALIDITY)
-    
+        return self.check_blank("iron3")
+
     def check_ph_blank(self) -> ErrorCode:
-        return self._check_blank(self._ph_blank, PH_BLANK_VALIDITY)
-    
+        return self.check_blank("ph")
+
     def check_phosphate_blank(self) -> ErrorCode:
-        return self._check_blank(self._phosphate_blank, PHOSPHATE_BLANK_VALIDITY)
+        return self.check_blank("phosphate")
+
+    def check_redox_blank(self) -> ErrorCode:
+        return self.check_blank("redox")
 
     def check_sulfate_blank(self) -> ErrorCode:
-        return self._check_blank(self._sulfate_blank, SULFATE_BLANK_VALIDITY)
-    
+        return self.check_blank("sulfate")
+
     def check_suspended_blank(self) -> ErrorCode:
-        return self._check_blank(self._suspended_blank, SUSPENDED_BLANK_VALIDITY)
-    
-    def check_redox_blank(self) -> ErrorCode:
-        return self._check_blank(self._redox_blank, REDOX_BLANK_VALIDITY)
+        return self.check_blank("suspended")
+
+    def estimate(self, analyte: str, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        return self.estimate_batch(analyte, [sample_path], [standard_volume], [used_volume])[0]
 
     def estimate_alkalinity(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_alkalinity_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._alkalinity_blank
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        assert blank_pmf is not None
-        (_, _, analyte_msk), lab_img, lab_white = alkalinity.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = alkalinity.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._alkalinity_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1, bounds[1][0]:bounds[1][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the alkalinity and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._alkalinity_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._alkalinity_net.expected_range
-        if value <= lower:
-            error_code = ALKALINITY_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = ALKALINITY_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
+        return self.estimate("alkalinity", sample_path, standard_volume, used_volume)
 
     def estimate_bisulfite_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_bisulfite_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._bisulfite_blank
-        assert blank_pmf is not None
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        (_, _, analyte_msk), lab_img, lab_white = bisulfite2d.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = bisulfite2d.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._bisulfite_lab_mean, lab_sorted_eigenvectors=self._bisulfite_lab_sorted_eigenvectors)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._bisulfite_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1, bounds[1][0]:bounds[1][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the concentration and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._bisulfite_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._bisulfite_net.expected_range
-        if value <= lower:
-            error_code = BISULFITE_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = BISULFITE_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
+        return self.estimate("bisulfite", sample_path, standard_volume, used_volume)
 
     def estimate_chloride_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_chloride_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._chloride_blank
-        assert blank_pmf is not None
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        (_, _, analyte_msk), lab_img, lab_white = chloride.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = chloride.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._chloride_lab_mean, lab_sorted_eigenvectors=self._chloride_lab_sorted_eigenvectors)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._chloride_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1, bounds[1][0]:bounds[1][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the concentration and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._chloride_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._chloride_net.expected_range
-        if value <= lower:
-            error_code = CHLORIDE_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = CHLORIDE_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
-    
-    def estimate_iron3_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_iron3_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._iron3_blank
-        assert blank_pmf is not None
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        (_, _, analyte_msk), lab_img, lab_white = iron3.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = iron3.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._iron3_lab_mean, lab_sorted_eigenvectors=self._iron3_lab_sorted_eigenvectors)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._iron3_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the concentration and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._iron3_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._iron3_net.expected_range
-        if value <= lower:
-            error_code = IRON3_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = IRON3_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
-    
+        return self.estimate("chloride", sample_path, standard_volume, used_volume)
+
+    def estimate_emulsion_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        return self.estimate("emulsion", sample_path, standard_volume, used_volume)
+
     def estimate_iron2_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_iron2_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._iron2_blank
-        assert blank_pmf is not None
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        (_, _, analyte_msk), lab_img, lab_white = iron2.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = iron2.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._iron2_lab_mean, lab_sorted_eigenvectors=self._iron2_lab_sorted_eigenvectors)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._iron2_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the concentration and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._iron2_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._iron2_net.expected_range
-        if value <= lower:
-            error_code = IRON2_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = IRON2_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
-    
+        return self.estimate("iron2", sample_path, standard_volume, used_volume)
+
+    def estimate_iron3_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        return self.estimate("iron3", sample_path, standard_volume, used_volume)
+
     def estimate_ph_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_ph_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._ph_blank
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        assert blank_pmf is not None
-        (_, _, analyte_msk), lab_img, lab_white = ph.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = ph.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._ph_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1, bounds[1][0]:bounds[1][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the ph and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._ph_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._ph_net.expected_range
-        if value <= lower:
-            error_code = PH_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = PH_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
+        return self.estimate("ph", sample_path, standard_volume, used_volume)
 
     def estimate_phosphate_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
-        # Check blank sample integrity.
-        error_code = self.check_phosphate_blank()
-        if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._phosphate_blank
-        assert blank_pmf is not None
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        (_, _, analyte_msk), lab_img, lab_white = phosphate.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = phosphate.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._phosphate_lab_mean, lab_sorted_eigenvectors=self._phosphate_lab_sorted_eigenvectors)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._phosphate_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the concentration and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._phosphate_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._phosphate_net.expected_range
-        if value <= lower:
-            error_code = PHOSPHATE_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = PHOSPHATE_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
+        return self.estimate("phosphate", sample_path, standard_volume, used_volume)
+
+    def estimate_redox(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        return self.estimate("redox", sample_path, standard_volume, used_volume)
 
     def estimate_sulfate_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        return self.estimate("sulfate", sample_path, standard_volume, used_volume)
+
+    def estimate_suspended_concentration(self, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        return self.estimate("suspended", sample_path, standard_volume, used_volume)
+
+    def estimate_batch(self, analyte: str, sample_paths: Sequence[str], standard_volumes: Sequence[float], used_volumes: Sequence[float], *, batch_size: int = ESTIMATION_BATCH_SIZE, num_workers: int = 0) -> List[Tuple[ErrorCode, float, float]]:
+        # Estimate many samples of the analyte against its current blank, with the same results as calling estimate for each sample. The ROIs of calibrated PMFs
+        # are computed on a pool of threads (OpenCV and NumPy release the GIL), while the network estimates the ones already computed in batches.
+        _check_analyte(analyte)
+        if not (len(sample_paths) == len(standard_volumes) == len(used_volumes)):
+            raise ValueError(f'Expected the same number of sample paths ({len(sample_paths)}), standard volumes ({len(standard_volumes)}) and used volumes ({len(used_volumes)})')
+        if batch_size <= 0:
+            raise ValueError(f'Invalid batch size {batch_size}, expected a positive value')
         # Check blank sample integrity.
-        error_code = self.check_sulfate_blank()
+        blank = self._blanks[analyte]
+        error_code = self._check_blank(blank, ANALYTE_PIPELINES[analyte].blank_validity)
         if error_code != NO_ERROR:
-            return error_code, float("NaN"), float("NaN")
-        # Compute the calibrated PMF for the sample.
-        blank_pmf, _ = self._sulfate_blank
-        assert blank_pmf is not None
-        sample_img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
-        (_, _, analyte_msk), lab_img, lab_white = sulfate.compute_masks(bgr_img=sample_img, lab_img=None, chamber_type=ChamberType.POT)
-        sample_pmf, _ = sulfate.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white)
-        calibrated_pmf = compute_calibrated_pmf(blank_pmf=blank_pmf, sample_pmf=sample_pmf)
-        # Check whether the sample can be processed.
-        bounds = self._sulfate_net.input_roi
-        roi = calibrated_pmf[bounds[0][0]:bounds[0][1]+1]
-        if roi.sum() <= 0.90:
-            return REDUCTION_REQUIRED_ERROR, float("NaN"), float("NaN")  # 10% of the pixels samples doesn't fall on the ROI. Reduction is required.
-        # Estimate the concentration and apply correction due to reduction.
-        with torch.no_grad():
-            value, _ = self._sulfate_net(torch.as_tensor(calibrated_pmf, dtype=torch.float32, device=self._device).unsqueeze(0))
-        corrected_value = correct_predicted_value(value, standard_volume, used_volume)
-        if math.isnan(value) or value < 0.0:
-            return ESTIMATION_ERROR, float("NaN"), float("NaN")
-        # Return the estimated and the corrected values.
-        lower, upper = self._sulfate_net.expected_range
-        if value <= lower:
-            error_code = SULFATE_LOWER_BOUND_IMPRECISION_WARNING
-        elif value >= upper:
-            error_code = SULFATE_UPPER_BOUND_IMPRECISION_WARNING
-        return error_code, float(value), float(corrected_value)
+            return [(error_code, float("NaN"), float("NaN"))] * len(sample_paths)
+        # Reuse the memoized predictions.
+        keys = [self._result_key(analyte, sample_path, blank) for sample_path in sample_paths]
+        predictions = [self._memoized_prediction(key) for key in keys]
+        # Compute the ROIs of the calibrated PMFs and predict the values of the other samples.
+        input_roi = self._network(analyte).input_roi
+        missing = [index for index, prediction in enumerate(predictions) if prediction is None]
+        with worker_pool(num_workers) as map_func:
+            rois = map_func(lambda index: self._compute_roi(analyte, sample_paths[index], blank, input_roi), missing)
+            for batch in _batched(zip(missing, rois), batch_size):
+                for (index, _), prediction in zip(batch, self._predict_rois(analyte, [roi for _, roi in batch])):
+                    predictions[index] = prediction
+                    self._memoize_prediction(keys[index], prediction)
+        return [self._make_estimate(analyte, prediction, standard_volume, used_volume) for prediction, standard_volume, used_volume in zip(predictions, standard_volumes, used_volumes)]
+
+    def clear_result_cache(self) -> None:
+        if self._result_cache is not None:
+            self._result_cache.clear()
+
+    def forget_blank(self, analyte: str) -> None:
+        self.set_blank(analyte, None)
 
     def forget_alkalinity_blank(self) -> None:
-        self.set_alkalinity_blank(None)
+        self.forget_blank("alkalinity")
 
     def forget_bisulfite_blank(self) -> None:
-        self.set_bisulfite_blank(None)
+        self.forget_blank("bisulfite")
 
     def forget_chloride_blank(self) -> None:
-        self.set_chloride_blank(None)
-        
+        self.forget_blank("chloride")
+
     def forget_emulsion_blank(self) -> None:
-        self.set_emulsion_blank(None)
-        
+        self.forget_blank("emulsion")
+
     def forget_iron2_blank(self) -> None:
-        self.set_iron2_blank(None)
+        self.forget_blank("iron2")
 
     def forget_iron3_blank(self) -> None:
-        self.set_iron3_blank(None)
+        self.forget_blank("iron3")
 
     def forget_ph_blank(self) -> None:
-        self.set_ph_blank(None)
+        self.forget_blank("ph")
 
     def forget_phosphate_blank(self) -> None:
-        self.set_phosphate_blank(None)
+        self.forget_blank("phosphate")
+
+    def forget_redox_blank(self) -> None:
+        self.forget_blank("redox")
 
     def forget_sulfate_blank(self) -> None:
-        self.set_sulfate_blank(None)
-        
+        self.forget_blank("sulfate")
+
     def forget_suspended_blank(self) -> None:
-        self.set_suspended_blank(None)
-        
-    def forget_redox_blank(self) -> None:
-        self.set_redox_blank(None)
+        self.forget_blank("suspended")
+
+    def get_network_version(self, analyte: str) -> str:
+        _check_analyte(analyte)
+        return self._get_version(self._network(analyte))
+
+    def get_result_cache_stats(self) -> Dict[str, int]:
+        # The hits, misses and entries of the memoized predictions, or nothing if they are disabled.
+        return self._result_cache.stats() if self._result_cache is not None else dict()
+
+    def get_range(self, analyte: str) -> Tuple[float, float]:
+        _check_analyte(analyte)
+        return self._network(analyte).expected_range
 
     def get_alkalinity_network_version(self) -> str:
-        return self._get_version(self._alkalinity_net)
+        return self.get_network_version("alkalinity")
 
     def get_alkalinity_range(self) -> Tuple[float, float]:
-        return self._alkalinity_net.expected_range
+        return self.get_range("alkalinity")
 
     def get_bisulfite_network_version(self) -> str:
-        return self._get_version(self._bisulfite_net)
+        return self.get_network_version("bisulfite")
 
     def get_bisulfite_range(self) -> Tuple[float, float]:
-        return self._bisulfite_net.expected_range
+        return self.get_range("bisulfite")
 
     def get_chloride_network_version(self) -> str:
-        return self._get_version(self._chloride_net)
+        return self.get_network_version("chloride")
 
     def get_chloride_range(self) -> Tuple[float, float]:
-        return self._chloride_net.expected_range
-    
-    def get_iron3_network_version(self) -> str:
-        return self._get_version(self._iron3_net)
-    
-    def get_iron3_range(self) -> Tuple[float, float]:
-        return self._iron3_net.expected_range
-    
-    
+        return self.get_range("chloride")
+
+    def get_emulsion_network_version(self) -> str:
+        return self.get_network_version("emulsion")
+
+    def get_emulsion_range(self) -> Tuple[float, float]:
+        return self.get_range("emulsion")
+
     def get_iron2_network_version(self) -> str:
-        return self._get_version(self._iron2_net)
-    
+        return self.get_network_version("iron2")
+
     def get_iron2_range(self) -> Tuple[float, float]:
-        return self._iron2_net.expected_range
-    
+        return self.get_range("iron2")
+
+    def get_iron3_network_version(self) -> str:
+        return self.get_network_version("iron3")
+
+    def get_iron3_range(self) -> Tuple[float, float]:
+        return self.get_range("iron3")
+
     def get_ph_network_version(self) -> str:
-        return self._get_version(self._ph_net)
+        return self.get_network_version("ph")
 
     def get_ph_range(self) -> Tuple[float, float]:
-        return self._ph_net.expected_range
+        return self.get_range("ph")
 
     def get_phosphate_network_version(self) -> str:
-        return self._get_version(self._phosphate_net)
+        return self.get_network_version("phosphate")
 
     def get_phosphate_range(self) -> Tuple[float, float]:
-        return self._phosphate_net.expected_range
+        return self.get_range("phosphate")
+
+    def get_redox_network_version(self) -> str:
+        return self.get_network_version("redox")
+
+    def get_redox_range(self) -> Tuple[float, float]:
+        return self.get_range("redox")
 
     def get_sulfate_network_version(self) -> str:
-        return self._get_version(self._sulfate_net)
+        return self.get_network_version("sulfate")
 
     def get_sulfate_range(self) -> Tuple[float, float]:
-        return self._sulfate_net.expected_range
+        return self.get_range("sulfate")
+
+    def get_suspended_network_version(self) -> str:
+        return self.get_network_version("suspended")
+
+    def get_suspended_range(self) -> Tuple[float, float]:
+        return self.get_range("suspended")
+
+    def load_blanks(self, path: str) -> List[str]:
+        # Restore the blanks saved by save_blanks, keeping their capture time so their validity still applies. Blanks saved with other settings, networks or PCA
+        # statistics are ignored. Return the restored analytes.
+        restored: List[str] = list()
+        with np.load(path) as npz:
+            if "version" not in npz.files or int(npz["version"]) != BLANKS_FILE_VERSION:
+                raise RuntimeError(f'Can\'t load the file "{path}"')
+            for analyte in ANALYTE_PIPELINES:
+                if f'{analyte}_pmf' not in npz.files or str(npz[f'{analyte}_stamp']) != self._blank_stamp(analyte):
+                    continue
+                circle = npz[f'{analyte}_circle']
+                self._blanks[analyte] = _make_blank(npz[f'{analyte}_pmf'], PotCircle(*circle.tolist()) if len(circle) == 3 else None, datetime.fromtimestamp(float(npz[f'{analyte}_time'])))
+                restored.append(analyte)
+        return restored
+
+    def preload(self, analytes: Optional[Iterable[str]] = None, *, background: bool = False) -> Optional[threading.Thread]:
+        # Load the networks and statistics of the given analytes (all, by default), so the first estimation is not delayed by them.
+        analytes = list(ANALYTE_PIPELINES.keys()) if analytes is None else list(analytes)
+        for analyte in analytes:
+            _check_analyte(analyte)
+        def load() -> None:
+            for analyte in analytes:
+                self._network(analyte)
+                if ANALYTE_PIPELINES[analyte].pca_stats is not None:
+                    self._get_pca_stats(analyte)
+            self._get_whitebalance_stats()
+        if not background:
+            load()
+            return None
+        thread = threading.Thread(target=load, name="AnalysisFacade.preload", daemon=True)
+        thread.start()
+        return thread
+
+    def save_blanks(self, path: str) -> None:
+        # Save the current blanks, so a later session can restore them with load_blanks instead of computing them again. The spectra of the blank PMFs are
+        # computed again on restore, as they are much larger than the PMFs.
+        arrays: Dict[str, np.ndarray] = {"version": np.asarray(BLANKS_FILE_VERSION)}
+        for analyte, blank in self._blanks.items():
+            if blank.data is None:
+                continue
+            arrays[f'{analyte}_pmf'] = blank.data
+            arrays[f'{analyte}_time'] = np.asarray(blank.time.timestamp(), dtype=np.float64)
+            arrays[f'{analyte}_circle'] = np.asarray(blank.circle if blank.circle is not None else (), dtype=np.float64)  # shape = (3,), or (0,) if there is no circle.
+            arrays[f'{analyte}_stamp'] = np.asarray(self._blank_stamp(analyte))
+        # Write to a temporary file first, so an interrupted save never leaves a partially written file.
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, "wb") as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(tmp_path, path)
+
+    def set_blank(self, analyte: str, blank_path: Optional[str]) -> None:
+        _check_analyte(analyte)
+        if blank_path is None:
+            self._blanks[analyte] = _make_blank(None)
+            return
+        blank_circle = self._find_blank_circle(blank_path)
+        self._blanks[analyte] = _make_blank(self._compute_pmf(analyte, blank_path, blank_circle), blank_circle)
 
     def set_alkalinity_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = alkalinity.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = alkalinity.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white)
-        self._alkalinity_blank = Blank(blank_pmf, datetime.now())
-    
+        self.set_blank("alkalinity", blank_path)
+
     def set_bisulfite_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = bisulfite2d.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = bisulfite2d.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._bisulfite_lab_mean, lab_sorted_eigenvectors=self._bisulfite_lab_sorted_eigenvectors)
-        self._bisulfite_blank = Blank(blank_pmf, datetime.now())
-    
+        self.set_blank("bisulfite", blank_path)
+
     def set_chloride_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = chloride.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = chloride.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._chloride_lab_mean, lab_sorted_eigenvectors=self._chloride_lab_sorted_eigenvectors)
-        self._chloride_blank = Blank(blank_pmf, datetime.now())
-    
+        self.set_blank("chloride", blank_path)
+
     def set_emulsion_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_pmf = np.zeros((1, 1), dtype=np.float32)
-        self._emulsion_blank = Blank(blank_pmf, datetime.now())
-    
+        self.set_blank("emulsion", blank_path)
+
     def set_iron2_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = iron2.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = iron2.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._iron2_lab_mean, lab_sorted_eigenvectors=self._iron2_lab_sorted_eigenvectors)
-        self._iron2_blank = Blank(blank_pmf, datetime.now())
+        self.set_blank("iron2", blank_path)
 
     def set_iron3_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = iron3.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = iron3.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._iron3_lab_mean, lab_sorted_eigenvectors=self._iron3_lab_sorted_eigenvectors)
-        self._iron3_blank = Blank(blank_pmf, datetime.now())
+        self.set_blank("iron3", blank_path)
 
-    
     def set_ph_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = ph.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = ph.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white)
-        self._ph_blank = Blank(blank_pmf, datetime.now())
+        self.set_blank("ph", blank_path)
 
     def set_phosphate_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = phosphate.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = phosphate.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._phosphate_lab_mean, lab_sorted_eigenvectors=self._phosphate_lab_sorted_eigenvectors)
-        self._phosphate_blank = Blank(blank_pmf, datetime.now())
+        self.set_blank("phosphate", blank_path)
+
+    def set_redox_blank(self, blank_path: Optional[str]) -> None:
+        self.set_blank("redox", blank_path)
 
     def set_sulfate_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_img = cv2.imread(blank_path, cv2.IMREAD_COLOR)
-            (_, _, analyte_msk), lab_img, lab_white = sulfate.compute_masks(bgr_img=blank_img, lab_img=None, chamber_type=ChamberType.POT)
-            blank_pmf, _ = sulfate.compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white)
-        self._sulfate_blank = Blank(blank_pmf, datetime.now())
-    
+        self.set_blank("sulfate", blank_path)
+
     def set_suspended_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
+        self.set_blank("suspended", blank_path)
+
+    def unload(self, analyte: str) -> None:
+        # Release the network and statistics of the analyte. The blank is kept, and they are loaded again on the next use.
+        _check_analyte(analyte)
+        with self._resources_lock:
+            self._networks.pop(analyte, None)
+            self._pca_stats.pop(analyte, None)
+        if self._device == "cuda":
+            torch.cuda.empty_cache()
+
+
+class PreparedSample(NamedTuple):
+    key: Optional[Hashable]
+    prediction: Optional[RawPrediction]  # The memoized prediction of the sample, if any.
+    roi: Optional[np.ndarray]  # The ROI of the calibrated PMF, computed only when the prediction is not memoized.
+
+
+class EstimationPipeline:
+    def __init__(self, facade: AnalysisFacade, *, num_workers: int = PIPELINE_NUM_WORKERS, max_in_flight: int = PIPELINE_MAX_IN_FLIGHT) -> None:
+        if num_workers <= 0:
+            raise ValueError(f'Invalid number of workers {num_workers}, expected a positive value')
+        if max_in_flight <= 0:
+            raise ValueError(f'Invalid number of samples in flight {max_in_flight}, expected a positive value')
+        self._facade = facade
+        # Decoding, masks, PMFs and calibration of the next samples run on the preprocessing threads while the network estimates the current sample on the
+        # inference thread.
+        self._preprocessing = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="EstimationPipeline-preprocessing")
+        self._inference = ThreadPoolExecutor(max_workers=1, thread_name_prefix="EstimationPipeline-inference")
+        # Submissions block while max_in_flight samples are not estimated yet.
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def __enter__(self) -> "EstimationPipeline":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    def _dispatch(self, analyte: str, prepared_future: "Future[PreparedSample]", standard_volume: float, used_volume: float, result: "Future[Tuple[ErrorCode, float, float]]") -> None:
+        # Memoized predictions and failed preprocessing don't need the network, so they don't wait behind the samples queued for inference.
+        if not prepared_future.cancelled() and prepared_future.exception() is None and prepared_future.result().prediction is None:
+            try:
+                self._inference.submit(self._estimate, analyte, prepared_future, standard_volume, used_volume, result)
+                return
+            except BaseException as error:
+                # The pipeline was closed meanwhile, the result must be resolved anyway to release its slot.
+                if result.set_running_or_notify_cancel():
+                    result.set_exception(error)
+                return
+        self._estimate(analyte, prepared_future, standard_volume, used_volume, result)
+
+    def _estimate(self, analyte: str, prepared_future: "Future[PreparedSample]", standard_volume: float, used_volume: float, result: "Future[Tuple[ErrorCode, float, float]]") -> None:
+        if not result.set_running_or_notify_cancel():
+            return
+        try:
+            key, prediction, roi = prepared_future.result()
+            if prediction is None:
+                prediction, = self._facade._predict_rois(analyte, [roi])
+                self._facade._memoize_prediction(key, prediction)
+            estimate = self._facade._make_estimate(analyte, prediction, standard_volume, used_volume)
+        except BaseException as error:
+            result.set_exception(error)
         else:
-            blank_pmf = np.zeros((1, 1), dtype=np.float32)
-        self._suspended_blank = Blank(blank_pmf, datetime.now())
-    
-    def set_redox_blank(self, blank_path: Optional[str]) -> None:
-        if blank_path is None:
-            blank_pmf = None
-        else:
-            blank_pmf = np.zeros((1, 1), dtype=np.float32)
-        self._redox_blank = Blank(blank_pmf, datetime.now())
+            result.set_result(estimate)
+
+    def _prepare(self, analyte: str, sample_path: str, blank: Blank, input_roi: Tuple[Tuple[int, int], ...]) -> PreparedSample:
+        # Hashing the image for the memoized predictions is as slow as reading it, so it runs on the preprocessing threads too.
+        key = self._facade._result_key(analyte, sample_path, blank)
+        prediction = self._facade._memoized_prediction(key)
+        if prediction is not None:
+            return PreparedSample(key, prediction, None)
+        return PreparedSample(key, None, self._facade._compute_roi(analyte, sample_path, blank, input_roi))
+
+    def close(self) -> None:
+        # Wait for the samples in flight to be estimated.
+        self._preprocessing.shutdown(wait=True)
+        self._inference.shutdown(wait=True)
+
+    async def estimate_async(self, analyte: str, sample_path: str, standard_volume: float, used_volume: float) -> Tuple[ErrorCode, float, float]:
+        # The same as submit, but waiting for room in the pipeline without blocking the event loop.
+        loop = asyncio.get_running_loop()
+        return await asyncio.wrap_future(await loop.run_in_executor(None, self.submit, analyte, sample_path, standard_volume, used_volume))
+
+    def submit(self, analyte: str, sample_path: str, standard_volume: float, used_volume: float) -> "Future[Tuple[ErrorCode, float, float]]":
+        # Schedule the estimation of the sample against the current blank of the analyte, with the same result as AnalysisFacade.estimate.
+        result: "Future[Tuple[ErrorCode, float, float]]" = Future()
+        error_code = self._facade.check_blank(analyte)
+        if error_code != NO_ERROR:
+            result.set_result((error_code, float("NaN"), float("NaN")))
+            return result
+        blank = self._facade._blanks[analyte]
+        input_roi = self._facade._network(analyte).input_roi
+        self._in_flight.acquire()
+        result.add_done_callback(lambda _: self._in_flight.release())
+        try:
+            prepared_future = self._preprocessing.submit(self._prepare, analyte, sample_path, blank, input_roi)
+        except BaseException as error:
+            # Resolving the result releases the slot taken above.
+            result.set_exception(error)
+            return result
+        prepared_future.add_done_callback(lambda _: self._dispatch(analyte, prepared_future, standard_volume, used_volume, result))
+        return result
@@ -1,11 +1,35 @@
-from ._utils import check_mutually_exclusive_kwargs
+from ._utils import _calibration_fft_shape, check_mutually_exclusive_kwargs
 from .typing import CalibratedDistributions, Distribution, Intervals, Value, Values
 from abc import ABC, abstractmethod
 from collections import OrderedDict
 from datetime import datetime, timezone
-from fft_conv_pytorch import fft_conv
-from typing import Any, Callable, List, Optional, Tuple, Type, Union
-import torch
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+import torch, weakref
+
+
+def compute_blank_spectrum_torch(blank_pmf: torch.Tensor) -> torch.Tensor:
+    # The same as compute_blank_spectrum, but for a torch tensor on any device.
+    fft_shape = _calibration_fft_shape(tuple(blank_pmf.shape))
+    return torch.fft.rfftn(torch.flip(blank_pmf, dims=tuple(range(blank_pmf.ndim))), s=fft_shape)
+
+
+def compute_calibrated_pmfs_torch(sample_pmfs: torch.Tensor, blank_spectra: torch.Tensor, blank_indices: Optional[torch.Tensor] = None) -> torch.Tensor:
+    # The same as compute_calibrated_pmfs, but for torch tensors on any device.
+    pmf_shape = tuple(sample_pmfs.shape[1:])
+    dims = tuple(range(1, sample_pmfs.ndim))
+    fft_shape = _calibration_fft_shape(pmf_shape)
+    spectra = torch.fft.rfftn(sample_pmfs, s=fft_shape, dim=dims)
+    spectra = spectra * (blank_spectra if blank_indices is None else blank_spectra[blank_indices])
+    full = torch.fft.irfftn(spectra, s=fft_shape, dim=dims)[(slice(None), *(slice(0, 2 * size - 1) for size in pmf_shape))]
+    return torch.nn.functional.relu(full)
+
+
+def crop_to_input_roi(calibrated_pmf: torch.Tensor, input_roi: torch.Tensor) -> torch.Tensor:
+    # Crop the input ROI (inclusive bounds per axis) from a batch of calibrated PMFs, unless they were already stored or computed for the ROI only.
+    bounds = [(int(lower), int(upper)) for lower, upper in input_roi.tolist()]
+    if tuple(calibrated_pmf.shape[-len(bounds):]) == tuple(upper - lower + 1 for lower, upper in bounds):
+        return calibrated_pmf
+    return calibrated_pmf[(..., *(slice(lower, upper + 1) for lower, upper in bounds))]
 
 
 class Network(ABC, torch.nn.Module):
@@ -116,6 +140,24 @@ class EstimationFunction(ABC, torch.nn.Module):
             self.net = net
         else:
             raise NotImplementedError
+        # Keep the spectrum of the last blank PMF, as the same blank is usually used to estimate many samples.
+        self._last_blank: Optional[Tuple[weakref.ref, int, torch.Tensor]] = None  # Tuple[reference to blank_pmf, version of blank_pmf, spectrum]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The spectrum of the last blank is not part of the module, so it is neither saved nor copied.
+        return {**self.__dict__, "_last_blank": None}
+
+    def _blank_spectrum(self, blank_pmf: torch.Tensor) -> torch.Tensor:
+        if blank_pmf.requires_grad and torch.is_grad_enabled():
+            # The spectrum is part of the autograd graph of the blank, so it is not kept.
+            return compute_blank_spectrum_torch(blank_pmf)
+        if self._last_blank is not None:
+            blank_ref, blank_version, blank_spectrum = self._last_blank
+            if blank_ref() is blank_pmf and blank_version == blank_pmf._version:
+                return blank_spectrum
+        blank_spectrum = compute_blank_spectrum_torch(blank_pmf.detach())
+        self._last_blank = (weakref.ref(blank_pmf), blank_pmf._version, blank_spectrum)
+        return blank_spectrum
 
     @abstractmethod
     def _check_and_reshape_calibrated_pmf(self, **kwargs: CalibratedDistributions) -> Tuple[torch.Tensor, ...]:
@@ -131,16 +173,12 @@ class EstimationFunction(ABC, torch.nn.Module):
         if sample_pmf is not None and blank_pmf is not None:
             ndim = sample_pmf.ndim
             # Reshape input.
-            reshaped_sample_pmf, reshaped_blank_pmf = self._check_and_reshape_pmfs(sample_pmf=sample_pmf, blank_pmf=blank_pmf)
+            reshaped_sample_pmf, _ = self._check_and_reshape_pmfs(sample_pmf=sample_pmf, blank_pmf=blank_pmf)
             # Compute C = A - B, where A is the random variable representing the sample and B is the random variable representing the blank sample.
             if ndim == 1:
-                fft_convolution = fft_conv(reshaped_sample_pmf.unsqueeze(-2), reshaped_blank_pmf.unsqueeze(-2), padding=(reshaped_blank_pmf.shape[-1] - 1,))  # adicionado por necessidade do torch.maximum comparar elementwise
-                fft_convolution = torch.nn.functional.relu(fft_convolution, inplace=True)
-                reshaped_calibrated_pmf = fft_convolution[:, :, :fft_convolution.shape[-1]].squeeze(1)
+                reshaped_calibrated_pmf = compute_calibrated_pmfs_torch(reshaped_sample_pmf, self._blank_spectrum(blank_pmf).unsqueeze(0))
             elif ndim == 2:
-                fft_convolution = fft_conv(reshaped_sample_pmf, reshaped_blank_pmf, padding=(reshaped_blank_pmf.shape[-2] - 1, reshaped_blank_pmf.shape[-1] - 1))
-                fft_convolution = torch.nn.functional.relu(fft_convolution, inplace=True)
-                reshaped_calibrated_pmf = fft_convolution[:, :, :fft_convolution.shape[-2], :fft_convolution.shape[-1]].squeeze(1)
+                reshaped_calibrated_pmf = compute_calibrated_pmfs_torch(reshaped_sample_pmf.squeeze(1), self._blank_spectrum(blank_pmf).unsqueeze(0))
             else:
                 raise NotImplementedError
             # Predict value.
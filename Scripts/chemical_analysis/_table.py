@@ -0,0 +1,166 @@
+from .typing import ChamberType, Sample
+from collections.abc import Sized
+from datetime import datetime, timezone
+from typing import Any, Dict, Final, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
+
+
+CATEGORICAL_COLUMNS: Final[Dict[str, Tuple[str, ...]]] = {  # Dict[column, path of keys in the sample]
+    "analystName": ("analystName",),
+    "appVersion": ("app", "versionName"),
+    "deviceManufacturer": ("device", "manufacturer"),
+    "deviceModel": ("device", "model"),
+    "fileName": ("fileName",),
+    "blankFileName": ("blankFileName",),
+    "stockName": ("sourceStock", "name"),
+    "valueUnit": ("valueUnit",),
+}
+
+
+NUMERICAL_COLUMNS: Final[Dict[str, Tuple[str, ...]]] = {  # Dict[column, path of keys in the sample]
+    "stockFactor": ("stockFactor",),
+    "standardVolume": ("standardVolume",),
+    "usedVolume": ("usedVolume",),
+    "theoreticalValue": ("theoreticalValue",),
+    "correctedTheoreticalValue": ("correctedTheoreticalValue",),
+    "estimatedValue": ("estimatedValue",),
+}
+
+
+SAMPLE_TABLE_DTYPE: Final[np.dtype] = np.dtype([
+    ("datetime", "datetime64[s]"),  # UTC.
+    ("chamberType", np.uint8),
+    ("isBlankSample", np.bool_),
+    ("isInferenceSample", np.bool_),
+    ("isTrainingSample", np.bool_),
+    ("hasBlank", np.bool_),
+    ("blankIndex", np.int32),  # Row of the blank sample in the table, or -1 if it is not available.
+    *[(name, np.int32) for name in CATEGORICAL_COLUMNS],  # Codes of interned strings, or -1 for None.
+    *[(name, np.float64) for name in NUMERICAL_COLUMNS],  # NaN for None.
+])
+
+
+def _to_datetime64(value: datetime) -> np.datetime64:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "s")
+
+
+class SampleTable(Sized):
+    def __init__(self, samples: Iterable[Sample], *, keep_samples: bool = False) -> None:
+        super().__init__()
+        samples = list(samples)
+        # Intern the strings of categorical columns.
+        self._categories: Dict[str, List[str]] = {name: list() for name in CATEGORICAL_COLUMNS}
+        self._category_codes: Dict[str, Dict[str, int]] = {name: dict() for name in CATEGORICAL_COLUMNS}
+        def encode(name: str, value: Optional[str]) -> int:
+            if value is None:
+                return -1
+            code = self._category_codes[name].get(value, None)
+            if code is None:
+                code = self._category_codes[name][value] = len(self._categories[name])
+                self._categories[name].append(value)
+            return code
+        def get(sample: Sample, keys: Tuple[str, ...]) -> Any:
+            value: Any = sample
+            for key in keys:
+                value = value[key]
+            return value
+        # Fill the columns.
+        self._rows = np.empty((len(samples),), dtype=SAMPLE_TABLE_DTYPE)
+        row_of_blank = {id(sample): index for index, sample in enumerate(samples) if sample["isBlankSample"]}
+        for index, sample in enumerate(samples):
+            row = self._rows[index]
+            row["datetime"] = _to_datetime64(sample["datetime"])
+            row["chamberType"] = sample["chamberType"].value
+            row["isBlankSample"] = sample["isBlankSample"]
+            row["isInferenceSample"] = sample["isInferenceSample"]
+            row["isTrainingSample"] = sample["isTrainingSample"]
+            row["hasBlank"] = sample["blank"] is not None
+            row["blankIndex"] = row_of_blank.get(id(sample["blank"]), -1) if sample["blank"] is not None else -1
+            for name, keys in CATEGORICAL_COLUMNS.items():
+                row[name] = encode(name, get(sample, keys))
+            for name, keys in NUMERICAL_COLUMNS.items():
+                value = get(sample, keys)
+                row[name] = float("NaN") if value is None else value
+        # Keep the original records only if required to.
+        self._samples: Optional[List[Sample]] = samples if keep_samples else None
+
+    def __getitem__(self, index: int) -> np.void:
+        return self._rows[index]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _codes(self, name: str, values: Union[str, Iterable[str]]) -> List[int]:
+        values = [values] if isinstance(values, str) else list(values)
+        codes = self._category_codes[name]
+        return [codes[value] for value in values if value in codes]
+
+    @property
+    def columns(self) -> np.ndarray:
+        return self._rows
+
+    @property
+    def nbytes(self) -> int:
+        return self._rows.nbytes + sum(len(value) for categories in self._categories.values() for value in categories)
+
+    def categories(self, name: str) -> List[str]:
+        return list(self._categories[name])
+
+    def column(self, name: str) -> np.ndarray:
+        if name in CATEGORICAL_COLUMNS:
+            categories = np.asarray([*self._categories[name], None], dtype=object)
+            return categories[self._rows[name]]  # Code -1 is mapped to None.
+        return self._rows[name]
+
+    def compute_true_value_statistics(self, indices: Optional[np.ndarray] = None) -> Dict[str, float]:
+        values = self._rows["correctedTheoreticalValue"] if indices is None else self._rows["correctedTheoreticalValue"][indices]
+        values = values[np.logical_not(np.isnan(values))].astype(np.float32)
+        median = np.median(values)
+        return {
+            "min": float(np.min(values)),
+            "max": float(np.max(values)),
+            "mean": float(np.mean(values)),
+            "std": float(np.std(values)),
+            "median": float(median),
+            "mad": float(np.median(np.abs(values - median))),
+        }
+
+    def samples(self, indices: Optional[np.ndarray] = None) -> List[Sample]:
+        if self._samples is None:
+            raise RuntimeError("The original samples were not kept by this table")
+        return list(self._samples) if indices is None else [self._samples[index] for index in indices.tolist()]
+
+    def select(self, *, analyst_name: Optional[Union[str, Iterable[str]]] = None, chamber_type: Optional[Union[ChamberType, Iterable[ChamberType]]] = None, date_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None, device_model: Optional[Union[str, Iterable[str]]] = None, has_blank: Optional[bool] = None, is_blank_sample: Optional[bool] = None, is_inference_sample: Optional[bool] = None, is_training_sample: Optional[bool] = None, stock_name: Optional[Union[str, Iterable[str]]] = None, value_column: str = "correctedTheoreticalValue", value_range: Optional[Tuple[Optional[float], Optional[float]]] = None) -> np.ndarray:
+        # Combine the masks of the given criteria and return the indices of the selected rows.
+        msk = np.ones((len(self._rows),), dtype=np.bool_)
+        for name, values in (("analystName", analyst_name), ("deviceModel", device_model), ("stockName", stock_name)):
+            if values is not None:
+                msk &= np.isin(self._rows[name], self._codes(name, values))
+        if chamber_type is not None:
+            chamber_types = [chamber_type] if isinstance(chamber_type, ChamberType) else list(chamber_type)
+            msk &= np.isin(self._rows["chamberType"], [item.value for item in chamber_types])
+        if date_range is not None:
+            begin, end = date_range
+            if begin is not None:
+                msk &= self._rows["datetime"] >= _to_datetime64(begin)
+            if end is not None:
+                msk &= self._rows["datetime"] <= _to_datetime64(end)
+        if value_range is not None:
+            lower, upper = value_range
+            values = self._rows[value_column]
+            if lower is not None:
+                msk &= values >= lower
+            if upper is not None:
+                msk &= values <= upper
+        for name, flag in (("isBlankSample", is_blank_sample), ("isInferenceSample", is_inference_sample), ("isTrainingSample", is_training_sample)):
+            if flag is not None:
+                msk &= self._rows[name] == flag
+        if has_blank is not None:
+            msk &= self._rows["hasBlank"] == has_blank
+        return np.flatnonzero(msk)
+
+    @classmethod
+    def from_dataset(cls, dataset: Sequence[Sample], **kwargs: Any) -> "SampleTable":
+        return cls((dataset[index] for index in range(len(dataset))), **kwargs)
@@ -1,12 +1,44 @@
-from .typing import ChamberType, Sample
-from typing import Any, Dict, Final, List, Optional, Tuple, Union
+from .typing import ChamberType
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Final, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 import cv2
+import itertools
 import math
 import numpy as np
-import scipy, scipy.ndimage, scipy.signal
+import scipy, scipy.fft, scipy.ndimage, scipy.signal
 
 
 LAB_CIE_D65: Final[np.ndarray] = np.asarray([100.0, 0.0, 0.0], dtype=np.float32)
+MASKS_REDUCTION_FACTOR: Final[int] = 4
+MASKS_REDUCED_IMREAD_FLAG: Final[int] = cv2.IMREAD_REDUCED_COLOR_4
+
+
+POT_CIRCLE_HINT_TOLERANCE: Final[float] = 0.15  # Relative to the radius of the hint, for both the displacement of the center and the change of the radius.
+POT_CIRCLE_OPENING_ITERATIONS: Final[int] = 15  # Also the padding (in pixels) of the window searched around a hint, so the opening is not affected by the borders.
+
+
+WHITEBALANCE_STATS_BATCH_SIZE: Final[int] = 16  # The number of images reduced by each task of the workers.
+
+
+SPARSE_CALIBRATION_MAX_BYTES: Final[int] = 2 ** 22  # Memory budget of the direct sum over pairs of non-zero bins, about the working memory of the FFT of 2D PMFs.
+
+
+PMF_PROJECTION_KINDS: Final[Dict[str, Tuple[int, ...]]] = {  # Dict[kind, shape of the PMF]
+    "ab_offset": (256, 256),
+    "l_offset": (256,),
+    "pca_1d": (256,),
+    "pca_2d": (256, 256),
+}
+
+
+PIXEL_SAMPLING_METHODS: Final[Tuple[str, ...]] = (
+    "blue_noise",  # One pixel at a random position of each cell of a regular grid (jittered grid), so samples are spread without aliasing.
+    "random",  # Uniformly random pixels, without replacement.
+    "stride",  # The first pixel of each cell of a regular grid.
+)
+
+
 LAB_SPACE_VERTICES: Final[np.ndarray] = np.asarray([[+100, +128, +128], [+100, -128, +128], [+100, -128, -128], [+100, +128, -128], [0, +128, +128], [0, -128, +128], [0, -128, -128], [0, +128, -128]], dtype=np.float32)
 
 
@@ -14,12 +46,18 @@ def bgr_to_lab(bgr: np.ndarray) -> np.ndarray:
     shape = bgr.shape
     if len(shape) != 3:
         bgr = bgr.reshape((1, -1, 3))
-    lab_img = cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB).astype(np.float32)
-    lab_img[:, :, 0] *= 100.0 / 255.0
-    lab_img[:, :, 1:] -= 128.0
+    lab_img = opencv_lab_to_lab(cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB))
     return lab_img.reshape(shape) if len(shape) != 3 else lab_img
 
 
+def opencv_lab_to_lab(opencv_lab: np.ndarray) -> np.ndarray:
+    # Convert 8-bit L*a*b* values from OpenCV to 0 ≤ L* ≤ 100, −127 ≤ a* ≤ 127, −127 ≤ b* ≤ 127.
+    lab = opencv_lab.astype(np.float32)
+    lab[..., 0] *= 100.0 / 255.0
+    lab[..., 1:] -= 128.0
+    return lab
+
+
 
 def whitebalance(lab: np.ndarray, lab_white: np.ndarray) -> np.ndarray:
     return lab - (lab_white - LAB_CIE_D65)
@@ -91,25 +129,302 @@ def check_mutually_exclusive_kwargs(**kwargs: Optional[Any]) -> None:
         raise ValueError(f'The following arguments are mutually exclusive: {", ".join(sorted(kwargs.keys()))}')
 
 
+@contextmanager
+def worker_pool(num_workers: int, *, use_processes: bool = False, chunksize: int = 1) -> Iterator[Callable[..., Iterator[Any]]]:
+    # Yield an order-preserving map function that runs on a pool of threads (I/O bound work) or processes (CPU bound work). The built-in map is used when no workers are requested.
+    if num_workers <= 0:
+        yield map
+    elif use_processes:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            yield lambda func, *iterables: executor.map(func, *iterables, chunksize=chunksize)
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            yield executor.map
+
+
+def _calibration_fft_shape(pmf_shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    # Padded shape of the real FFT that computes the full convolution of two PMFs with the given shape.
+    return tuple(scipy.fft.next_fast_len(2 * size - 1, real=True) for size in pmf_shape)
+
+
+def compute_blank_spectrum(blank_pmf: np.ndarray) -> np.ndarray:
+    # The spectrum of the flipped blank PMF is shared by all samples calibrated against the same blank.
+    return scipy.fft.rfftn(np.flip(blank_pmf), s=_calibration_fft_shape(blank_pmf.shape))
+
+
+def compute_calibrated_pmfs(sample_pmfs: np.ndarray, blank_spectra: np.ndarray, blank_indices: Optional[np.ndarray] = None) -> np.ndarray:
+    # Compute C = A - B for a batch of samples (sample_pmfs.shape = (batch_size, *pmf_shape)) with one batched real FFT, where blank_spectra[blank_indices]
+    # are the spectra of the corresponding blanks (or blank_spectra is broadcast to the batch if blank_indices is None).
+    pmf_shape = sample_pmfs.shape[1:]
+    axes = tuple(range(1, sample_pmfs.ndim))
+    fft_shape = _calibration_fft_shape(pmf_shape)
+    spectra = scipy.fft.rfftn(sample_pmfs, s=fft_shape, axes=axes)
+    spectra *= blank_spectra if blank_indices is None else blank_spectra[blank_indices]
+    full = scipy.fft.irfftn(spectra, s=fft_shape, axes=axes)[(slice(None), *(slice(0, 2 * size - 1) for size in pmf_shape))]
+    return np.maximum(full, 0.0)
+
+
 def compute_calibrated_pmf(blank_pmf: np.ndarray, sample_pmf: np.ndarray) -> np.ndarray:
     # Compute C = A - B, where A is the random variable representing the sample and B is the random variable representing the blank sample
-    return np.maximum(scipy.signal.fftconvolve(sample_pmf, np.flip(blank_pmf), mode="full"), 0.0)  #PAPER Alterei mode de same para full e troquei abs por maximum. Faz mais sentido dessa forma.
+    return compute_calibrated_pmfs(sample_pmf[np.newaxis, ...], compute_blank_spectrum(blank_pmf)[np.newaxis, ...])[0, ...]  #PAPER Alterei mode de same para full e troquei abs por maximum. Faz mais sentido dessa forma.
+
+
+def _sparse_calibration_nbytes(num_pairs: int, ndim: int) -> int:
+    # Peak memory of the direct sum: one 32-bit index array per axis, the mask of pairs in the ROI, and the 64-bit weights and flat indices of the pairs.
+    return num_pairs * (4 * ndim + 1 + 8 + 8 + 8)
+
+
+def compute_roi_calibrated_pmf(blank_pmf: np.ndarray, sample_pmf: np.ndarray, roi: Tuple[Tuple[int, int], ...], *, blank_spectrum: Optional[np.ndarray] = None) -> np.ndarray:
+    # Compute only the window of C = A - B given by the inclusive bounds in roi (in the coordinates of compute_calibrated_pmf). As PMFs are sparse, the window
+    # is the direct sum over pairs of non-zero bins, unless it would take more memory than SPARSE_CALIBRATION_MAX_BYTES. The choice depends only on the PMFs, so
+    # the same PMFs always take the same numerical path (e.g., in training, validation, test, and in the mobile application).
+    roi = tuple((int(lower), int(upper)) for lower, upper in roi)
+    roi_shape = tuple(upper - lower + 1 for lower, upper in roi)
+    sample_ind, blank_ind = np.nonzero(sample_pmf), np.nonzero(blank_pmf)
+    if _sparse_calibration_nbytes(len(sample_ind[0]) * len(blank_ind[0]), sample_pmf.ndim) > SPARSE_CALIBRATION_MAX_BYTES:
+        blank_spectrum = blank_spectrum if blank_spectrum is not None else compute_blank_spectrum(blank_pmf)
+        calibrated_pmf = compute_calibrated_pmfs(sample_pmf[np.newaxis, ...], blank_spectrum[np.newaxis, ...])[0, ...]
+        return np.ascontiguousarray(calibrated_pmf[tuple(slice(lower, upper + 1) for lower, upper in roi)])
+    # The bin (sample_bin - blank_bin + size - 1) of the full result receives sample_pmf[sample_bin] * blank_pmf[blank_bin].
+    in_roi = np.ones((len(sample_ind[0]), len(blank_ind[0])), dtype=np.bool_)
+    roi_ind: List[np.ndarray] = list()
+    for sample_axis_ind, blank_axis_ind, size, (lower, upper) in zip(sample_ind, blank_ind, sample_pmf.shape, roi):
+        axis_ind = sample_axis_ind.astype(np.int32)[:, np.newaxis] - blank_axis_ind.astype(np.int32)[np.newaxis, :] + np.int32(size - 1 - lower)
+        in_roi &= (axis_ind >= 0) & (axis_ind <= upper - lower)
+        roi_ind.append(axis_ind)
+    flat_ind = np.ravel_multi_index(tuple(axis_ind[in_roi] for axis_ind in roi_ind), roi_shape)
+    weights = (sample_pmf[sample_ind].astype(np.float64)[:, np.newaxis] * blank_pmf[blank_ind].astype(np.float64)[np.newaxis, :])[in_roi]
+    return np.bincount(flat_ind, weights=weights, minlength=int(np.prod(roi_shape))).reshape(roi_shape).astype(sample_pmf.dtype)
+
+
+class PmfProjection(NamedTuple):
+    kind: str  # One of PMF_PROJECTION_KINDS.
+    lab_mean: Optional[np.ndarray] = None  # Required by PCA projections.
+    lab_sorted_eigenvectors: Optional[np.ndarray] = None  # Required by PCA projections.
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return PMF_PROJECTION_KINDS[self.kind]
+
+
+def _project(lab: np.ndarray, lab_white: np.ndarray, projection: PmfProjection) -> np.ndarray:
+    # Map whitebalanced L*a*b* entries (lab.shape = (num_pixels, 3)) to continuous bin coordinates, which may be out of range.
+    if projection.kind == "ab_offset":
+        # a*b* coordinates mapped to the CIE standard illuminant D65 and offset to be non-negative, in (b*, a*) order.
+        return np.flip(lab[:, 1:] - (lab_white[1:] - LAB_CIE_D65[1:] - 128), 1)
+    elif projection.kind == "l_offset":
+        # L* coordinate mapped to the CIE standard illuminant D65 and scaled to 0-255.
+        return (lab[:, 0] - (lab_white[0] - LAB_CIE_D65[0])) * 2.55
+    elif projection.kind == "pca_1d":
+        # First principal component, normalized by the limits of the L*a*b* space.
+        lab_matrix = (LAB_SPACE_VERTICES - projection.lab_mean).dot(projection.lab_sorted_eigenvectors)[:, 0]
+        lab_min = lab_matrix.min(axis=0)
+        lab_max = lab_matrix.max(axis=0)
+        lab_pca = (whitebalance(lab, lab_white) - projection.lab_mean).dot(projection.lab_sorted_eigenvectors)[:, 0]
+        return ((lab_pca - lab_min) / (lab_max - lab_min)) * 255.0
+    elif projection.kind == "pca_2d":
+        # First two principal components, normalized by the limits of the L*a*b* space.
+        return 255 * lab_to_normalized(lab, lab_white=lab_white, lab_mean=projection.lab_mean, lab_sorted_eigenvectors=projection.lab_sorted_eigenvectors, out_channels=(0, 1))
+    raise ValueError(f'Unknown PMF projection "{projection.kind}", expected one of {sorted(PMF_PROJECTION_KINDS)}')
+
+
+def _project_to_bins(lab: np.ndarray, lab_white: np.ndarray, projection: PmfProjection) -> np.ndarray:
+    # Map L*a*b* entries to bin indices, which may be out of range. 8-bit L*a*b* entries from OpenCV are mapped through a lookup table of their distinct
+    # colors, which are projected by the same float arithmetic as the float L*a*b* entries, so the bin indices are the same as those of bgr_to_lab images.
+    if lab.dtype != np.uint8:
+        return _project(lab, lab_white, projection).astype(np.int64)
+    codes = np.ascontiguousarray(lab).reshape(-1, 3).astype(np.int32)
+    codes = (codes[:, 0] << 16) | (codes[:, 1] << 8) | codes[:, 2]
+    colors, inverse = np.unique(codes, return_inverse=True)
+    opencv_lab_colors = np.stack(((colors >> 16) & 0xFF, (colors >> 8) & 0xFF, colors & 0xFF), axis=1).astype(np.uint8)
+    table = _project(opencv_lab_to_lab(opencv_lab_colors), lab_white, projection).astype(np.int64)
+    return table[inverse.reshape(-1), ...]
+
+
+def _ravel_bins(ind: np.ndarray, projection: PmfProjection) -> Tuple[np.ndarray, np.ndarray]:
+    # Return the in-range mask and the raveled indices of the in-range bins.
+    shape = projection.shape
+    if len(shape) == 1:
+        in_range = np.logical_and(0 <= ind, ind < shape[0])
+        return in_range, ind[in_range]
+    in_range = np.logical_and(0 <= ind, ind < np.asarray(shape)).all(axis=1)
+    ind_in_range = ind[in_range, ...]
+    return in_range, ind_in_range[:, 0] * shape[1] + ind_in_range[:, 1]
+
+
+def compute_projected_pmf(lab_img: np.ndarray, analyte_msk: np.ndarray, lab_white: np.ndarray, projection: PmfProjection, *, with_img_to_pmf: bool = True) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+    # Map L*a*b* coordinates (in float, or 8-bit from OpenCV) of the analyte pixels to bin indices.
+    ind = _project_to_bins(lab_img[analyte_msk], lab_white, projection)
+    in_range, flat_ind = _ravel_bins(ind, projection)
+    # Compute the frequency of each bin in the sample.
+    pmf = np.bincount(flat_ind, minlength=math.prod(projection.shape)).astype(np.float32).reshape(projection.shape)
+    pmf /= pmf.sum()
+    if not with_img_to_pmf:
+        return pmf, None
+    # Return the PMF and the map from the coordinates of the analyte pixels in the image to bins of the PMF.
+    return pmf, (np.stack(np.nonzero(analyte_msk), axis=1)[in_range, ...], ind[in_range, ...])
+
+
+def compute_projected_pmfs(lab_pixels: Sequence[np.ndarray], lab_whites: Sequence[np.ndarray], projection: PmfProjection) -> np.ndarray:
+    # Map the pixels of each image to raveled bin indices, offset by the position of the image in the batch, so all PMFs are computed by a single bincount.
+    size = math.prod(projection.shape)
+    flat_inds: List[np.ndarray] = list()
+    for index, (lab, lab_white) in enumerate(zip(lab_pixels, lab_whites)):
+        _, flat_ind = _ravel_bins(_project_to_bins(lab.reshape(-1, 3), lab_white, projection), projection)
+        flat_inds.append(flat_ind + index * size)
+    counts = np.bincount(np.concatenate(flat_inds) if len(flat_inds) > 0 else np.empty((0,), dtype=np.int64), minlength=len(flat_inds) * size)
+    pmfs = counts.astype(np.float32).reshape((len(flat_inds), *projection.shape))
+    for pmf in pmfs:
+        pmf /= pmf.sum()
+    return pmfs
+
+
+class PixelSampling(NamedTuple):
+    method: str  # One of PIXEL_SAMPLING_METHODS.
+    num_pixels: int  # The target number of analyte pixels, which are all kept if there are not more than that.
+    seed: int = 0  # The seed of the random positions, so the sampled pixels of the same mask are the same every time.
+
+
+def _grid_cells(size: int, step: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Split range(size) into cells of about step consecutive indices, and return the cell of each index, and the first index and the length of each cell.
+    starts = np.unique(np.ceil(np.arange(math.ceil(size / step)) * step).astype(np.int64))
+    starts = starts[starts < size]
+    lengths = np.diff(np.append(starts, size))
+    return np.repeat(np.arange(len(starts)), lengths), starts, lengths
+
+
+def sample_analyte_mask(analyte_msk: np.ndarray, pixel_sampling: PixelSampling) -> np.ndarray:
+    # Keep about pixel_sampling.num_pixels pixels of the analyte mask, since neighboring pixels are highly correlated and the PMF changes little.
+    rows, cols = np.nonzero(analyte_msk)
+    if len(rows) <= pixel_sampling.num_pixels:
+        return analyte_msk
+    rng = np.random.default_rng(pixel_sampling.seed)
+    if pixel_sampling.method == "random":
+        keep = np.sort(rng.choice(len(rows), size=pixel_sampling.num_pixels, replace=False))
+    elif pixel_sampling.method in ("blue_noise", "stride"):
+        # Cells are sized so that a full analyte region has about one cell per required pixel.
+        step = math.sqrt(len(rows) / pixel_sampling.num_pixels)
+        row_cells, row_starts, row_lengths = _grid_cells(analyte_msk.shape[0], step)
+        col_cells, col_starts, col_lengths = _grid_cells(analyte_msk.shape[1], step)
+        if pixel_sampling.method == "stride":
+            keep = np.logical_and(rows == row_starts[row_cells[rows]], cols == col_starts[col_cells[cols]])
+        else:
+            chosen_rows = row_starts[:, np.newaxis] + (rng.random((len(row_starts), len(col_starts))) * row_lengths[:, np.newaxis]).astype(np.int64)
+            chosen_cols = col_starts[np.newaxis, :] + (rng.random((len(row_starts), len(col_starts))) * col_lengths[np.newaxis, :]).astype(np.int64)
+            cell_rows, cell_cols = row_cells[rows], col_cells[cols]
+            keep = np.logical_and(rows == chosen_rows[cell_rows, cell_cols], cols == chosen_cols[cell_rows, cell_cols])
+    else:
+        raise ValueError(f'Unknown pixel sampling method "{pixel_sampling.method}", expected one of {sorted(PIXEL_SAMPLING_METHODS)}')
+    sampled_msk = np.zeros(analyte_msk.shape, dtype=np.bool_)
+    sampled_msk[rows[keep], cols[keep]] = True
+    return sampled_msk
 
 
-def _compute_masks_for_cuvette(bgr_img: np.ndarray, lab_img: Optional[np.ndarray])-> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], np.ndarray, np.ndarray]:
+def _resize_for_masks(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], reduced_bgr_img: Optional[np.ndarray]) -> Tuple[int, int, int, int, np.ndarray, Optional[np.ndarray], np.ndarray]:
+    height, width, _ = bgr_img.shape
+    if reduced_bgr_img is None:
+        # Convert the input image from BGR to L*a*b* and set the correct range for the channels, i.e., 0 ≤ L* ≤ 100, −127 ≤ a* ≤ 127, −127 ≤ b* ≤ 127
+        if lab_img is None:
+            lab_img = bgr_to_lab(bgr_img)
+        # Resize the input image
+        resized_height, resized_width = height // MASKS_REDUCTION_FACTOR, width // MASKS_REDUCTION_FACTOR
+        resized_bgr_img = cv2.resize(bgr_img, (resized_width, resized_height), interpolation=cv2.INTER_CUBIC)
+        resized_lab_img = cv2.resize(lab_img, (resized_width, resized_height), interpolation=cv2.INTER_CUBIC)
+    else:
+        # Use the image decoded at reduced scale, so the full resolution image is not converted to L*a*b* (lab_img is returned as given).
+        resized_height, resized_width, _ = reduced_bgr_img.shape
+        resized_bgr_img = reduced_bgr_img
+        resized_lab_img = bgr_to_lab(reduced_bgr_img)
+    return height, width, resized_height, resized_width, resized_bgr_img, lab_img, resized_lab_img
+
+
+def read_reduced_bgr_image(path: str) -> np.ndarray:
+    # Decode the image directly at the scale used to estimate the masks (in the DCT domain for JPEG files).
+    bgr_img = cv2.imread(path, MASKS_REDUCED_IMREAD_FLAG)
+    if bgr_img is None:
+        raise RuntimeError(f'Can\'t load the file "{path}"')
+    return bgr_img
+
+
+def read_image_shape(path: str) -> Tuple[int, int]:
+    # Read the (height, width) of the image as decoded by OpenCV from the header of the file, i.e., without decoding the pixels.
+    from PIL import Image  # Only required to read image headers.
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            orientation = img.getexif().get(0x0112, 1)  # The EXIF orientation, which OpenCV applies when decoding.
+    except OSError:
+        raise RuntimeError(f'Can\'t load the file "{path}"')
+    return (width, height) if orientation in (5, 6, 7, 8) else (height, width)
+
+
+def full_resolution_placeholder(shape: Tuple[int, int]) -> np.ndarray:
+    # Make a read-only BGR image with the given shape and no storage, to be given with the image decoded at reduced scale to functions that use only the shape of
+    # the full resolution image (e.g., to resize the masks).
+    return np.broadcast_to(np.zeros((1, 1, 1), dtype=np.uint8), (*shape, 3))
+
+
+class PotCircle(NamedTuple):
+    # The circle of the hole of the grid that holds the pot, in pixels of the full resolution image.
+    x: float
+    y: float
+    radius: float
+
+
+def _compute_bright_image(bgr_img: np.ndarray) -> np.ndarray:
+    return ((bgr_img.astype(np.float32) / 255.0).prod(axis=2) * 255.0).astype(np.uint8)
+
+
+def _hough_pot_circle(bright_img: np.ndarray, min_radius: int, max_radius: int) -> Optional[Tuple[int, int, int]]:
+    bright_img_ = cv2.morphologyEx(bright_img, cv2.MORPH_OPEN, (3, 3), iterations=POT_CIRCLE_OPENING_ITERATIONS)
+    detected_circles = cv2.HoughCircles(cv2.GaussianBlur(bright_img_, (3, 3), 0), cv2.HOUGH_GRADIENT, 1, 1, param1=50, param2=30, minRadius=min_radius, maxRadius=max_radius)
+    if detected_circles is None:
+        return None
+    x, y, r = np.around(detected_circles).astype(np.uint16)[0, 0]
+    return int(x), int(y), int(r)
+
+
+def _find_pot_circle(bright_img: np.ndarray, circle_hint: Optional[PotCircle]) -> Optional[Tuple[int, int, int]]:
+    height, width = bright_img.shape
+    if circle_hint is not None:
+        # Verify the hint by searching a narrow range of radii in a window around it (e.g., the circle found in the blank, which is captured in the same holder).
+        x, y, r = circle_hint
+        tolerance = POT_CIRCLE_HINT_TOLERANCE * r
+        extent = int(np.ceil(r + 2.0 * tolerance)) + POT_CIRCLE_OPENING_ITERATIONS
+        top, bottom = max(int(y) - extent, 0), min(int(y) + extent + 1, height)
+        left, right = max(int(x) - extent, 0), min(int(x) + extent + 1, width)
+        if top < bottom and left < right:
+            detected_circle = _hough_pot_circle(bright_img[top:bottom, left:right], max(int(r - tolerance), 1), int(np.ceil(r + tolerance)))
+            if detected_circle is not None:
+                window_x, window_y, detected_r = detected_circle
+                if abs(left + window_x - x) <= tolerance and abs(top + window_y - y) <= tolerance:
+                    return left + window_x, top + window_y, detected_r
+    # Search the whole image over a wide range of radii, if there is no hint or it could not be verified.
+    return _hough_pot_circle(bright_img, min(height, width) // 6, min(height, width) // 3)
+
+
+def _scale_pot_circle(circle: PotCircle, factor: float) -> PotCircle:
+    return PotCircle(circle.x * factor, circle.y * factor, circle.radius * factor)
+
+
+def find_pot_circle(bgr_img: np.ndarray, *, reduced_bgr_img: Optional[np.ndarray] = None, circle_hint: Optional[PotCircle] = None) -> Optional[PotCircle]:
+    # Find the circle used by the masks of pot chambers, so it can be given as hint to the masks of other images captured in the same holder.
+    height, width, _ = bgr_img.shape
+    if reduced_bgr_img is None:
+        reduced_bgr_img = cv2.resize(bgr_img, (width // MASKS_REDUCTION_FACTOR, height // MASKS_REDUCTION_FACTOR), interpolation=cv2.INTER_CUBIC)
+    factor = reduced_bgr_img.shape[1] / width
+    detected_circle = _find_pot_circle(_compute_bright_image(reduced_bgr_img), _scale_pot_circle(circle_hint, factor) if circle_hint is not None else None)
+    return _scale_pot_circle(PotCircle(*map(float, detected_circle)), 1.0 / factor) if detected_circle is not None else None
+
+
+def _compute_masks_for_cuvette(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], reduced_bgr_img: Optional[np.ndarray] = None)-> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], Optional[np.ndarray], np.ndarray]:
     # Define a function to help finding the grid lines
     def find_grid(msk: np.ndarray, axis: int, sigma: float) -> np.ndarray:
         values = scipy.ndimage.gaussian_filter1d(msk.sum(axis=axis), sigma=sigma)
         peaks, _ = scipy.signal.find_peaks(values)
         return np.sort(peaks)
-    # Convert the input image from BGR to L*a*b* and set the correct range for the channels, i.e., 0 ≤ L* ≤ 100, −127 ≤ a* ≤ 127, −127 ≤ b* ≤ 127
-    if lab_img is None:
-        lab_img = bgr_to_lab(bgr_img)
-    # Resize the input image
-    height, width, _ = bgr_img.shape
-    resized_height, resized_width = height // 4, width // 4
-    resized_bgr_img = cv2.resize(bgr_img, (resized_width, resized_height), interpolation=cv2.INTER_CUBIC)
-    resized_lab_img = cv2.resize(lab_img, (resized_width, resized_height), interpolation=cv2.INTER_CUBIC)
+    # Resize the input image and convert it from BGR to L*a*b*
+    height, width, resized_height, resized_width, resized_bgr_img, lab_img, resized_lab_img = _resize_for_masks(bgr_img, lab_img, reduced_bgr_img)
     # Find the bright pixels and set a mask for them (most pixels are from the grid, but some of pixels may be from the cuvette's cap and from highlights)
     bright_img = ((resized_bgr_img.astype(np.float32) / 255.0).prod(axis=2) * 255.0).astype(np.uint8)
     _, bright_bw = cv2.threshold(bright_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
@@ -156,22 +471,14 @@ def _compute_masks_for_cuvette(bgr_img: np.ndarray, lab_img: Optional[np.ndarray
     return (bright_msk, grid_msk, analyte_msk, np.ones(analyte_msk.shape, dtype=np.float32)), lab_img, lab_white
 
 
-def _compute_masks_for_pot(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], min_bright_threshould: Optional[int]) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], np.ndarray, np.ndarray]:
-    # Convert the input image from BGR to L*a*b* and set the correct range for the channels, i.e., 0 ≤ L* ≤ 100, −127 ≤ a* ≤ 127, −127 ≤ b* ≤ 127
-    if lab_img is None:
-        lab_img = bgr_to_lab(bgr_img)
-    # Resize the input image
-    height, width, _ = bgr_img.shape
-    resized_height, resized_width = height // 4, width // 4
-    resized_bgr_img = cv2.resize(bgr_img, (resized_width, resized_height), interpolation=cv2.INTER_CUBIC)
-    resized_lab_img = cv2.resize(lab_img, (resized_width, resized_height), interpolation=cv2.INTER_CUBIC)
-    # Compute the bright image and find the main circle
-    bright_img = ((resized_bgr_img.astype(np.float32) / 255.0).prod(axis=2) * 255.0).astype(np.uint8)
-    bright_img_ = cv2.morphologyEx(bright_img, cv2.MORPH_OPEN, (3, 3), iterations=15)
-    detected_circles = cv2.HoughCircles(cv2.GaussianBlur(bright_img_, (3, 3), 0), cv2.HOUGH_GRADIENT, 1, 1, param1=50, param2=30, minRadius=min(resized_height, resized_width) // 6, maxRadius=min(resized_height, resized_width) // 3)
-    if detected_circles is not None:
-        detected_circles = np.around(detected_circles).astype(np.uint16)
-        x, y, r = detected_circles[0, 0]
+def _compute_masks_for_pot(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], min_bright_threshould: Optional[int], reduced_bgr_img: Optional[np.ndarray] = None, circle_hint: Optional[PotCircle] = None) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], Optional[np.ndarray], np.ndarray]:
+    # Resize the input image and convert it from BGR to L*a*b*
+    height, width, resized_height, resized_width, resized_bgr_img, lab_img, resized_lab_img = _resize_for_masks(bgr_img, lab_img, reduced_bgr_img)
+    # Compute the bright image and find the main circle, near the hint if it is given
+    bright_img = _compute_bright_image(resized_bgr_img)
+    detected_circle = _find_pot_circle(bright_img, _scale_pot_circle(circle_hint, resized_width / width) if circle_hint is not None else None)
+    if detected_circle is not None:
+        x, y, r = detected_circle
         # Compute the mask for the grid
         grid_bw = bright_img.copy()
         cv2.circle(grid_bw, (x, y), r, 0, -1)
@@ -207,12 +514,12 @@ def _compute_masks_for_pot(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], m
     return (bright_msk, grid_msk, analyte_msk), lab_img, lab_white
 
 
-def _compute_masks(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], chamber_type: ChamberType, min_bright_threshould: Optional[int]) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], np.ndarray, np.ndarray]:
+def _compute_masks(bgr_img: np.ndarray, lab_img: Optional[np.ndarray], chamber_type: ChamberType, min_bright_threshould: Optional[int], reduced_bgr_img: Optional[np.ndarray] = None, circle_hint: Optional[PotCircle] = None) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], Optional[np.ndarray], np.ndarray]:
     # Compute masks according to the chamber type
     if chamber_type is ChamberType.CUVETTE:
-        return _compute_masks_for_cuvette(bgr_img, lab_img)
+        return _compute_masks_for_cuvette(bgr_img, lab_img, reduced_bgr_img)
     elif chamber_type is ChamberType.POT:
-        return _compute_masks_for_pot(bgr_img, lab_img, min_bright_threshould)
+        return _compute_masks_for_pot(bgr_img, lab_img, min_bright_threshould, reduced_bgr_img, circle_hint)
     else:
         raise ValueError(f"Invalid chamber type: {chamber_type}")
 
@@ -253,19 +560,70 @@ def estimate_confidence_in_whitebalance(lab_img: np.ndarray, grid_msk: np.ndarra
     return 1 + math.erf(t_sample_mean_x / std_x)  # return 2 * cdf = [1 + erf((x - mu) / std * sqrt(2))]
 
 
-def write_whitebalance_stats(samples: List[Sample], filepath: str) -> None:
-    # Calculate some statistics, if not previously given.
-    means, covs = list(), list()
-    for sample in samples:
-        bgr_img = cv2.imread(sample["fileName"], cv2.IMREAD_COLOR)
-        if bgr_img is None:
-            raise RuntimeError(f'Can\'t load the file "{sample["fileName"]}"')
-        (_, grid_msk, _, _), lab_img, _ = _compute_masks(bgr_img=bgr_img, lab_img=None, chamber_type=sample["chamberType"], min_bright_threshould=None)
-        lab_grid = lab_img[grid_msk, 1:]
-        means.append(np.mean(lab_grid, axis=0))
-        covs.append(np.cov(lab_grid, rowvar=False))
-    mean = np.mean(means, axis=0)
-    cov = np.sum(covs, axis=0)  #TODO Pode isso?
+class WhitebalanceStatsAccumulator(NamedTuple):
+    # The running statistics of the grid pixels of the images, where each image contributes its mean and covariance of a*b* values. The sums are accumulated
+    # image by image in the order of the images, with the same precision as the mean and sum of the lists of per-image statistics.
+    num_images: int = 0
+    mean_sum: np.ndarray = np.zeros((2,), dtype=np.float32)  # The sum of the means of the images.
+    cov_sum: np.ndarray = np.zeros((2, 2), dtype=np.float64)  # The sum of the covariances of the images.
+
+    @property
+    def mean(self) -> np.ndarray:
+        # The mean of the means of the images, divided as np.mean does.
+        return (self.mean_sum.astype(np.float64) / self.num_images).astype(np.float32)
+
+
+def merge_whitebalance_stats(accumulator: WhitebalanceStatsAccumulator, other: WhitebalanceStatsAccumulator) -> WhitebalanceStatsAccumulator:
+    # Merge the statistics of two disjoint sets of images. The result is the same as the one of the per-image statistics if other has a single image.
+    return WhitebalanceStatsAccumulator(accumulator.num_images + other.num_images, accumulator.mean_sum + other.mean_sum, accumulator.cov_sum + other.cov_sum)
+
+
+def _whitebalance_image_stats(sample: Any, reduced_masks: bool) -> WhitebalanceStatsAccumulator:
+    if isinstance(sample, dict):
+        if reduced_masks:
+            # Use the grid pixels of the image decoded at reduced scale, so the full resolution image is never decoded.
+            bgr_img = read_reduced_bgr_image(sample["fileName"])
+            masks, lab_img, _ = _compute_masks(bgr_img=bgr_img, lab_img=None, chamber_type=sample["chamberType"], min_bright_threshould=None, reduced_bgr_img=bgr_img)
+        else:
+            bgr_img = cv2.imread(sample["fileName"], cv2.IMREAD_COLOR)
+            if bgr_img is None:
+                raise RuntimeError(f'Can\'t load the file "{sample["fileName"]}"')
+            masks, lab_img, _ = _compute_masks(bgr_img=bgr_img, lab_img=None, chamber_type=sample["chamberType"], min_bright_threshould=None)
+        grid_msk = masks[1]  # The masks of cuvettes include the attention mask, and the ones of pots don't.
+    else:
+        # Reuse the grid mask kept in the cache of the processed sample.
+        bgr_img, grid_msk, lab_img = sample.sample_bgr_image, sample.sample_grid_mask, None
+    # Convert to L*a*b* only the grid pixels, if the L*a*b* image is not available.
+    lab_grid = lab_img[grid_msk, 1:] if lab_img is not None else np.ascontiguousarray(bgr_to_lab(bgr_img[grid_msk][:, np.newaxis, :])[:, 0, 1:])
+    return WhitebalanceStatsAccumulator(1, np.mean(lab_grid, axis=0), np.cov(lab_grid, rowvar=False))
+
+
+def _whitebalance_batch_stats(samples: List[Any], reduced_masks: bool) -> List[WhitebalanceStatsAccumulator]:
+    return [_whitebalance_image_stats(sample, reduced_masks) for sample in samples]
+
+
+def _batched(iterable: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def write_whitebalance_stats(samples: Iterable[Any], filepath: str, *, num_workers: int = 0, batch_size: int = WHITEBALANCE_STATS_BATCH_SIZE, reduced_masks: bool = False) -> None:
+    # Calculate some statistics, if not previously given. The samples are raw samples, whose masks are computed from their images, or processed samples
+    # (e.g., from a ProcessedSampleDataset), whose cached masks are reused. With reduced masks, the statistics of raw samples are the ones of the grid pixels of
+    # the images decoded at reduced scale. Each worker computes the statistics of a batch of images, and they are accumulated image by image in order.
+    accumulator = WhitebalanceStatsAccumulator()
+    with worker_pool(num_workers, use_processes=True) as map_func:
+        for batch_stats in map_func(_whitebalance_batch_stats, _batched(samples, batch_size), itertools.repeat(reduced_masks)):
+            for image_stats in batch_stats:
+                accumulator = merge_whitebalance_stats(accumulator, image_stats)
+    if accumulator.num_images == 0:
+        raise ValueError("Can't compute whitebalance statistics without samples")
+    mean = accumulator.mean
+    cov = accumulator.cov_sum  #TODO Pode isso?
     # Calculate first eigenvalue and eigenvector rotation angle.
     tau = (cov[1, 1] - cov[0, 0]) / (2 * cov[0, 1])
     t = np.sign(tau) / (np.abs(tau) + np.sqrt(1 + tau * tau))
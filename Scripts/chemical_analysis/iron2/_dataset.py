@@ -1,4 +1,5 @@
 from .._dataset import ProcessedSampleDataset, SampleDataset
+from .._utils import PotCircle
 from ..typing import AuxiliarySolution, ChamberType
 from ._utils import compute_masks, compute_pmf
 from typing import Any, Dict, List, Optional, Tuple
@@ -29,9 +30,12 @@ class ProcessedIron2SampleDataset(ProcessedSampleDataset):
         self._lab_sorted_eigenvectors = lab_sorted_eigenvectors
         super().__init__(*args, **kwargs)
 
-    def _compute_masks(self, bgr_img: np.ndarray, lab_img: np.ndarray, chamber_type: ChamberType) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-        (bright_msk, grid_msk, analyte_msk), _, lab_white = compute_masks(bgr_img=bgr_img, lab_img=lab_img, chamber_type=chamber_type)
+    def _compute_masks(self, bgr_img: np.ndarray, lab_img: Optional[np.ndarray], chamber_type: ChamberType, reduced_bgr_img: Optional[np.ndarray] = None, circle_hint: Optional[PotCircle] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        (bright_msk, grid_msk, analyte_msk), _, lab_white = compute_masks(bgr_img=bgr_img, lab_img=lab_img, chamber_type=chamber_type, reduced_bgr_img=reduced_bgr_img, circle_hint=circle_hint)
         return bright_msk, grid_msk, analyte_msk, lab_white
 
-    def _compute_pmf(self, lab_img: np.ndarray, analyte_msk: np.ndarray, lab_white: np.ndarray) -> Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
-        return compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._lab_mean, lab_sorted_eigenvectors=self._lab_sorted_eigenvectors)
+    def _compute_pmf(self, lab_img: np.ndarray, analyte_msk: np.ndarray, lab_white: np.ndarray, with_img_to_pmf: bool = True) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+        return compute_pmf(lab_img=lab_img, analyte_msk=analyte_msk, lab_white=lab_white, lab_mean=self._lab_mean, lab_sorted_eigenvectors=self._lab_sorted_eigenvectors, with_img_to_pmf=with_img_to_pmf)
+
+    def _pmf_key_params(self) -> Tuple[Any, ...]:
+        return (*super()._pmf_key_params(), self._lab_mean, self._lab_sorted_eigenvectors)
@@ -77,7 +77,7 @@ class PreProcessing(Module):
 
     def forward(self, calibrated_pmf: CalibratedDistributions) -> torch.Tensor:
         normalized = (calibrated_pmf - self.input_range[0]) / (self.input_range[1] - self.input_range[0])
-        roi = normalized[..., self.input_roi[0,0]:self.input_roi[0,1]+1]
+        roi = crop_to_input_roi(normalized, self.input_roi)
         return roi.unsqueeze(1)
 
 
@@ -7,9 +7,9 @@ import plotly.graph_objects as go
 import pytorch_lightning as pl
 
 from plotly.subplots import make_subplots
-from ._dataset import ExpandedSampleDataset, SampleDataset, ProcessedSampleDataset
+from ._dataset import CALIBRATION_BATCH_SIZE, ExpandedSampleDataset, SampleDataset, ProcessedSampleDataset
 from ._model import Network
-from ._utils import whitebalance
+from ._utils import PixelSampling, whitebalance
 from .typing import CalibratedDistributions, Loss, Values
 from _const import WandbMode
 from abc import ABC, abstractmethod
@@ -20,7 +20,6 @@ from pytorch_lightning.callbacks import Callback
 from pytorch_lightning.callbacks.early_stopping import EarlyStopping
 from pytorch_lightning.callbacks import LearningRateMonitor
 from pytorch_lightning.loggers.wandb import WandbLogger
-from tempfile import TemporaryDirectory
 from torch import FloatTensor, UntypedStorage, Tensor
 from torch.nn import CrossEntropyLoss, ModuleDict, MSELoss
 from torch.optim import SGD
@@ -28,7 +27,7 @@ from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.utils.data import DataLoader, random_split, TensorDataset
 from torchmetrics import Accuracy, F1Score, JaccardIndex, MeanAbsoluteError, MeanAbsolutePercentageError, MeanSquaredError, MetricCollection, Precision, Recall, SymmetricMeanAbsolutePercentageError, WeightedMeanAbsolutePercentageError
 from tqdm import tqdm
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+from typing import Any, Dict, Final, Iterable, List, Optional, Tuple, Type
 from dist2dist._utils import _check_if_artificial_pmfs_exists, _load_artificial_pmfs_from_cache
 
 
@@ -37,6 +36,9 @@ from wandb.wandb_run import Run
 import wandb
 
 
+DEFAULT_CACHE_DIRNAME: Final[str] = ".processed-samples-cache"
+
+
 class DataCheckpointAction(Enum):
     CREATE = auto()
     USE = auto()
@@ -72,31 +74,34 @@ def data_checkpoint(root_dir: str, label: str):
 
 
 class DataModule(LightningDataModule):
-    def __init__(self, *, batch_size: int, dataset_root_dir: str, fit_train_samples_base_dirs: Iterable[str], fit_val_samples_base_dirs: Iterable[str] , num_augmented_samples: int, sample_dataset_class: Type[SampleDataset], processed_sample_dataset_class: Type[ProcessedSampleDataset], reduction_level: float, test_samples_base_dirs: Iterable[str], use_expanded_set: bool, use_artificial_data: bool, val_proportion: float, **_: Any) -> None:
+    def __init__(self, *, batch_size: int, dataset_root_dir: str, augmentation_seed: Optional[int] = None, cache_dir: Optional[str] = None, fit_train_samples_base_dirs: Iterable[str], fit_val_samples_base_dirs: Iterable[str] , num_augmented_samples: int, pixel_sampling: Optional[PixelSampling] = None, sample_dataset_class: Type[SampleDataset], processed_sample_dataset_class: Type[ProcessedSampleDataset], reduction_level: float, store_input_roi_only: bool = False, test_samples_base_dirs: Iterable[str], use_expanded_set: bool, use_artificial_data: bool, val_proportion: float, **_: Any) -> None:
         super().__init__()
         # Keep the input arguments.
         self.batch_size = batch_size
         self.dataset_root_dir = dataset_root_dir
+        self.augmentation_seed = augmentation_seed
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(os.path.dirname(os.path.abspath(dataset_root_dir)), DEFAULT_CACHE_DIRNAME)  # Shared by all analytes and sweeps.
         #self.fit_samples_base_dirs = fit_samples_base_dirs
         self.fit_train_samples_base_dirs = fit_train_samples_base_dirs
         self.fit_val_samples_base_dirs = fit_val_samples_base_dirs
         self.num_augmented_samples = num_augmented_samples
+        self.pixel_sampling = pixel_sampling
         self.processed_sample_dataset_class = processed_sample_dataset_class
         self.reduction_level = reduction_level
         self.sample_dataset_class = sample_dataset_class
+        self.store_input_roi_only = store_input_roi_only
         self.test_samples_base_dirs = test_samples_base_dirs
         self.use_expanded_set = use_expanded_set
         self.val_proportion = val_proportion
         self.use_artificial_data = use_artificial_data
         # Set other arguments.
-        self.artifact_name = f'{sample_dataset_class.__name__}-{"Expanded" if use_expanded_set else "NotExpanded"}-AugmentedSamples_{num_augmented_samples}-ReductionLevel_{reduction_level:1.2f}-ValProportion_{val_proportion:1.2f}'
+        self.artifact_name = f'{sample_dataset_class.__name__}-{"Expanded" if use_expanded_set else "NotExpanded"}-AugmentedSamples_{num_augmented_samples}-ReductionLevel_{reduction_level:1.2f}-ValProportion_{val_proportion:1.2f}{"-InputRoiOnly" if store_input_roi_only else ""}{f"-PixelSampling_{pixel_sampling.method}_{pixel_sampling.num_pixels}_{pixel_sampling.seed}" if pixel_sampling is not None else ""}'
         self.pca_stats_filepath = os.path.join(dataset_root_dir, "PcaStats.npz")
 
     def _compute_pca_stats(self, subset: ProcessedSampleDataset) -> Dict[str, np.ndarray]:
         labs = np.empty((3, len(subset)), dtype=np.float32)
         for index, item in enumerate(tqdm(iter(subset), total=len(subset), desc="Computing PCA statistics", leave=False)):
-            analyte_msk = item.sample_analyte_mask
-            lab = whitebalance(item.sample_lab_image[analyte_msk], item.sample_lab_white)
+            lab = whitebalance(item.sample_analyte_lab_pixels, item.sample_lab_white)
             labs[:, index] = lab.sum(axis=0)
         mean = labs.mean(axis=1, keepdims=True)
         eigenvalues, eigenvectors = np.linalg.eig(np.cov(labs - mean, rowvar=True))
@@ -122,23 +127,28 @@ class DataModule(LightningDataModule):
         expected_value = FloatTensor(UntypedStorage.from_file(os.path.join(self.dataset_root_dir, f'{split}-expected_value.bin'), shared=True, nbytes=(nbytes_float32 * num_samples)))
         return TensorDataset(calibrated_pmf, expected_value)
 
-    def _write_ready_to_use_subset(self, split: str, subset: ProcessedSampleDataset) -> None:
+    def _write_ready_to_use_subset(self, split: str, subset: ProcessedSampleDataset, input_roi: Optional[Tuple[Tuple[int, int], ...]] = None) -> None:
+        # Store only the input ROI of the calibrated PMFs, if it is given. The pre-processing of the networks skips the cropping of such inputs.
         num_samples = len(subset)
         if num_samples > 0:
             nbytes_float32 = torch.finfo(torch.float32).bits // 8
-            calibrated_pmf_shape = tuple(subset[0].calibrated_pmf.shape)
+            calibrated_pmf_shape = tuple(subset.calibrated_pmfs([0], roi=input_roi)[0].shape)
             calibrated_pmf = FloatTensor(UntypedStorage.from_file(os.path.join(self.dataset_root_dir, f'{split}-calibrated_pmf.bin'), shared=True, nbytes=int((np.prod(calibrated_pmf_shape).item() * nbytes_float32 * num_samples)))).view(num_samples, *calibrated_pmf_shape)
             expected_value = FloatTensor(UntypedStorage.from_file(os.path.join(self.dataset_root_dir, f'{split}-expected_value.bin'), shared=True, nbytes=(nbytes_float32 * num_samples)))
-            for index, item in enumerate(tqdm(iter(subset), total=len(subset), desc=f'Writing "{split}" split to disk', leave=False)):
-                calibrated_pmf[index, ...] = torch.as_tensor(item.calibrated_pmf, dtype=torch.float32)
-                assert item.sample["correctedTheoreticalValue"] is not None
-                expected_value[index] = item.sample["correctedTheoreticalValue"]
+            # Calibrate the samples in batches, so samples sharing the same blank reuse its spectrum.
+            for begin in tqdm(range(0, num_samples, CALIBRATION_BATCH_SIZE), desc=f'Writing "{split}" split to disk', leave=False):
+                indices = range(begin, min(begin + CALIBRATION_BATCH_SIZE, num_samples))
+                calibrated_pmf[begin:begin + len(indices), ...] = torch.as_tensor(np.stack(subset.calibrated_pmfs(indices, roi=input_roi)), dtype=torch.float32)
+                for index in indices:
+                    item = subset[index]
+                    assert item.sample["correctedTheoreticalValue"] is not None
+                    expected_value[index] = item.sample["correctedTheoreticalValue"]
         else:
             calibrated_pmf_shape = tuple()
             calibrated_pmf = FloatTensor(UntypedStorage.from_file(os.path.join(self.dataset_root_dir, f'{split}-calibrated_pmf.bin'), shared=True, nbytes=0))
             expected_value = FloatTensor(UntypedStorage.from_file(os.path.join(self.dataset_root_dir, f'{split}-expected_value.bin'), shared=True, nbytes=0))
         with open(os.path.join(self.dataset_root_dir, f'{split}-processed_samples.json'), "w") as fout:
-            json.dump({"num_samples": num_samples, "calibrated_pmf_shape": calibrated_pmf_shape}, fout)
+            json.dump({"num_samples": num_samples, "calibrated_pmf_shape": calibrated_pmf_shape, "input_roi": input_roi}, fout)
 
     def data_parameters(self) -> Dict[str, Any]:
         return dict(np.load(os.path.join(self.dataset_root_dir, "DataParameters.npz")))
@@ -170,42 +180,40 @@ class DataModule(LightningDataModule):
                     if self.use_expanded_set:
                         train_subset = ExpandedSampleDataset(train_subset)
                     test_subset = self.sample_dataset_class(self.test_samples_base_dirs, skip_blank_samples=True, skip_incomplete_samples=True, skip_inference_sample=True, skip_training_sample=False)
+                    # The processed artifacts are kept in a persistent cache whose keys depend on the image content and the processing parameters, so only new work is done.
                     # ... compute and write PCA statistics, ...
-                    with TemporaryDirectory(dir=self.dataset_root_dir, prefix=".cache-pca_stats-") as tmpdir:
-                        processed_subset = self.processed_sample_dataset_class(train_subset, cache_dir=tmpdir, num_augmented_samples=self.num_augmented_samples, lab_mean=np.zeros((3,), dtype=np.float32), lab_sorted_eigenvectors=np.eye(3, dtype=np.float32))
-                        pca_stats = self._compute_pca_stats(processed_subset)
-                        np.savez_compressed(self.pca_stats_filepath, **pca_stats)
+                    processed_subset = self.processed_sample_dataset_class(train_subset, cache_dir=self.cache_dir, analyte_lab_only=True, augmentation_seed=self.augmentation_seed, num_augmented_samples=self.num_augmented_samples, lab_mean=np.zeros((3,), dtype=np.float32), lab_sorted_eigenvectors=np.eye(3, dtype=np.float32))
+                    pca_stats = self._compute_pca_stats(processed_subset)
+                    np.savez_compressed(self.pca_stats_filepath, **pca_stats)
                     # ... and compute and write processed data as stored tensors.
-                    with TemporaryDirectory(dir=self.dataset_root_dir, prefix=".cache-train-") as tmpdir:
-                        processed_subset = self.processed_sample_dataset_class(train_subset, cache_dir=tmpdir, num_augmented_samples=self.num_augmented_samples, **pca_stats)
-                        self._write_ready_to_use_subset("train", processed_subset)
-                        training_stats = processed_subset.compute_true_value_statistics()
-                        input_roi, input_range = processed_subset.compute_calibrated_pmf_roi(self.reduction_level)
-                        np.savez_compressed(os.path.join(self.dataset_root_dir, "DataParameters.npz"), input_range=input_range, input_roi=input_roi, training_mad=training_stats["mad"], training_median=training_stats["median"])
-                        with open(os.path.join(self.dataset_root_dir, "train-samples.json"), "w") as fout:
-                            json.dump({
-                                "use_expanded_set": self.use_expanded_set,
-                                "num_augmented_samples": self.num_augmented_samples,
-                                "original_samples": list(sorted([os.path.splitext(os.path.basename(item["fileName"]))[0] for item in train_subset])),
-                            }, fout)
-                    with TemporaryDirectory(dir=self.dataset_root_dir, prefix=".cache-val-") as tmpdir:
-                        processed_subset = self.processed_sample_dataset_class(val_subset, cache_dir=tmpdir, num_augmented_samples=0, **pca_stats)
-                        self._write_ready_to_use_subset("val", processed_subset)
-                        with open(os.path.join(self.dataset_root_dir, "val-samples.json"), "w") as fout:
-                            json.dump({
-                                "use_expanded_set": False,
-                                "num_augmented_samples": 0,
-                                "original_samples": list(sorted([os.path.splitext(os.path.basename(item["fileName"]))[0] for item in val_subset])),
-                            }, fout)
-                    with TemporaryDirectory(dir=self.dataset_root_dir, prefix=".cache-test-") as tmpdir:
-                        processed_subset = self.processed_sample_dataset_class(test_subset, cache_dir=tmpdir, num_augmented_samples=0, **pca_stats)
-                        self._write_ready_to_use_subset("test", processed_subset)
-                        with open(os.path.join(self.dataset_root_dir, "test-samples.json"), "w") as fout:
-                            json.dump({
-                                "use_expanded_set": False,
-                                "num_augmented_samples": 0,
-                                "original_samples": list(sorted([os.path.splitext(os.path.basename(item["fileName"]))[0] for item in test_subset])),
-                            }, fout)
+                    processed_subset = self.processed_sample_dataset_class(train_subset, cache_dir=self.cache_dir, analyte_lab_only=True, augmentation_seed=self.augmentation_seed, num_augmented_samples=self.num_augmented_samples, pixel_sampling=self.pixel_sampling, **pca_stats)
+                    training_stats = processed_subset.compute_true_value_statistics()
+                    input_roi, input_range = processed_subset.compute_calibrated_pmf_roi(self.reduction_level)
+                    stored_roi = input_roi if self.store_input_roi_only else None
+                    self._write_ready_to_use_subset("train", processed_subset, stored_roi)
+                    np.savez_compressed(os.path.join(self.dataset_root_dir, "DataParameters.npz"), input_range=input_range, input_roi=input_roi, training_mad=training_stats["mad"], training_median=training_stats["median"])
+                    with open(os.path.join(self.dataset_root_dir, "train-samples.json"), "w") as fout:
+                        json.dump({
+                            "use_expanded_set": self.use_expanded_set,
+                            "num_augmented_samples": self.num_augmented_samples,
+                            "original_samples": list(sorted([os.path.splitext(os.path.basename(item["fileName"]))[0] for item in train_subset])),
+                        }, fout)
+                    processed_subset = self.processed_sample_dataset_class(val_subset, cache_dir=self.cache_dir, analyte_lab_only=True, augmentation_seed=self.augmentation_seed, num_augmented_samples=0, pixel_sampling=self.pixel_sampling, **pca_stats)
+                    self._write_ready_to_use_subset("val", processed_subset, stored_roi)
+                    with open(os.path.join(self.dataset_root_dir, "val-samples.json"), "w") as fout:
+                        json.dump({
+                            "use_expanded_set": False,
+                            "num_augmented_samples": 0,
+                            "original_samples": list(sorted([os.path.splitext(os.path.basename(item["fileName"]))[0] for item in val_subset])),
+                        }, fout)
+                    processed_subset = self.processed_sample_dataset_class(test_subset, cache_dir=self.cache_dir, analyte_lab_only=True, augmentation_seed=self.augmentation_seed, num_augmented_samples=0, pixel_sampling=self.pixel_sampling, **pca_stats)
+                    self._write_ready_to_use_subset("test", processed_subset, stored_roi)
+                    with open(os.path.join(self.dataset_root_dir, "test-samples.json"), "w") as fout:
+                        json.dump({
+                            "use_expanded_set": False,
+                            "num_augmented_samples": 0,
+                            "original_samples": list(sorted([os.path.splitext(os.path.basename(item["fileName"]))[0] for item in test_subset])),
+                        }, fout)
                     # We have to schedule to upload the artfact.
                     create_artifact = True
             # If data is available them do nothing.
@@ -493,7 +501,7 @@ def _tracked_run(*, checkpoint_dir: str, gpus: int, model_class: Type[BaseModel]
         if seed is not None:
             pl.seed_everything(seed, workers=True)
         # Setup the data module.
-        datamodule = DataModule(**run.config.as_dict(), **kwargs)
+        datamodule = DataModule(**run.config.as_dict(), augmentation_seed=seed, **kwargs)
         datamodule.prepare_data()
         # Setup the model.
         model = model_class(**run.config.as_dict(), **datamodule.data_parameters(), **kwargs)
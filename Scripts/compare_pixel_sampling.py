@@ -0,0 +1,142 @@
+from argparse import Namespace
+from chemical_analysis import PIXEL_SAMPLING_METHODS, PixelSampling, alkalinity, bgr_to_lab, bisulfite2d, chloride, compute_calibrated_pmf, iron2, iron3, iron_oxid, ph, phosphate, sample_analyte_mask, sulfate
+from chemical_analysis import ProcessedSample, ProcessedSampleDataset, SampleDataset
+from tqdm import tqdm
+from types import ModuleType
+from typing import Any, Dict, Final, List, NamedTuple, Optional, Tuple, Type
+import argparse, csv, os, time
+import numpy as np
+
+
+class AnalyteClasses(NamedTuple):
+    module: ModuleType
+    sample_dataset_class: Type[SampleDataset]
+    processed_sample_dataset_class: Type[ProcessedSampleDataset]
+    pca_stats: Optional[str]  # The default PCA statistics, required by analytes whose PMFs are computed on principal components.
+
+
+ANALYTE_CHOICES: Final[Dict[str, AnalyteClasses]] = {
+    "alkalinity": AnalyteClasses(alkalinity, alkalinity.AlkalinitySampleDataset, alkalinity.ProcessedAlkalinitySampleDataset, None),
+    "bisulfite2d": AnalyteClasses(bisulfite2d, bisulfite2d.Bisulfite2DSampleDataset, bisulfite2d.ProcessedBisulfite2DSampleDataset, bisulfite2d.PCA_STATS),
+    "chloride": AnalyteClasses(chloride, chloride.ChlorideSampleDataset, chloride.ProcessedChlorideSampleDataset, chloride.PCA_STATS),
+    "iron2": AnalyteClasses(iron2, iron2.Iron2SampleDataset, iron2.ProcessedIron2SampleDataset, iron2.PCA_STATS),
+    "iron3": AnalyteClasses(iron3, iron3.Iron3SampleDataset, iron3.ProcessedIron3SampleDataset, iron3.PCA_STATS),
+    "iron_oxid": AnalyteClasses(iron_oxid, iron_oxid.IronOxidSampleDataset, iron_oxid.ProcessedIronOxidSampleDataset, iron_oxid.PCA_STATS),
+    "ph": AnalyteClasses(ph, ph.PhSampleDataset, ph.ProcessedPhSampleDataset, None),
+    "phosphate": AnalyteClasses(phosphate, phosphate.PhosphateSampleDataset, phosphate.ProcessedPhosphateSampleDataset, phosphate.PCA_STATS),
+    "sulfate": AnalyteClasses(sulfate, sulfate.SulfateSampleDataset, sulfate.ProcessedSulfateSampleDataset, None),
+}
+
+# Default values for the comparison.
+DEFAULT_ANALYTE: Final[str] = "chloride"
+DEFAULT_CACHE_DIR: Final[str] = os.path.join(os.path.dirname(__file__), "..", "cache_dir")
+DEFAULT_NUM_PIXELS: Final[List[int]] = [10000, 30000, 100000, 300000]
+DEFAULT_NUM_WORKERS: Final[int] = 0
+DEFAULT_SEED: Final[int] = 0
+
+
+# Compute the earth mover's distance between the marginals of two PMFs, in bins. For 2D PMFs, the sum of the marginal distances is a lower bound of the earth mover's
+# distance with L1 ground distance, so the total variation distance is reported as well.
+def marginal_emd(pmf: np.ndarray, other_pmf: np.ndarray) -> float:
+    distance = 0.0
+    for axis in range(pmf.ndim):
+        other_axes = tuple(other_axis for other_axis in range(pmf.ndim) if other_axis != axis)
+        distance += np.abs(np.cumsum(pmf.sum(axis=other_axes) - other_pmf.sum(axis=other_axes))).sum()
+    return float(distance)
+
+
+def total_variation(pmf: np.ndarray, other_pmf: np.ndarray) -> float:
+    return float(0.5 * np.abs(pmf - other_pmf).sum())
+
+
+# Compute the PMF of an image as the mobile application does with reduced masks: sample the analyte pixels, convert only them to L*a*b*, and count them.
+def compute_pmf(args: Namespace, bgr_img: np.ndarray, analyte_msk: np.ndarray, lab_white: np.ndarray, pixel_sampling: Optional[PixelSampling]) -> Tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    if pixel_sampling is not None:
+        analyte_msk = sample_analyte_mask(analyte_msk, pixel_sampling)
+    lab_pixels = bgr_to_lab(bgr_img[analyte_msk][:, np.newaxis, :])
+    pmf, _ = args.analyte.module.compute_pmf(lab_img=lab_pixels, analyte_msk=np.ones(lab_pixels.shape[:2], dtype=np.bool_), lab_white=lab_white, with_img_to_pmf=False, **args.pca_kwargs)
+    return pmf, time.perf_counter() - start
+
+
+def compute_pmfs(args: Namespace, processed_samples: List[ProcessedSample], pixel_sampling: Optional[PixelSampling]) -> Dict[str, Any]:
+    sample_pmfs: List[np.ndarray] = list()
+    calibrated_pmfs: List[Optional[np.ndarray]] = list()
+    elapsed = 0.0
+    for processed_sample in processed_samples:
+        sample_pmf, seconds = compute_pmf(args, processed_sample.sample_bgr_image, processed_sample.sample_analyte_mask, processed_sample.sample_lab_white, pixel_sampling)
+        sample_pmfs.append(sample_pmf)
+        elapsed += seconds
+        if processed_sample.has_valid_blank:
+            blank_pmf, _ = compute_pmf(args, processed_sample.blank_bgr_image, processed_sample.blank_analyte_mask, processed_sample.blank_lab_white, pixel_sampling)
+            calibrated_pmfs.append(compute_calibrated_pmf(blank_pmf, sample_pmf))
+        else:
+            calibrated_pmfs.append(None)
+    return {"sample_pmfs": sample_pmfs, "calibrated_pmfs": calibrated_pmfs, "elapsed": elapsed}
+
+
+# The main method.
+def main(args: Namespace) -> None:
+    dataset = args.analyte.sample_dataset_class(args.samples_base_dirs, progress_bar=False, verbose=False)
+    # The masks are kept in the persistent cache, and are the same for all pixel samplings.
+    processed_samples = list(args.analyte.processed_sample_dataset_class(dataset, cache_dir=args.cache_dir, num_workers=args.num_workers, **args.pca_kwargs))
+    reference = compute_pmfs(args, processed_samples, None)
+    # Compare the PMFs computed from sampled analyte pixels with the ones computed from all analyte pixels.
+    rows: List[Dict[str, Any]] = list()
+    for method in args.methods:
+        for num_pixels in tqdm(args.num_pixels, desc=f'Sampling pixels by {method}', leave=False):
+            sampled = compute_pmfs(args, processed_samples, PixelSampling(method, num_pixels, args.seed))
+            sample_emds = [marginal_emd(pmf, other_pmf) for pmf, other_pmf in zip(reference["sample_pmfs"], sampled["sample_pmfs"])]
+            sample_tvs = [total_variation(pmf, other_pmf) for pmf, other_pmf in zip(reference["sample_pmfs"], sampled["sample_pmfs"])]
+            calibrated_emds = [marginal_emd(pmf, other_pmf) for pmf, other_pmf in zip(reference["calibrated_pmfs"], sampled["calibrated_pmfs"]) if pmf is not None and other_pmf is not None]
+            rows.append({
+                "method": method,
+                "num_pixels": num_pixels,
+                "sample_emd_mean": float(np.mean(sample_emds)),
+                "sample_emd_p95": float(np.percentile(sample_emds, 95)),
+                "sample_emd_max": float(np.max(sample_emds)),
+                "sample_tv_mean": float(np.mean(sample_tvs)),
+                "sample_tv_max": float(np.max(sample_tvs)),
+                "calibrated_emd_mean": float(np.mean(calibrated_emds)) if len(calibrated_emds) > 0 else float("NaN"),
+                "calibrated_emd_max": float(np.max(calibrated_emds)) if len(calibrated_emds) > 0 else float("NaN"),
+                "seconds_per_image": sampled["elapsed"] / len(processed_samples),
+                "speedup": reference["elapsed"] / sampled["elapsed"],
+            })
+    # Report the distances.
+    print(f'{len(processed_samples)} samples, {reference["elapsed"] / len(processed_samples):.4f}s per image to compute PMFs from all analyte pixels')
+    print(" ".join(f'{key:>19s}' for key in rows[0].keys()))
+    for row in rows:
+        print(" ".join(f'{value:>19s}' if isinstance(value, str) else f'{value:>19d}' if isinstance(value, int) else f'{value:>19.4f}' for value in row.values()))
+    if args.output is not None:
+        with open(args.output, "w", newline="") as fout:
+            writer = csv.DictWriter(fout, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+# Call the main method.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the PMFs computed from sampled analyte pixels with the ones computed from all analyte pixels.")
+    group = parser.add_argument_group("dataset arguments")
+    group.add_argument("--analyte", type=str, choices=sorted(ANALYTE_CHOICES.keys()), default=DEFAULT_ANALYTE, help="the analyte whose PMFs are compared")
+    group.add_argument("--samples_base_dirs", metavar="PATHS", nargs="+", required=True, help="list of paths to folders with samples")
+    group.add_argument("--cache_dir", metavar="PATH", type=str, default=DEFAULT_CACHE_DIR, help="path to the persistent cache of processed samples")
+    group.add_argument("--pca_stats", metavar="PATH", type=str, default=None, help="path to the PCA statistics of the analyte, if not the default one")
+    group = parser.add_argument_group("sampling arguments")
+    group.add_argument("--methods", metavar="METHOD", nargs="+", choices=sorted(PIXEL_SAMPLING_METHODS), default=sorted(PIXEL_SAMPLING_METHODS), help="the methods used to sample the analyte pixels")
+    group.add_argument("--num_pixels", metavar="COUNT", type=int, nargs="+", default=DEFAULT_NUM_PIXELS, help="the numbers of analyte pixels sampled to make each PMF")
+    group.add_argument("--seed", metavar="VALUE", type=int, default=DEFAULT_SEED, help="the seed of the random positions of sampled pixels")
+    group = parser.add_argument_group("general arguments")
+    group.add_argument("--num_workers", metavar="COUNT", type=int, default=DEFAULT_NUM_WORKERS, help="the number of processes used to compute the masks")
+    group.add_argument("--output", metavar="PATH", type=str, default=None, help="path to a CSV file where the distances are written")
+    # Parse arguments.
+    args = parser.parse_args()
+    if args.pca_stats is None:
+        args.pca_stats = ANALYTE_CHOICES[args.analyte].pca_stats
+    args.analyte = ANALYTE_CHOICES[args.analyte]
+    args.pca_kwargs = dict()
+    if args.pca_stats is not None:
+        stats = np.load(args.pca_stats)
+        args.pca_kwargs = {"lab_mean": stats["lab_mean"], "lab_sorted_eigenvectors": stats["lab_sorted_eigenvectors"]}
+    # Call the main procedure.
+    main(args)
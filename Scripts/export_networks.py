@@ -0,0 +1,75 @@
+from argparse import Namespace
+from chemical_analysis import EXPORT_FORMATS, export_network, load_exported_network
+from chemical_analysis._mobile import ANALYTE_PIPELINES
+from typing import Any, Callable, Dict, Final, List, Optional
+import argparse, os, time
+import numpy as np
+import torch
+
+
+# Default values for the export.
+DEFAULT_BENCHMARK_BATCH_SIZES: Final[List[int]] = [1, 32]
+DEFAULT_BENCHMARK_ITERATIONS: Final[int] = 0
+DEFAULT_SEED: Final[int] = 0
+
+
+# Measure the mean time of a forward pass on the input, and the output.
+def benchmark(func: Callable[[torch.Tensor], Any], input: torch.Tensor, iterations: int) -> Dict[str, Any]:
+    with torch.no_grad():
+        value, _ = func(input)  # Warm up.
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func(input)
+    return {"value": value.reshape(len(input), -1)[:, 0].numpy(), "seconds": (time.perf_counter() - start) / iterations}
+
+
+# The main method.
+def main(args: Namespace) -> None:
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    rng = np.random.default_rng(args.seed)
+    for analyte in args.analytes:
+        pipeline = ANALYTE_PIPELINES[analyte]
+        if not os.path.isfile(pipeline.network_checkpoint):
+            print(f'{analyte}: checkpoint "{pipeline.network_checkpoint}" not found, skipped')
+            continue
+        # Export the network next to its checkpoint, unless another folder is given.
+        net = pipeline.network_class.load_from_checkpoint(pipeline.network_checkpoint).cpu().eval()
+        path_prefix = os.path.splitext(pipeline.network_checkpoint)[0] if args.output_dir is None else os.path.join(args.output_dir, os.path.splitext(os.path.basename(pipeline.network_checkpoint))[0])
+        for path in export_network(net, path_prefix, args.formats):
+            print(f'{analyte}: wrote "{path}"')
+        if args.benchmark_iterations <= 0:
+            continue
+        # Compare the runtimes on CPU on random ROIs of calibrated PMFs.
+        runtimes: Dict[str, Callable[[torch.Tensor], Any]] = {"checkpoint": net}
+        for format in args.formats:
+            runtimes[format] = load_exported_network(path_prefix, format)
+        roi_shape = tuple(upper - lower + 1 for lower, upper in net.input_roi)
+        for batch_size in args.benchmark_batch_sizes:
+            roi = rng.random((batch_size, *roi_shape), dtype=np.float32)
+            input = torch.as_tensor(roi / roi.sum(axis=tuple(range(1, roi.ndim)), keepdims=True))
+            reference: Optional[np.ndarray] = None
+            for runtime, func in runtimes.items():
+                result = benchmark(func, input, args.benchmark_iterations)
+                reference = result["value"] if reference is None else reference
+                print(f'{analyte}: {runtime:>11s}, batch size {batch_size:>4d}, {1000 * result["seconds"]:9.3f}ms per call, max abs diff {float(np.abs(result["value"] - reference).max()):.3g}')
+
+
+# Call the main method.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the analyte networks to TorchScript and ONNX artifacts that the mobile facade can run without the training stack.")
+    group = parser.add_argument_group("export arguments")
+    group.add_argument("--analytes", metavar="NAME", nargs="+", choices=sorted(ANALYTE_PIPELINES.keys()), default=sorted(ANALYTE_PIPELINES.keys()), help="the analytes whose networks are exported")
+    group.add_argument("--formats", metavar="FORMAT", nargs="+", choices=sorted(EXPORT_FORMATS), default=sorted(EXPORT_FORMATS), help="the formats of the artifacts")
+    group.add_argument("--output_dir", metavar="PATH", type=str, default=None, help="path to the folder where the artifacts are written, if not next to the checkpoints")
+    group = parser.add_argument_group("benchmark arguments")
+    group.add_argument("--benchmark_iterations", metavar="COUNT", type=int, default=DEFAULT_BENCHMARK_ITERATIONS, help="the number of forward passes timed for each runtime, or 0 to skip the benchmark")
+    group.add_argument("--benchmark_batch_sizes", metavar="COUNT", type=int, nargs="+", default=DEFAULT_BENCHMARK_BATCH_SIZES, help="the batch sizes of the timed forward passes")
+    group.add_argument("--num_threads", metavar="COUNT", type=int, default=None, help="the number of threads used by PyTorch on CPU")
+    group.add_argument("--seed", metavar="VALUE", type=int, default=DEFAULT_SEED, help="the seed of the random inputs")
+    # Parse arguments.
+    args = parser.parse_args()
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    # Call the main procedure.
+    main(args)
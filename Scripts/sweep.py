@@ -1,5 +1,5 @@
 from argparse import Namespace
-from chemical_analysis import alkalinity, chloride, phosphate, sulfate, iron_oxid, iron3, iron2, bisulfite2d, ph, sweep, ContinuousNetwork, IntervalNetwork, Network
+from chemical_analysis import PIXEL_SAMPLING_METHODS, PixelSampling, alkalinity, chloride, phosphate, sulfate, iron_oxid, iron3, iron2, bisulfite2d, ph, sweep, ContinuousNetwork, IntervalNetwork, Network
 from chemical_analysis.sweep import DataModule, ContinuousModel, IntervalModel, ProcessedSampleDataset, SampleDataset
 from typing import Dict, Final, List, NamedTuple, Optional, Tuple, Type
 import argparse, inspect, os
@@ -131,6 +131,9 @@ DEFAULT_TEST_SAMPLES_BASE_DIRS: Final[Dict[str, List[str]]] = {
     # ],
 }
 DEFAULT_USE_EXPANDED_SET: Final[bool] = False
+DEFAULT_STORE_INPUT_ROI_ONLY: Final[bool] = True
+DEFAULT_PIXEL_SAMPLING_METHOD: Final[Optional[str]] = None  # None stands for all analyte pixels.
+DEFAULT_PIXEL_SAMPLING_NUM_PIXELS: Final[int] = 100000
 DEFAULT_NUM_AUGMENTED_SAMPLES: Final[int] = 0
 DEFAULT_REDUCTION_LEVEL: Final[Dict[str, float]] = {
     AnalyteName.ALKALINITY: 0.05,
@@ -181,13 +184,16 @@ def main(args: Namespace) -> None:
             seed=args.seed,
             # Dataset arguments.
             dataset_root_dir=args.dataset_root_dir,
+            cache_dir=args.cache_dir,
             #fit_samples_base_dirs=args.fit_samples_base_dirs,
             fit_train_samples_base_dirs=args.fit_train_samples_base_dirs,
             fit_val_samples_base_dirs=args.fit_val_samples_base_dirs,
             num_augmented_samples=args.num_augmented_samples,
+            pixel_sampling=args.pixel_sampling,
             processed_sample_dataset_class=args.net.processed_sample_dataset_class,
             reduction_level=args.reduction_level,
             sample_dataset_class=args.net.sample_dataset_class,
+            store_input_roi_only=args.store_input_roi_only,
             test_samples_base_dirs=args.test_samples_base_dirs,
             use_expanded_set=args.use_expanded_set,
             val_proportion=args.val_proportion,
@@ -218,13 +224,16 @@ def main(args: Namespace) -> None:
             seed=args.seed,
             # Dataset arguments.
             dataset_root_dir=args.dataset_root_dir,
+            cache_dir=args.cache_dir,
             #fit_samples_base_dirs=args.fit_samples_base_dirs,
             fit_train_samples_base_dirs=args.fit_train_samples_base_dirs,
             fit_val_samples_base_dirs=args.fit_val_samples_base_dirs,
             num_augmented_samples=args.num_augmented_samples,
+            pixel_sampling=args.pixel_sampling,
             processed_sample_dataset_class=args.net.processed_sample_dataset_class,
             reduction_level=args.reduction_level,
             sample_dataset_class=args.net.sample_dataset_class,
+            store_input_roi_only=args.store_input_roi_only,
             test_samples_base_dirs=args.test_samples_base_dirs,
             use_expanded_set=args.use_expanded_set,
             val_proportion=args.val_proportion,
@@ -253,6 +262,7 @@ if __name__ == "__main__":
     group.add_argument("--fit_val_samples_base_dirs", metavar="PATHS", nargs="+", default=[], help="list of paths to folders with fit samples")
     group.add_argument("--test_samples_base_dirs", metavar="PATHS", nargs="+", default=[], help="list of paths to folders with fit samples")
     group.add_argument("--dataset_root_dir", metavar="PATH", type=str, help="path to the root dir where the dataset will be creates")
+    group.add_argument("--cache_dir", metavar="PATH", type=str, default=None, help="path to the persistent cache of processed samples shared by all analytes and sweeps")
     switch = group.add_mutually_exclusive_group()
     switch.add_argument("--use_expanded_set", dest="use_expanded_set", action="store_true")
     switch.add_argument("--dont_use_expanded_set", dest="use_expanded_set", action="store_false")
@@ -260,6 +270,12 @@ if __name__ == "__main__":
     group.add_argument("--num_augmented_samples", metavar="VALUE", type=int, default=DEFAULT_NUM_AUGMENTED_SAMPLES, help="number of augmented samples to be generated")
     group.add_argument("--reduction_level", metavar="VALUE", type=float, choices=sorted(DEFAULT_REDUCTION_LEVEL.keys()), default=None, help="amount of less frequent calibrated a*b* samples that will be removed from the input distribution, VALUE in [0, 1]")
     group.add_argument("--val_proportion", metavar="VALUE", type=float, default=DEFAULT_VAL_PROPORTION, help="amount of dataset entries used as validation, VALUE in [0, 1]")
+    switch = group.add_mutually_exclusive_group()
+    switch.add_argument("--store_input_roi_only", dest="store_input_roi_only", action="store_true", help="store only the input ROI of the calibrated PMFs in the ready-to-use dataset")
+    switch.add_argument("--store_full_calibrated_pmf", dest="store_input_roi_only", action="store_false", help="store the whole calibrated PMFs in the ready-to-use dataset")
+    switch.set_defaults(store_input_roi_only=DEFAULT_STORE_INPUT_ROI_ONLY)
+    group.add_argument("--pixel_sampling_method", metavar="METHOD", type=str, choices=sorted(PIXEL_SAMPLING_METHODS), default=DEFAULT_PIXEL_SAMPLING_METHOD, help="the method used to sample the analyte pixels that make the PMFs, or all pixels if not given")
+    group.add_argument("--pixel_sampling_num_pixels", metavar="COUNT", type=int, default=DEFAULT_PIXEL_SAMPLING_NUM_PIXELS, help="the number of analyte pixels sampled to make each PMF")
     # Set general arguments.
     group = parser.add_argument_group("general arguments")
     group.add_argument("--checkpoint_dir", metavar="PATH", type=str, default=DEFAULT_CHECKPOINT_DIR, help="the path to the model checkpoint folder")
@@ -285,5 +301,8 @@ if __name__ == "__main__":
         args.dataset_root_dir = os.path.join(os.path.dirname(__file__), "dataset", args.net.analyte)
     if args.reduction_level is None:
         args.reduction_level = DEFAULT_REDUCTION_LEVEL[args.net.analyte]
+    args.pixel_sampling = PixelSampling(args.pixel_sampling_method, args.pixel_sampling_num_pixels) if args.pixel_sampling_method is not None else None
+    if args.allow_dist2dist_pmfs:
+        args.store_input_roi_only = False  # Artificial PMFs are generated from whole calibrated PMFs.
     # Call the main procedure.
     main(args)